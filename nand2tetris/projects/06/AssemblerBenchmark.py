@@ -0,0 +1,37 @@
+import sys,io,time,argparse
+import HackAssembler
+
+# Times the assembler implementations against each other on the given .asm
+# files and checks that they produce identical output.
+
+def timeAssembler(assemble, asmfilename, repeat):
+	best = None
+	for _ in range(repeat):
+		out = io.StringIO()
+		start = time.perf_counter()
+		assemble(asmfilename, out)
+		elapsed = time.perf_counter() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return (best, out.getvalue())
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description='Hack assembler benchmark')
+	argparser.add_argument('asmfiles', nargs='*', default=['pong/Pong.asm'],
+		help='Hack assembly (.asm) files (default: pong/Pong.asm)')
+	argparser.add_argument('--repeat', type=int, default=5,
+		help='runs per file; the best time is reported (default: 5)')
+	args = argparser.parse_args()
+
+	mismatch = False
+	print('{:<30}{:>12}{:>12}{:>9}'.format('file', 'two-pass', 'one-pass', 'speedup'))
+	for asmfilename in args.asmfiles:
+		(twoPass, expected) = timeAssembler(HackAssembler.assembleTwoPass, asmfilename, args.repeat)
+		(onePass, actual) = timeAssembler(HackAssembler.assembleOnePass, asmfilename, args.repeat)
+		print('{:<30}{:>10.1f}ms{:>10.1f}ms{:>8.2f}x'.format(asmfilename,
+			twoPass * 1000, onePass * 1000, twoPass / onePass))
+		if actual != expected:
+			print('ERROR: one-pass output differs for ' + asmfilename)
+			mismatch = True
+
+	sys.exit(1 if mismatch else 0)
@@ -0,0 +1,160 @@
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import argparse
+
+# The assembler sources. Their contents make up the assembler version, so any
+# change to the assembler invalidates everything cached by the old one.
+ASSEMBLER_SOURCES = [ 'HackAssembler.py', 'Parser.py', 'Code.py', 'SymbolTable.py', 'Optimizer.py' ]
+
+_version = None
+
+def assemblerVersion():
+	global _version
+	if _version is None:
+		digest = hashlib.sha256()
+		here = os.path.dirname(os.path.abspath(__file__))
+		for name in ASSEMBLER_SOURCES:
+			with open(os.path.join(here, name), 'rb') as f:
+				digest.update(f.read())
+		_version = digest.hexdigest()
+	return _version
+
+class AssemblerCache:
+
+	DEFAULT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'hackasm')
+	DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+	STATS = [ 'hits', 'misses', 'seconds_saved', 'evictions' ]
+
+	# Cached outputs are stored as files named by their key. An SQLite index
+	# next to them records the size, word count, assembly time and last use
+	# of each entry, plus running statistics, and is safe to share between
+	# the processes of a batch build.
+	def __init__(self, directory=None, maxSize=None):
+		self._dir = directory or os.environ.get('HACKASM_CACHE') or AssemblerCache.DEFAULT_DIR
+		self._maxSize = AssemblerCache.DEFAULT_MAX_SIZE if maxSize is None else maxSize
+		os.makedirs(self._dir, exist_ok=True)
+
+		self._db = sqlite3.connect(os.path.join(self._dir, 'index.sqlite'), timeout=60)
+		with self._db:
+			self._db.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, '
+				'size INTEGER, nwords INTEGER, seconds REAL, lastUsed REAL)')
+			self._db.execute('CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value REAL)')
+			self._db.executemany('INSERT OR IGNORE INTO stats VALUES (?, 0)',
+				[ (name,) for name in AssemblerCache.STATS ])
+
+	# Key for the output of the current assembler on this source and format
+	def key(self, source, format):
+		digest = hashlib.sha256()
+		digest.update('{}\0{}\0'.format(assemblerVersion(), format).encode())
+		digest.update(source)
+		return digest.hexdigest()
+
+	def _path(self, key):
+		return os.path.join(self._dir, key)
+
+	def _count(self, name, amount=1):
+		self._db.execute('UPDATE stats SET value = value + ? WHERE name = ?', (amount, name))
+
+	# Copies the cached output for key to outfilename.
+	# Returns: the number of ROM words, or None on a miss
+	def fetch(self, key, outfilename):
+		with self._db:
+			row = self._db.execute('SELECT nwords, seconds FROM entries WHERE key = ?',
+				(key,)).fetchone()
+			if row is not None:
+				try:
+					shutil.copyfile(self._path(key), outfilename)
+				except FileNotFoundError:
+					# Entry file went missing. Forget it.
+					self._db.execute('DELETE FROM entries WHERE key = ?', (key,))
+					row = None
+			if row is None:
+				self._count('misses')
+				return None
+
+			(nwords, seconds) = row
+			self._db.execute('UPDATE entries SET lastUsed = ? WHERE key = ?', (time.time(), key))
+			self._count('hits')
+			self._count('seconds_saved', seconds)
+			return nwords
+
+	# Adds the freshly assembled outfilename to the cache under key, then
+	# evicts least recently used entries if the cache is over its size cap.
+	def store(self, key, outfilename, nwords, seconds):
+		tmpname = self._path('{}.{}.tmp'.format(key, os.getpid()))
+		shutil.copyfile(outfilename, tmpname)
+		os.replace(tmpname, self._path(key))
+		with self._db:
+			self._db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+				(key, os.path.getsize(outfilename), nwords, seconds, time.time()))
+		self.evict()
+
+	# Removes least recently used entries until the cache holds at most
+	# maxSize bytes (default: the cap the cache was opened with).
+	# Returns: (entries removed, bytes freed)
+	def evict(self, maxSize=None):
+		if maxSize is None:
+			maxSize = self._maxSize
+		removed = freed = 0
+		with self._db:
+			total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+			if total <= maxSize:
+				return (0, 0)
+			for (key, size) in self._db.execute(
+					'SELECT key, size FROM entries ORDER BY lastUsed').fetchall():
+				if total <= maxSize:
+					break
+				try:
+					os.remove(self._path(key))
+				except FileNotFoundError:
+					pass
+				self._db.execute('DELETE FROM entries WHERE key = ?', (key,))
+				total -= size
+				removed += 1
+				freed += size
+			self._count('evictions', removed)
+		return (removed, freed)
+
+	# Returns: dict of the running statistics plus the current entry count
+	# and size
+	def stats(self):
+		stats = dict(self._db.execute('SELECT name, value FROM stats').fetchall())
+		(stats['entries'], stats['size']) = self._db.execute(
+			'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+		return stats
+
+	def close(self):
+		self._db.close()
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description='Hack assembler cache maintenance')
+	argparser.add_argument('command', choices=['stats', 'evict', 'clear'],
+		help='stats: show hit/miss statistics; evict: shrink to --max-size; clear: remove all entries')
+	argparser.add_argument('--cache-dir', default=None,
+		help='assembler cache directory (default: $HACKASM_CACHE or ~/.cache/hackasm)')
+	argparser.add_argument('--max-size', type=int, default=AssemblerCache.DEFAULT_MAX_SIZE,
+		help='size cap in bytes for evict (default: {})'.format(AssemblerCache.DEFAULT_MAX_SIZE))
+	args = argparser.parse_args()
+
+	cache = AssemblerCache(args.cache_dir)
+	if args.command == 'evict':
+		(removed, freed) = cache.evict(args.max_size)
+		print('Evicted {} entries ({} bytes)'.format(removed, freed))
+	elif args.command == 'clear':
+		(removed, freed) = cache.evict(0)
+		print('Removed {} entries ({} bytes)'.format(removed, freed))
+	else:
+		stats = cache.stats()
+		lookups = stats['hits'] + stats['misses']
+		print('entries:       {}'.format(stats['entries']))
+		print('size:          {} bytes'.format(stats['size']))
+		print('hits:          {:.0f}'.format(stats['hits']))
+		print('misses:        {:.0f}'.format(stats['misses']))
+		print('hit rate:      {:.1%}'.format(stats['hits'] / lookups if lookups else 0))
+		print('time saved:    {:.3f}s'.format(stats['seconds_saved']))
+		print('evictions:     {:.0f}'.format(stats['evictions']))
+	cache.close()
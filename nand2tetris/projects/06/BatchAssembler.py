@@ -0,0 +1,85 @@
+import sys,os,glob,time,argparse
+from concurrent.futures import ProcessPoolExecutor
+import HackAssembler
+from AssemblerCache import AssemblerCache
+
+# Assembles many .asm files in one run, spread across a pool of worker
+# processes, so interpreter startup is paid once per worker rather than once
+# per file. Each worker builds the predefined symbol table once and copies it
+# for every file it assembles.
+
+# Expands the command line arguments (directories, globs or files) into a
+# sorted list of .asm files without duplicates.
+def findAsmFiles(args):
+	asmfiles = set()
+	for arg in args:
+		if os.path.isdir(arg):
+			with os.scandir(arg) as it:
+				for entry in it:
+					if entry.name.endswith('.asm') and entry.is_file():
+						asmfiles.add(os.path.join(arg, entry.name))
+		else:
+			matches = glob.glob(arg) or [arg]
+			asmfiles.update(m for m in matches if m.endswith('.asm'))
+	return sorted(asmfiles)
+
+# Each worker's connection to the assembler cache, if caching
+_cache = None
+
+# Worker process setup: build the predefined symbols once and open the cache
+def initWorker(useCache, cacheDir):
+	global _cache
+	HackAssembler.predefinedSymbols()
+	if useCache:
+		_cache = AssemblerCache(cacheDir)
+
+# Assembles one file in a worker.
+# Returns: (asmfilename, number of words, seconds, error message or None)
+def assembleOne(asmfilename, format, optimize=False):
+	start = time.perf_counter()
+	try:
+		nwords = HackAssembler.assembleFile(asmfilename, format, _cache, optimize)
+		error = None
+	except Exception as e:
+		nwords = 0
+		error = '{}: {}'.format(type(e).__name__, e)
+	return (asmfilename, nwords, time.perf_counter() - start, error)
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description='Batch Hack assembler')
+	argparser.add_argument('paths', nargs='+',
+		help='.asm files, directories of .asm files, or glob patterns')
+	argparser.add_argument('--format', choices=['hack', 'bin'], default='hack',
+		help='hack: text .hack files (default); bin: little-endian uint16 .bin images')
+	argparser.add_argument('--jobs', '-j', type=int, default=None,
+		help='number of worker processes (default: one per CPU)')
+	argparser.add_argument('--cache', action='store_true',
+		help='reuse output from the assembler cache when a source is unchanged')
+	argparser.add_argument('--cache-dir', default=None,
+		help='assembler cache directory (default: $HACKASM_CACHE or ~/.cache/hackasm)')
+	argparser.add_argument('--optimize', '-O', action='store_true',
+		help='run the peephole optimizer on every file')
+	args = argparser.parse_args()
+
+	asmfiles = findAsmFiles(args.paths)
+	if not asmfiles:
+		print('No .asm files found')
+		sys.exit(1)
+
+	start = time.perf_counter()
+	failures = 0
+	with ProcessPoolExecutor(max_workers=args.jobs, initializer=initWorker,
+			initargs=(args.cache, args.cache_dir)) as pool:
+		results = pool.map(assembleOne, asmfiles, [args.format] * len(asmfiles),
+			[args.optimize] * len(asmfiles))
+		for (asmfilename, nwords, elapsed, error) in results:
+			if error:
+				failures += 1
+				print('FAILED  {:<40}{}'.format(asmfilename, error))
+			else:
+				print('ok      {:<40}{:>7} words{:>10.1f}ms'.format(asmfilename,
+					nwords, elapsed * 1000))
+
+	print('{} files, {} failed, {:.1f}ms total'.format(len(asmfiles), failures,
+		(time.perf_counter() - start) * 1000))
+	sys.exit(1 if failures else 0)
@@ -0,0 +1,222 @@
+import sys,time,argparse
+import numpy as np
+from array import array
+from CPUEmulator import CPUEmulator, readRom, isHaltLoop, RAM_SIZE, ROM_SIZE, ADDRESS_MASK, JGT, JEQ, JLT, JMP
+
+# Runs one Hack program on many machines at once, in lockstep. A, D and PC
+# are NumPy vectors with one element per machine and RAM is an N x 32K
+# matrix. Each step sorts the running machines by PC and executes each
+# distinct instruction once, as array operations over the group of machines
+# at that PC, so the Python overhead per step depends on how far the machines
+# have diverged rather than on how many there are.
+#
+# As in CPUEmulator, M is the RAM word at the low 15 bits of A, so
+# addresses of 32K and above wrap around onto the machine's 32K words.
+#
+# Registers and RAM are uint16, so the ALU wraps for free; a signed view of
+# the output gives the jump conditions. A machine stops at an
+# "(END) @END 0;JMP" loop or on running off the end of the ROM.
+
+class BatchEmulator:
+
+	def __init__(self, machines, rom=None):
+		self.machines = machines
+		self.ram = np.zeros((machines, RAM_SIZE), dtype=np.uint16)
+		self.loadRom(rom or [])
+
+	# Loads a program from a .hack, .bin or .asm file
+	def load(self, filename):
+		self.loadRom(readRom(filename))
+
+	def loadRom(self, rom):
+		if len(rom) > ROM_SIZE:
+			raise ValueError('Program has {} words; ROM holds {}'.format(len(rom), ROM_SIZE))
+		self.rom = list(rom)
+		self._halts = set(pc for pc in range(len(self.rom)) if isHaltLoop(self.rom, pc))
+		self.reset()
+
+	# Resets every machine. RAM is left alone, like the reset button.
+	def reset(self):
+		n = self.machines
+		self.A = np.zeros(n, dtype=np.uint16)
+		self.D = np.zeros(n, dtype=np.uint16)
+		self.PC = np.zeros(n, dtype=np.int64)
+		self.cycles = np.zeros(n, dtype=np.int64)
+		self.halted = np.zeros(n, dtype=bool)
+
+	# Signed RAM[address] of every machine
+	def peek(self, address):
+		return self.ram[:, address].view(np.int16)
+
+	# Sets RAM[address] of every machine to value, which may be one number
+	# or one per machine
+	def poke(self, address, value):
+		self.ram[:, address] = np.asarray(value, dtype=np.int64) & 65535
+
+	# Executes one instruction on the machines idx, all at the given pc.
+	# Returns: the new PC of each, or None if they have halted
+	def _execute(self, pc, idx):
+		word = self.rom[pc]
+		if word & 0x8000 == 0:
+			self.A[idx] = word
+			return pc + 1
+		if pc in self._halts:
+			return None
+
+		a = self.A[idx]
+		d = self.D[idx]
+		x = d
+		y = self.ram[idx, a & ADDRESS_MASK] if word & 0x1000 else a
+		if word & 0x0800: x = np.zeros_like(x)
+		if word & 0x0400: x = ~x
+		if word & 0x0200: y = np.zeros_like(y)
+		if word & 0x0100: y = ~y
+		out = x + y if word & 0x0080 else x & y
+		if word & 0x0040: out = ~out
+
+		# M at the old A, then A and D
+		if word & 0x0008:
+			self.ram[idx, a & ADDRESS_MASK] = out
+		if word & 0x0020:
+			self.A[idx] = a = out
+		if word & 0x0010:
+			self.D[idx] = out
+
+		jump = word & 7
+		if jump == 0:
+			return pc + 1
+		if jump == JMP:
+			return a.astype(np.int64)
+		signed = out.view(np.int16)
+		taken = np.zeros(len(idx), dtype=bool)
+		if jump & JLT: taken |= signed < 0
+		if jump & JEQ: taken |= signed == 0
+		if jump & JGT: taken |= signed > 0
+		return np.where(taken, a.astype(np.int64), pc + 1)
+
+	# Executes up to maxCycles lockstep steps, stopping early once every
+	# machine has halted.
+	# Returns: the number of steps executed
+	def run(self, maxCycles):
+		size = len(self.rom)
+		steps = 0
+		while steps < maxCycles:
+			self.halted |= self.PC >= size
+			running = np.flatnonzero(~self.halted)
+			if len(running) == 0:
+				break
+			steps += 1
+			self.cycles[running] += 1
+
+			# Group the running machines by PC
+			pcs = self.PC[running]
+			first = pcs[0]
+			if (pcs == first).all():
+				groups = [ (int(first), running) ]
+			else:
+				order = np.argsort(pcs, kind='stable')
+				running = running[order]
+				pcs = pcs[order]
+				starts = np.flatnonzero(np.diff(pcs)) + 1
+				groups = [ (int(pcs[idx[0]]), running[idx])
+					for idx in np.split(np.arange(len(running)), starts) ]
+
+			for (pc, idx) in groups:
+				nextPC = self._execute(pc, idx)
+				if nextPC is None:
+					self.halted[idx] = True
+				else:
+					self.PC[idx] = nextPC
+		return steps
+
+# Runs the first count machines of batch again on CPUEmulator, from their
+# RAM before the run (initial), and compares the final states.
+# Returns: the number of machines that differ
+def compareWithCPUEmulator(batch, initial, maxCycles, count):
+	failures = 0
+	for i in range(min(count, batch.machines)):
+		cpu = CPUEmulator(batch.rom)
+		cpu.ram[:] = array('H', initial[i].tolist())
+		cpu.run(maxCycles)
+		state = (cpu.A, cpu.D, cpu.PC, cpu.cycles, list(cpu.ram))
+		expected = (int(batch.A[i]), int(batch.D[i]), int(batch.PC[i]), int(batch.cycles[i]),
+			batch.ram[i].tolist())
+		if state != expected:
+			failures += 1
+			print('ERROR: machine {} differs from CPUEmulator'.format(i))
+	return failures
+
+# Differential test against CPUEmulator: random programs of random words,
+# whose addresses are mostly small so that they read the random RAM the
+# machines start with, and whose ALU results, stored in A, reach all over
+# the address space, including the addresses of 32K and above that wrap.
+# Returns: the number of programs on which some machine differs
+def selfTest(programs, machines, maxCycles, rng):
+	failures = 0
+	for _ in range(programs):
+		rom = []
+		for _ in range(rng.integers(1, 65)):
+			if rng.random() < 0.4:
+				rom.append(int(rng.choice([ rng.integers(0, 64), rng.integers(0, 32768) ])))
+			else:
+				rom.append(0xE000 | int(rng.integers(0, 0x2000)))
+		batch = BatchEmulator(machines, rom)
+		batch.ram[:, :64] = rng.integers(0, 65536, (machines, 64))
+		initial = batch.ram.copy()
+		batch.run(maxCycles)
+		if compareWithCPUEmulator(batch, initial, maxCycles, machines):
+			failures += 1
+			print('ERROR: program {} differs'.format(' '.join(str(word) for word in rom)))
+	return failures
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description='Lockstep Hack CPU emulator for many machines')
+	argparser.add_argument('program', nargs='?', help='.hack, .bin or .asm file')
+	argparser.add_argument('--machines', '-n', type=int, default=1000,
+		help='number of machines (default: 1000)')
+	argparser.add_argument('--cycles', type=int, default=1000000,
+		help='maximum steps to execute (default: 1000000)')
+	argparser.add_argument('--set', action='append', default=[], metavar='ADDRESS=VALUE',
+		help='set RAM[ADDRESS] on every machine before running; may be repeated')
+	argparser.add_argument('--random', action='append', default=[], metavar='ADDRESS',
+		type=int, help='set RAM[ADDRESS] to a random value on each machine; may be repeated')
+	argparser.add_argument('--seed', type=int, default=None, help='random seed')
+	argparser.add_argument('--print', action='append', default=[], metavar='ADDRESS',
+		type=int, help='print RAM[ADDRESS] of the first machines after running; may be repeated')
+	argparser.add_argument('--compare', type=int, default=0, metavar='K',
+		help='rerun the first K machines on CPUEmulator and compare final states')
+	argparser.add_argument('--self-test', type=int, default=None, metavar='PROGRAMS',
+		help='instead of running a program, compare PROGRAMS random programs, each on '
+		     'MACHINES machines (default: 1000) with random RAM, against CPUEmulator')
+	args = argparser.parse_args()
+	rng = np.random.default_rng(args.seed)
+
+	if args.self_test is not None:
+		failures = selfTest(args.self_test, args.machines, args.cycles, rng)
+		print('{} of {} random programs differ from CPUEmulator'.format(failures, args.self_test))
+		sys.exit(1 if failures else 0)
+	if args.program is None:
+		argparser.error('a program is needed unless --self-test is given')
+
+	batch = BatchEmulator(args.machines)
+	batch.load(args.program)
+	for assignment in args.set:
+		(address, value) = assignment.split('=')
+		batch.poke(int(address), int(value))
+	for address in args.random:
+		batch.poke(address, rng.integers(-32768, 32768, args.machines))
+	initial = batch.ram[:args.compare].copy()
+
+	start = time.perf_counter()
+	steps = batch.run(args.cycles)
+	elapsed = time.perf_counter() - start
+
+	total = int(batch.cycles.sum())
+	print('{} machines, {} steps, {} instructions in {:.3f}s ({:.2f}M instructions/s), {} halted'.format(
+		args.machines, steps, total, elapsed, total / elapsed / 1e6 if elapsed else 0,
+		int(batch.halted.sum())))
+	for address in args.print:
+		print('RAM[{}] = {}'.format(address, ' '.join(str(v) for v in batch.peek(address)[:10])))
+
+	failures = compareWithCPUEmulator(batch, initial, args.cycles, args.compare)
+	sys.exit(1 if failures else 0)
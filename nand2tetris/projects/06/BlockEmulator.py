@@ -0,0 +1,560 @@
+import sys,time,random,argparse
+from array import array
+from Code import Code
+from CPUEmulator import CPUEmulator, ADDRESS_MASK, HALT, JMP, JGT, JEQ, JLT, DEST_A, DEST_D, DEST_M
+
+# Hack CPU emulator that translates the ROM into Python a basic block at a
+# time. Starting from an entry PC, instructions are translated up to a jump;
+# the jump becomes an early return, and the fall-through path (and the target
+# of an unconditional jump to a known address) is chained into the same
+# function, up to MAX_BLOCK instructions. Each function is compiled once,
+# cached by its entry PC, and returns (D, A, next PC, instructions executed).
+# The plain CPUEmulator steps the program instead where a block cannot be
+# used: at halt loops, on comp codes without a mnemonic, and when fewer
+# cycles remain than the block might execute.
+#
+# A block is not translated an instruction at a time. It is first run
+# symbolically: A, D and each RAM word read become values, which are
+# constants, locals of the generated function, or operations on other
+# values. Only then is Python written, for the values that are stored, tested
+# or returned, so that a register value nothing reads costs nothing, and the
+# stack idioms of the VM translator (@SP AM=M-1 D=M A=A-1 M=D+M, or
+# @x D=M @SP A=M M=D @SP M=M+1) come out as a statement or two. Values are
+# masked to 16 bits only where they are stored or tested, and a jump on a
+# constant, as in "push constant 0, if-goto", is settled as it is translated.
+#
+# RAM below LOW_RAM (SP, LCL, ARG, THIS, THAT, temp and the statics) is read
+# at most once per block and kept in locals; the block writes back the words
+# it changed when it returns. Every other address must then be at least
+# LOW_RAM, or a store there might be one of those words. An address that is
+# a word read from RAM plus a constant, such as SP-1 or THAT+3, is checked
+# once for the block, right after the word is read: if any of the offsets
+# the block uses with it would take it below LOW_RAM or past the end of RAM,
+# the block returns there, and the CPUEmulator steps that instruction.
+# Other addresses are masked and checked where they are used. Once checked,
+# the words at one base are distinct, so a word the block stored there is
+# not read back, and a store there that is overwritten before anything could
+# read it is not made.
+#
+# Once translated, Pong's blocks run at 40-50M instructions/s, 10-15 times
+# as fast as CPUEmulator. Translating them takes about a second, so that
+# from a cold start a run of 50M instructions of pong/Pong.asm is 8-10
+# times as fast as CPUEmulator, while one of 5M is barely faster.
+
+MAX_BLOCK = 256
+
+# RAM words below this address are kept in locals within a block
+LOW_RAM = 256
+
+# Comp code (a-bit and c1..c6) to mnemonic
+_MNEMONIC = { int(bits, 2): mnemonic for (mnemonic, bits) in Code._COMP.items() }
+
+# Python condition on an unsigned ALU output for each conditional jump
+_CONDITION = {
+	JGT: '0 < {} < 32768', JEQ: '{} == 0', JGT | JEQ: '{} < 32768', JLT: '{} >= 32768',
+	JLT | JGT: '{} != 0', JLT | JEQ: '{} == 0 or {} >= 32768',
+}
+
+# The signed value of a 16-bit word, for the offsets of addresses
+def _signed(value):
+	return value - 65536 if value & 32768 else value
+
+# A value in a block: a constant ('const', holding 0 to 65535), a local of
+# the generated function ('local': a RAM word read, or a register the block
+# was called with, both 0 to 65535), or an operation ('+', '-', '&', '|',
+# 'neg' or 'not') on other values. Operations are written unmasked, and so
+# may be any integer congruent to their value mod 65536. Once written to a
+# local, a value is known by its name.
+class _Value:
+
+	def __init__(self, op, args, name=None):
+		self.op = op
+		self.args = args
+		self.name = name
+		# References to it from the code that must run, set before writing
+		self.uses = 0
+		# For a local: the offsets of the RAM addresses it is the base of
+		self.offsets = set()
+
+	# True if the value is always 0 to 65535 as written. A range checked base
+	# plus an offset within those it was checked for is.
+	def masked(self):
+		if self.op in [ 'const', 'local' ]:
+			return True
+		if self.op == '+' and self.args[0].op == 'local' and self.args[1].op == 'const':
+			offsets = self.args[0].offsets
+			return bool(offsets) and min(offsets) <= _signed(self.args[1].args[0]) <= max(offsets)
+		if self.op == '&':
+			return self.args[0].masked() or self.args[1].masked()
+		if self.op == '|':
+			return self.args[0].masked() and self.args[1].masked()
+		return False
+
+def _const(value):
+	return _Value('const', (value & 65535,))
+
+# Splits a value into (base, offset), base being None for a constant
+def _linear(value):
+	if value.op == 'const':
+		return (None, _signed(value.args[0]))
+	if value.op == '+' and value.args[1].op == 'const':
+		return (value.args[0], _signed(value.args[1].args[0]))
+	return (value, 0)
+
+def _add(x, y):
+	if x.op == 'const':
+		(x, y) = (y, x)
+	if y.op != 'const':
+		return _Value('+', (x, y))
+	(base, offset) = _linear(x)
+	offset = _signed((offset + y.args[0]) & 65535)
+	if base is None:
+		return _const(offset)
+	if offset == 0:
+		return base
+	return _Value('+', (base, _const(offset)))
+
+def _sub(x, y):
+	if y.op == 'const':
+		return _add(x, _const(-y.args[0]))
+	return _Value('-', (x, y))
+
+def _neg(x):
+	return _const(-x.args[0]) if x.op == 'const' else _Value('neg', (x,))
+
+def _not(x):
+	return _const(~x.args[0]) if x.op == 'const' else _Value('not', (x,))
+
+def _and(x, y):
+	if x.op == 'const' and y.op == 'const':
+		return _const(x.args[0] & y.args[0])
+	return _Value('&', (x, y))
+
+def _or(x, y):
+	if x.op == 'const' and y.op == 'const':
+		return _const(x.args[0] | y.args[0])
+	return _Value('|', (x, y))
+
+_OPERATORS = { '+': _add, '-': _sub, '&': _and, '|': _or }
+_ZERO = _const(0)
+_ONE = _const(1)
+
+# The ALU output for a mnemonic in Code._COMP, given the D, A and M values
+def _alu(mnemonic, d, a, m):
+	if mnemonic == '-1':
+		return _const(65535)
+	operands = { 'D': d, 'A': a, 'M': m, '0': _ZERO, '1': _ONE }
+	if len(mnemonic) == 1:
+		return operands[mnemonic]
+	if len(mnemonic) == 2:
+		x = operands[mnemonic[1]]
+		return _not(x) if mnemonic[0] == '!' else _neg(x)
+	return _OPERATORS[mnemonic[1]](operands[mnemonic[0]], operands[mnemonic[2]])
+
+# The state of a block before an instruction, or after a jump: what an exit
+# there returns and writes back to RAM. pc is None for the address in A.
+class _Exit:
+
+	def __init__(self, a, d, dirty, pc, n):
+		self.a = a
+		self.d = d
+		self.dirty = dict(dirty)
+		self.pc = pc
+		self.n = n
+
+# Translates one block: runs it symbolically, recording what the generated
+# code must do in order as events, then writes the code.
+class _Block:
+
+	def __init__(self, emulator, entry):
+		self._code = emulator._code
+		self._rom = emulator.rom
+		self._entry = entry
+		self._locals = 0
+
+		# ('load', local, address, exit), ('mask', local, value, exit or None),
+		# ('store', address, value) and ('exit', jump, tested value, exit)
+		self._events = []
+
+		# Low RAM words: their current values, those changed, and the values
+		# read from RAM
+		self._known = {}
+		self._dirty = {}
+		self._read = {}
+		# Other RAM words at a base plus an offset, as stored or read, while
+		# no store elsewhere might have changed them
+		self._stack = {}
+		# The events storing to a base plus an offset since the last event
+		# that reads RAM or returns, which a store there makes dead
+		self._unread = {}
+
+		self._a = _Value('local', (), 'a')
+		self._d = _Value('local', (), 'd')
+
+	# Records an event other than a store
+	def _event(self, event):
+		self._events.append(event)
+		self._unread = {}
+
+	def _newLocal(self):
+		self._locals += 1
+		name = 'v{}'.format(self._locals)
+		return _Value('local', (), name)
+
+	# An address for RAM at the value of A: ('const', address),
+	# ('base', local, offset) or ('index', local holding the masked address)
+	def _address(self, a, exit):
+		if a.op == 'const':
+			return ('const', a.args[0] & ADDRESS_MASK)
+		(base, offset) = _linear(a)
+		if base.op == 'local':
+			base.offsets.add(offset)
+			return ('base', base, offset)
+		index = self._newLocal()
+		self._event(('mask', index, a, exit if self._known or self._dirty else None))
+		return ('index', index)
+
+	def _load(self, address, exit):
+		if address[0] == 'const' and address[1] < LOW_RAM:
+			word = address[1]
+			if word not in self._known:
+				value = self._known[word] = self._read[word] = self._newLocal()
+				self._event(('load', value, address, exit))
+			return self._known[word]
+		if address[0] == 'base' and address[1:] in self._stack:
+			return self._stack[address[1:]]
+		value = self._newLocal()
+		self._event(('load', value, address, exit))
+		if address[0] == 'base':
+			self._stack[address[1:]] = value
+		return value
+
+	# Once its base is checked, a base plus an offset is a different word for
+	# each offset, but may be the same as any word at another base or index.
+	def _store(self, address, value):
+		if address[0] == 'const' and address[1] < LOW_RAM:
+			self._known[address[1]] = self._dirty[address[1]] = value
+			return
+		if address[0] == 'base':
+			base = address[1]
+			if address[1:] in self._unread:
+				self._events[self._unread[address[1:]]] = None
+			self._unread[address[1:]] = len(self._events)
+			self._events.append(('store', address, value))
+			self._stack = { key: known for (key, known) in self._stack.items() if key[0] is base }
+			self._stack[address[1:]] = value
+		else:
+			self._events.append(('store', address, value))
+			self._stack = {}
+
+	# Runs the block from the entry symbolically.
+	# Returns: the number of instructions in it
+	def run(self):
+		code = self._code
+		size = len(code)
+		a = self._a
+		d = self._d
+		pc = self._entry
+		n = 0
+		while n < MAX_BLOCK and pc is not None and pc < size:
+			(fn, dest, jump) = code[pc]
+			if jump == HALT:
+				break
+			if fn is None:
+				a = _const(dest)
+				pc += 1
+				n += 1
+				continue
+
+			mnemonic = _MNEMONIC.get((self._rom[pc] >> 6) & 0x7F)
+			if mnemonic is None:
+				break
+			exit = _Exit(a, d, self._dirty, pc, n)
+			address = None
+			if 'M' in mnemonic or dest & DEST_M:
+				address = self._address(a, exit)
+			m = self._load(address, exit) if 'M' in mnemonic else None
+			out = _alu(mnemonic, d, a, m)
+			n += 1
+
+			# M at the old A, then A and D
+			if dest & DEST_M:
+				self._store(address, out)
+			if dest & DEST_A:
+				a = out
+			if dest & DEST_D:
+				d = out
+
+			if jump and out.op == 'const':
+				# A jump on a constant always or never goes
+				value = _signed(out.args[0])
+				taken = ((jump & JLT and value < 0) or (jump & JEQ and value == 0) or
+					(jump & JGT and value > 0))
+				jump = JMP if taken else 0
+			if jump == JMP:
+				# Chain straight on to a known target; otherwise go where A says
+				pc = a.args[0] if a.op == 'const' else None
+			elif jump:
+				target = a.args[0] if a.op == 'const' else None
+				self._event(('exit', jump, out, _Exit(a, d, self._dirty, target, n)))
+				pc += 1
+			else:
+				pc += 1
+
+		self._final = _Exit(a, d, self._dirty, pc, n)
+		return n
+
+	# Counts the references to value and, the first time, to its operands
+	def _use(self, value):
+		value.uses += 1
+		if value.uses == 1 and value.op not in [ 'const', 'local' ]:
+			for arg in value.args:
+				self._use(arg)
+
+	# Python for value. A value used more than once is written to a local the
+	# first time, unless cold is set for code that seldom runs.
+	def _text(self, value, cold=False):
+		if value.name is not None:
+			return value.name
+		op = value.op
+		args = value.args
+		if op == 'const':
+			return str(args[0])
+		if op == 'neg':
+			text = '(-{})'.format(self._text(args[0], cold))
+		elif op == 'not':
+			text = '(~{})'.format(self._text(args[0], cold))
+		elif op == '+' and args[1].op == 'const':
+			offset = _signed(args[1].args[0])
+			text = '({} {} {})'.format(self._text(args[0], cold), '-' if offset < 0 else '+',
+				abs(offset))
+		else:
+			text = '({} {} {})'.format(self._text(args[0], cold), op, self._text(args[1], cold))
+		if value.uses > 1 and not cold:
+			value.name = self._newLocal().name
+			self._lines.append('\t{} = {}'.format(value.name, text))
+			return value.name
+		return text
+
+	# Python for the 16-bit value of value
+	def _word(self, value, cold=False):
+		text = self._text(value, cold)
+		return text if value.masked() else text + ' & 65535'
+
+	def _addressText(self, address):
+		if address[0] == 'const':
+			return str(address[1])
+		if address[0] == 'index':
+			return address[1].name
+		(base, offset) = address[1:]
+		if offset == 0:
+			return base.name
+		return '{} {} {}'.format(base.name, '-' if offset < 0 else '+', abs(offset))
+
+	# Lines that write back the changed low RAM words and return
+	def _exitLines(self, exit, cold):
+		lines = [ 'ram[{}] = {}'.format(word, self._word(value, cold))
+			for (word, value) in sorted(exit.dirty.items()) if value is not self._read.get(word) ]
+		pc = self._word(exit.a, cold) if exit.pc is None else str(exit.pc)
+		lines.append('return ({}, {}, {}, {})'.format(self._word(exit.d, cold),
+			self._word(exit.a, cold), pc, exit.n))
+		return lines
+
+	def _writeIf(self, condition, exit):
+		body = self._exitLines(exit, True)
+		self._lines.append('\tif {}:'.format(condition))
+		self._lines.extend('\t\t' + line for line in body)
+
+	# Checks, once it is read, that a base plus each offset the block uses
+	# with it is an address of RAM at or above LOW_RAM
+	def _writeRangeCheck(self, base, exit):
+		if not base.offsets:
+			return
+		low = LOW_RAM - min(base.offsets)
+		high = ADDRESS_MASK - max(base.offsets)
+		tests = []
+		if low > 0:
+			tests.append('{} < {}'.format(base.name, low))
+		if high < 65535:
+			tests.append('{} > {}'.format(base.name, high))
+		if tests:
+			self._writeIf(' or '.join(tests), exit)
+
+	# Writes and compiles the block.
+	# Returns: the compiled function
+	def compile(self):
+		self._events = [ event for event in self._events if event is not None ]
+		for event in self._events:
+			if event[0] == 'mask':
+				self._use(event[2])
+			elif event[0] == 'store':
+				self._use(event[2])
+			elif event[0] == 'exit':
+				self._use(event[2])
+		for value in self._final.dirty.values():
+			self._use(value)
+		self._use(self._final.d)
+		self._use(self._final.a)
+		if self._final.pc is None:
+			self._use(self._final.a)
+
+		self._lines = [ 'def block(d, a, ram):' ]
+		entry = _Exit(self._a, self._d, {}, self._entry, 0)
+		self._writeRangeCheck(self._a, entry)
+		self._writeRangeCheck(self._d, entry)
+		for event in self._events:
+			kind = event[0]
+			if kind == 'load':
+				(value, address, exit) = event[1:]
+				self._lines.append('\t{} = ram[{}]'.format(value.name, self._addressText(address)))
+				self._writeRangeCheck(value, exit)
+			elif kind == 'mask':
+				(index, value, exit) = event[1:]
+				self._lines.append('\t{} = {} & {}'.format(index.name, self._text(value),
+					ADDRESS_MASK))
+				if exit is not None:
+					self._writeIf('{} < {}'.format(index.name, LOW_RAM), exit)
+			elif kind == 'store':
+				(address, value) = event[1:]
+				text = self._word(value)
+				self._lines.append('\tram[{}] = {}'.format(self._addressText(address), text))
+			else:
+				(jump, tested, exit) = event[1:]
+				text = self._word(tested)
+				if jump == JLT | JEQ and tested.name is None:
+					tested.name = self._newLocal().name
+					self._lines.append('\t{} = {}'.format(tested.name, text))
+					text = tested.name
+				self._writeIf(_CONDITION[jump].format(text, text), exit)
+		self._lines.extend('\t' + line for line in self._exitLines(self._final, False))
+
+		source = '\n'.join(self._lines) + '\n'
+		namespace = {}
+		exec(compile(source, '<block {}>'.format(self._entry), 'exec'), namespace)
+		return namespace['block']
+
+class BlockEmulator(CPUEmulator):
+
+	def loadRom(self, rom):
+		CPUEmulator.loadRom(self, rom)
+		self._blocks = {}
+
+	def addBreakpoint(self, pc):
+		CPUEmulator.addBreakpoint(self, pc)
+		self._blocks = {}
+
+	# Translates the block starting at entry.
+	# Returns: (compiled function, most instructions it can execute), or
+	# None if the instruction at entry has to be stepped
+	def _translate(self, entry):
+		block = _Block(self, entry)
+		n = block.run()
+		if n == 0:
+			return None
+		return (block.compile(), n)
+
+	# Executes up to maxCycles instructions, like CPUEmulator.run
+	def run(self, maxCycles):
+		blocks = self._blocks
+		ram = self.ram
+		a = self.A
+		d = self.D
+		pc = self.PC
+		executed = 0
+		stepped = 0
+		while executed < maxCycles:
+			block = blocks.get(pc)
+			if block is None:
+				if pc not in blocks:
+					blocks[pc] = self._translate(pc)
+				block = blocks[pc]
+
+			if block is not None and executed + block[1] <= maxCycles:
+				(d, a, pc, n) = block[0](d, a, ram)
+				executed += n
+				if n:
+					continue
+				# A check failed before the first instruction. Step it.
+
+			# Step this instruction with the interpreter
+			(self.A, self.D, self.PC) = (a, d, pc)
+			n = CPUEmulator.run(self, 1)
+			(a, d, pc) = (self.A, self.D, self.PC)
+			executed += n
+			stepped += n
+			if self.halted:
+				break
+
+		self.A = a
+		self.D = d
+		self.PC = pc
+		self.cycles += executed - stepped
+		return executed
+
+# Differential test against CPUEmulator: random programs of random words, run
+# from random RAM in which the VM's pointers (SP, LCL, ARG, THIS and THAT)
+# usually point at or near the stack. Their A-instructions mostly name those
+# pointers or the stack, so that blocks keep low RAM in locals and check
+# their addresses, and sometimes fail the checks, as they would on compiled
+# VM code.
+# Returns: the number of programs on which the two end in different states
+def selfTest(programs, maxCycles, rng):
+	failures = 0
+	for _ in range(programs):
+		rom = []
+		for _ in range(rng.randrange(1, 65)):
+			if rng.random() < 0.4:
+				rom.append(rng.choice([ rng.randrange(0, 16), rng.randrange(240, 272),
+					rng.randrange(0, 32768) ]))
+			else:
+				rom.append(0xE000 | rng.randrange(0, 0x2000))
+		initial = [ rng.choice([ rng.randrange(250, 270), rng.randrange(0, 65536) ])
+			for _ in range(16) ] + [ rng.randrange(0, 65536) for _ in range(272) ]
+
+		states = []
+		for engine in [ BlockEmulator, CPUEmulator ]:
+			cpu = engine(rom)
+			cpu.ram[:len(initial)] = array('H', initial)
+			cpu.run(maxCycles)
+			states.append((cpu.A, cpu.D, cpu.PC, cpu.cycles, cpu.halted, cpu.ram.tobytes()))
+		if states[0] != states[1]:
+			failures += 1
+			print('ERROR: program {} differs'.format(' '.join(str(word) for word in rom)))
+	return failures
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description='Block-translating Hack CPU emulator')
+	argparser.add_argument('program', nargs='?', help='.hack, .bin or .asm file')
+	argparser.add_argument('--cycles', type=int, default=10000000,
+		help='maximum instructions to execute (default: 10000000)')
+	argparser.add_argument('--compare', action='store_true',
+		help='also run the interpreter and compare speed and final state')
+	argparser.add_argument('--self-test', type=int, default=None, metavar='PROGRAMS',
+		help='instead of running a program, compare PROGRAMS random programs against '
+		     'CPUEmulator, each for at most CYCLES instructions')
+	argparser.add_argument('--seed', type=int, default=None, help='random seed for --self-test')
+	args = argparser.parse_args()
+
+	if args.self_test is not None:
+		failures = selfTest(args.self_test, args.cycles, random.Random(args.seed))
+		print('{} of {} random programs differ from CPUEmulator'.format(failures, args.self_test))
+		sys.exit(1 if failures else 0)
+	if args.program is None:
+		argparser.error('a program is needed unless --self-test is given')
+
+	engines = [ BlockEmulator ] + ([ CPUEmulator ] if args.compare else [])
+	results = []
+	for engine in engines:
+		cpu = engine()
+		cpu.load(args.program)
+		start = time.perf_counter()
+		cpu.run(args.cycles)
+		elapsed = time.perf_counter() - start
+		print('{:<14}{} instructions in {:.3f}s ({:.2f}M instructions/s){}'.format(engine.__name__,
+			cpu.cycles, elapsed, cpu.cycles / elapsed / 1e6 if elapsed else 0,
+			', halted' if cpu.halted else ''))
+		results.append((cpu.A, cpu.D, cpu.PC, cpu.cycles, cpu.ram.tobytes()))
+
+	if args.compare and results[0] != results[1]:
+		print('ERROR: final states differ')
+		sys.exit(1)
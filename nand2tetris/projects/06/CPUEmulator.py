@@ -0,0 +1,236 @@
+import sys,time,argparse
+from array import array
+from Code import Code
+import HackAssembler
+
+# Headless Hack CPU emulator. Every ROM word is decoded once, when the program
+# is loaded, into a (comp, dest, jump) tuple:
+#   A-instruction: (None, value, 0)
+#   C-instruction: (function of (D, A, RAM) giving the ALU output, dest bits,
+#                   jump bits, or HALT for a jump to itself)
+# Registers hold unsigned 16-bit Python ints and RAM is an array('H'), so
+# wrapping a result is a single mask. As in the Hack hardware, whose memory
+# address bus is 15 bits wide, M is the RAM word at the low 15 bits of A:
+# addresses of 32K and above wrap around onto RAM. Jumps use A as it stands.
+# peek() and poke() deal in signed values.
+#
+# As in the course's CPU emulator, a C-instruction writes M at the address A
+# held before the instruction, and a jump goes to the new value of A.
+
+RAM_SIZE = 32768
+ROM_SIZE = 32768
+# The bits of A that address RAM
+ADDRESS_MASK = RAM_SIZE - 1
+SCREEN = 16384
+KBD = 24576
+
+DEST_M = 1
+DEST_D = 2
+DEST_A = 4
+
+JGT = 1
+JEQ = 2
+JLT = 4
+JMP = 7
+
+# Pseudo jump code for the usual end-of-program loop, "(END) @END 0;JMP"
+HALT = 8
+
+# Converts between signed values and the unsigned 16-bit register contents
+def unsigned(value):
+	return value & 65535
+
+def signed(value):
+	return value - 65536 if value & 32768 else value
+
+# Python expression for an ALU mnemonic in Code._COMP, given the expressions
+# for the D, A and M operands
+def aluExpression(mnemonic, d='d', a='a', m='ram[a & 32767]'):
+	if mnemonic == '-1':
+		return '65535'
+	if mnemonic in [ '0', '1' ]:
+		return mnemonic
+	expr = ''.join({ 'D': d, 'A': a, 'M': m }.get(c, c) for c in mnemonic)
+	if len(mnemonic) == 1:
+		return expr
+	if mnemonic[0] == '!':
+		return expr[1:] + ' ^ 65535'
+	if '&' in mnemonic or '|' in mnemonic:
+		return expr
+	return '(' + expr + ') & 65535'
+
+# ALU function for each comp code (a-bit and c1..c6) with a mnemonic
+def _buildComp():
+	table = {}
+	for (mnemonic, bits) in Code._COMP.items():
+		table[int(bits, 2)] = eval('lambda d, a, ram: ' + aluExpression(mnemonic))
+	return table
+
+_COMP = _buildComp()
+
+# The ALU computed from its control bits, for comp codes without a mnemonic
+def _alu(comp):
+	(useM, zx, nx, zy, ny, f, no) = [ (comp >> bit) & 1 for bit in range(6, -1, -1) ]
+	def compute(d, a, ram):
+		x = d
+		y = ram[a & ADDRESS_MASK] if useM else a
+		if zx: x = 0
+		if nx: x ^= 65535
+		if zy: y = 0
+		if ny: y ^= 65535
+		out = (x + y) & 65535 if f else x & y
+		return out ^ 65535 if no else out
+	return compute
+
+# Reads a program: a .hack, .bin or .asm file.
+# Returns: the ROM words
+def readRom(filename):
+	if filename.endswith('.asm'):
+		return HackAssembler.assemble(filename)
+	if filename.endswith('.bin'):
+		rom = array('H')
+		with open(filename, 'rb') as binfile:
+			rom.frombytes(binfile.read())
+		if sys.byteorder == 'big':
+			rom.byteswap()
+		return rom
+	with open(filename) as hackfile:
+		return [ int(line, 2) for line in hackfile if line.strip() ]
+
+# True if the instruction at pc is the jump of an "(END) @END 0;JMP" loop
+def isHaltLoop(rom, pc):
+	word = rom[pc]
+	return pc > 0 and word & 0x8000 and word & 0x3F == JMP and rom[pc-1] == pc-1
+
+# ALU function for a breakpoint, which has no effect
+def _breakpoint(d, a, ram):
+	return 0
+
+_decoded = {}
+
+# Decodes one ROM word. Identical words share the same tuple.
+def decode(word):
+	if word not in _decoded:
+		if word & 0x8000 == 0:
+			_decoded[word] = (None, word, 0)
+		else:
+			comp = (word >> 6) & 0x7F
+			fn = _COMP.get(comp) or _alu(comp)
+			_decoded[word] = (fn, (word >> 3) & 7, word & 7)
+	return _decoded[word]
+
+class CPUEmulator:
+
+	def __init__(self, rom=None):
+		self.ram = array('H', bytes(2 * RAM_SIZE))
+		self.loadRom(rom or [])
+
+	# Loads a program from a .hack, .bin or .asm file
+	def load(self, filename):
+		self.loadRom(readRom(filename))
+
+	def loadRom(self, rom):
+		if len(rom) > ROM_SIZE:
+			raise ValueError('Program has {} words; ROM holds {}'.format(len(rom), ROM_SIZE))
+		self.rom = array('H', rom)
+		self._code = [ decode(word) for word in self.rom ]
+
+		# Spot "(END) @END 0;JMP" loops so run() can stop at them
+		for pc in range(1, len(self._code)):
+			if isHaltLoop(self.rom, pc):
+				(fn, dest, jump) = self._code[pc]
+				self._code[pc] = (fn, dest, HALT)
+		self.reset()
+
+	# Makes run() stop when it reaches pc, as it does at a halt loop. The
+	# stop counts as one instruction.
+	def addBreakpoint(self, pc):
+		self._code[pc] = (_breakpoint, 0, HALT)
+
+	# Resets the CPU. RAM is left alone, like the reset button.
+	def reset(self):
+		self.A = self.D = self.PC = 0
+		self.cycles = 0
+		self.halted = False
+
+	def peek(self, address):
+		return signed(self.ram[address])
+
+	def poke(self, address, value):
+		self.ram[address] = unsigned(value)
+
+	# Executes one instruction.
+	def step(self):
+		return self.run(1)
+
+	# Executes up to maxCycles instructions, stopping early if the program
+	# halts (reaches an "(END) @END 0;JMP" loop or runs off the end of the ROM).
+	# Returns: the number of instructions executed
+	def run(self, maxCycles):
+		code = self._code
+		ram = self.ram
+		a = self.A
+		d = self.D
+		pc = self.PC
+		size = len(code)
+		executed = 0
+		while executed < maxCycles:
+			if pc >= size:
+				self.halted = True
+				break
+			(fn, dest, jump) = code[pc]
+			executed += 1
+			if fn is None:
+				a = dest
+				pc += 1
+				continue
+
+			out = fn(d, a, ram)
+			if dest:
+				if dest & DEST_M:
+					ram[a & 32767] = out
+				if dest & DEST_A:
+					a = out
+				if dest & DEST_D:
+					d = out
+
+			if jump and (jump >= JMP or (out >= 32768 and jump & JLT) or
+					(out == 0 and jump & JEQ) or (0 < out < 32768 and jump & JGT)):
+				if jump == HALT:
+					self.halted = True
+					break
+				pc = a
+			else:
+				pc += 1
+
+		self.A = a
+		self.D = d
+		self.PC = pc
+		self.cycles += executed
+		return executed
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description='Headless Hack CPU emulator')
+	argparser.add_argument('program', help='.hack, .bin or .asm file')
+	argparser.add_argument('--cycles', type=int, default=10000000,
+		help='maximum instructions to execute (default: 10000000)')
+	argparser.add_argument('--set', action='append', default=[], metavar='ADDRESS=VALUE',
+		help='set RAM[ADDRESS] before running; may be repeated')
+	argparser.add_argument('--print', action='append', default=[], metavar='ADDRESS',
+		type=int, help='print RAM[ADDRESS] after running; may be repeated')
+	args = argparser.parse_args()
+
+	cpu = CPUEmulator()
+	cpu.load(args.program)
+	for assignment in args.set:
+		(address, value) = assignment.split('=')
+		cpu.poke(int(address), int(value))
+
+	start = time.perf_counter()
+	cpu.run(args.cycles)
+	elapsed = time.perf_counter() - start
+
+	print('{} instructions in {:.3f}s ({:.2f}M instructions/s){}'.format(cpu.cycles, elapsed,
+		cpu.cycles / elapsed / 1e6 if elapsed else 0, ', halted' if cpu.halted else ''))
+	for address in args.print:
+		print('RAM[{}] = {}'.format(address, cpu.peek(address)))
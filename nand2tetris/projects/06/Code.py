@@ -1,5 +1,3 @@
-import Parser
-
 class Code:
 	_DEST = {None: '000', 'M':   '001', 'D':   '010', 'MD':  '011', 'A':   '100', 'AM':  '101', 'AD':  '110', 'AMD': '111'}
 	_JUMP = {None: '000', 'JGT': '001', 'JEQ': '010', 'JGE': '011', 'JLT': '100', 'JNE': '101', 'JLE': '110', 'JMP': '111'}
@@ -33,3 +31,21 @@ class Code:
 
 	def jump(j):
 		return Code._JUMP[j]
+
+	# Returns the 16-bit machine word for a C command written in assembly
+	# syntax (dest=comp;jump), or None if it is not a legal C command.
+	def cInstruction(text):
+		return Code._C_INSTRUCTIONS.get(text)
+
+# Precompute every legal dest x comp x jump combination, keyed by its assembly
+# syntax, so a C command can be encoded with a single dictionary lookup.
+def _buildCInstructions():
+	table = {}
+	for (d, dbits) in Code._DEST.items():
+		for (c, cbits) in Code._COMP.items():
+			for (j, jbits) in Code._JUMP.items():
+				text = ((d + '=') if d else '') + c + ((';' + j) if j else '')
+				table[text] = int('111' + cbits + dbits + jbits, 2)
+	return table
+
+Code._C_INSTRUCTIONS = _buildCInstructions()
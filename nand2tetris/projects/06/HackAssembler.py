@@ -1,49 +1,337 @@
-import sys,re
+import sys,time,argparse
+from array import array
+from collections import deque
 from Parser import Parser
 from Code import Code
 from SymbolTable import SymbolTable
+from Optimizer import Optimizer
+from AssemblerCache import AssemblerCache
 
-# Set Filenames
-asmfilename  = sys.argv[1]
-hackfilename = asmfilename.replace(".asm", ".hack")
-
-# Initialize symbol table
-syms = SymbolTable()
-syms.addEntry('SP', 0)
-syms.addEntry('LCL', 1)
-syms.addEntry('ARG', 2)
-syms.addEntry('THIS', 3)
-syms.addEntry('THAT', 4)
-for i in range(16):
-	syms.addEntry('R'+str(i), i)
-syms.addEntry('SCREEN', 16384)
-syms.addEntry('KBD', 24576)
-
-# Pass 1 (define jump symbols only)
-parser = Parser(asmfilename)
-pc = 0
-for junk in parser.advance():
-	ctype = parser.commandType()
-	if ctype == Parser.L_COMMAND:
-		syms.addEntry(parser.symbol(), pc)
+# First RAM address handed out to variables
+VARIABLE_BASE = 16
+
+# Text form of a 16-bit machine word in a .hack file
+WORD_FORMAT = '{:016b}'.format
+
+# The predefined symbols are built once per process; every program gets its
+# own copy to add labels and variables to.
+_predefined = None
+
+def predefinedSymbols():
+	global _predefined
+	if _predefined is None:
+		# Initialize symbol table
+		syms = SymbolTable()
+		syms.addEntry('SP', 0)
+		syms.addEntry('LCL', 1)
+		syms.addEntry('ARG', 2)
+		syms.addEntry('THIS', 3)
+		syms.addEntry('THAT', 4)
+		for i in range(16):
+			syms.addEntry('R'+str(i), i)
+		syms.addEntry('SCREEN', 16384)
+		syms.addEntry('KBD', 24576)
+		_predefined = syms
+	return _predefined.copy()
+
+# Original two-pass assembly: the .asm file is read and parsed once to define
+# the labels and a second time to generate the code.
+def assembleTwoPass(asmfilename, hackfile):
+	syms = predefinedSymbols()
+
+	# Pass 1 (define jump symbols only)
+	parser = Parser(asmfilename)
+	pc = 0
+	for junk in parser.advance():
+		ctype = parser.commandType()
+		if ctype == Parser.L_COMMAND:
+			syms.addEntry(parser.symbol(), pc)
+		else:
+			pc = pc + 1
+	checkErrors(parser, asmfilename)
+
+	# Pass 2
+	parser = Parser(asmfilename)
+	varloc = VARIABLE_BASE
+	for junk in parser.advance():
+		ctype = parser.commandType()
+		if ctype == Parser.A_COMMAND:
+			sym = parser.symbol()
+			if sym.isdecimal():
+				print(WORD_FORMAT(int(sym)), file=hackfile)
+			else:
+				if not syms.contains(sym):
+					syms.addEntry(sym, varloc)
+					varloc = varloc + 1
+				print(WORD_FORMAT(syms.getAddress(sym)), file=hackfile)
+		elif ctype == Parser.C_COMMAND:
+			print(WORD_FORMAT(parser.instruction()), file=hackfile)
+
+# The Parser reports each unrecognized line on stderr and skips it. A program
+# with any is not assembled: without those lines the code that is left would
+# not do what its author meant.
+def checkErrors(parser, asmfilename):
+	if parser.errors:
+		raise ValueError('{}: {} unrecognized line{}'.format(asmfilename,
+			parser.errors, '' if parser.errors == 1 else 's'))
+
+# Single-pass assembly: every line is parsed exactly once into a list of
+# instructions. A-commands that refer to symbols not yet defined are left as
+# holes and recorded, then patched once all of the labels are known. The holes
+# are patched in program order, so variables get the same addresses as they
+# do in the two-pass assembler and the output is identical.
+# lines: the source lines, if already in memory; otherwise asmfilename is read
+# optimize: run the peephole Optimizer between parsing and encoding
+# Returns: the ROM words as an array('H')
+# Raises: ValueError if the source has unrecognized lines
+def assemble(asmfilename, lines=None, optimize=False):
+	parser = Parser(asmfilename)
+	if optimize:
+		optimizer = Optimizer(readCommands(parser, lines))
+		checkErrors(parser, asmfilename)
+		if not optimizer.relocatable():
+			print('Not optimizing {}: jumps to numeric ROM addresses'.format(asmfilename),
+				file=sys.stderr)
+			return encode(optimizer.commands())
+		commands = optimizer.optimize()
+		print('Optimized {}: {} -> {} instructions'.format(asmfilename,
+			optimizer.before, optimizer.count()), file=sys.stderr)
+		return encode(commands)
+
+	syms = predefinedSymbols()
+	rom = array('H')
+	unresolved = []
+
+	for junk in parser.advance(lines):
+		ctype = parser.commandType()
+		if ctype == Parser.A_COMMAND:
+			sym = parser.symbol()
+			if sym.isdecimal():
+				rom.append(int(sym))
+			elif syms.contains(sym):
+				rom.append(syms.getAddress(sym))
+			else:
+				# Forward label reference or variable. Decide at the end.
+				unresolved.append((len(rom), sym))
+				rom.append(0)
+		elif ctype == Parser.C_COMMAND:
+			rom.append(parser.instruction())
+		elif ctype == Parser.L_COMMAND:
+			syms.addEntry(parser.symbol(), len(rom))
+	checkErrors(parser, asmfilename)
+
+	backpatch(rom, syms, unresolved)
+	return rom
+
+# Fills the holes left for unresolved symbols. Anything still undefined is a
+# variable.
+def backpatch(rom, syms, unresolved):
+	varloc = VARIABLE_BASE
+	for (pc, sym) in unresolved:
+		if not syms.contains(sym):
+			syms.addEntry(sym, varloc)
+			varloc = varloc + 1
+		rom[pc] = syms.getAddress(sym)
+
+# Reads the whole program as (ctype, value) pairs: the symbol of A and L
+# commands, and the text of C commands.
+def readCommands(parser, lines=None):
+	commands = []
+	for junk in parser.advance(lines):
+		ctype = parser.commandType()
+		if ctype == Parser.C_COMMAND:
+			commands.append((ctype, parser.command()))
+		else:
+			commands.append((ctype, parser.symbol()))
+	return commands
+
+# Encodes (ctype, value) pairs as produced by readCommands.
+# Returns: the ROM words as an array('H')
+def encode(commands):
+	syms = predefinedSymbols()
+	rom = array('H')
+	unresolved = []
+	for (ctype, value) in commands:
+		if ctype == Parser.A_COMMAND:
+			if value.isdecimal():
+				rom.append(int(value))
+			elif syms.contains(value):
+				rom.append(syms.getAddress(value))
+			else:
+				unresolved.append((len(rom), value))
+				rom.append(0)
+		elif ctype == Parser.C_COMMAND:
+			rom.append(Code.cInstruction(value))
+		elif ctype == Parser.L_COMMAND:
+			syms.addEntry(value, len(rom))
+	backpatch(rom, syms, unresolved)
+	return rom
+
+# Packs the ROM words into a little-endian uint16 image
+def romBytes(rom):
+	if sys.byteorder == 'big':
+		rom = array('H', rom)
+		rom.byteswap()
+	return rom.tobytes()
+
+# Writes the ROM as text, one 16-character binary word per line
+def writeHack(rom, hackfile):
+	if rom:
+		hackfile.write('\n'.join(map(WORD_FORMAT, rom)) + '\n')
+
+# Writes the ROM as a packed little-endian uint16 image in one write
+def writeBin(rom, binfile):
+	binfile.write(romBytes(rom))
+
+def assembleOnePass(asmfilename, hackfile):
+	writeHack(assemble(asmfilename), hackfile)
+
+# Streaming assembly: reads source lines from any iterable (e.g. a pipe) and
+# writes the machine code as it goes, with writeWords (writeHack or writeBin)
+# called on chunks of at least STREAM_CHUNK words. Output is held back from
+# the oldest unresolved symbol reference onwards, two bytes per held word.
+# A label patches the references waiting for it as soon as it is defined, but
+# a reference to a variable stays open until the end of the input, since only
+# then is it known that no label of that name follows. Memory is therefore
+# bounded only for label-only input, where it depends on the outstanding
+# forward references rather than the length of the source. A program that uses
+# variables is held from the first of them to the end: for Pong.asm that is
+# 22960 of its 27483 words.
+# Returns: the number of unrecognized lines skipped
+STREAM_CHUNK = 4096
+
+def assembleStream(lines, outfile, writeWords=writeHack):
+	syms = predefinedSymbols()
+	pending = array('H')   # Words not yet written
+	base = 0               # ROM address of pending[0]
+	unresolved = deque()   # (pc, sym) of open holes, in program order
+	holes = {}             # sym -> ROM addresses waiting for it
+
+	parser = Parser()
+	for junk in parser.advance(lines):
+		ctype = parser.commandType()
+		if ctype == Parser.A_COMMAND:
+			sym = parser.symbol()
+			if sym.isdecimal():
+				pending.append(int(sym))
+			elif syms.contains(sym):
+				pending.append(syms.getAddress(sym))
+			else:
+				pc = base + len(pending)
+				unresolved.append((pc, sym))
+				holes.setdefault(sym, []).append(pc)
+				pending.append(0)
+		elif ctype == Parser.C_COMMAND:
+			pending.append(parser.instruction())
+		elif ctype == Parser.L_COMMAND:
+			sym = parser.symbol()
+			pc = base + len(pending)
+			syms.addEntry(sym, pc)
+
+			# Patch the holes waiting for this label
+			for hole in holes.pop(sym, ()):
+				pending[hole - base] = pc
+
+			# Drop the resolved holes from the front of the queue
+			while unresolved and unresolved[0][1] not in holes:
+				unresolved.popleft()
+
+		# Write everything ahead of the oldest open hole
+		ready = (unresolved[0][0] if unresolved else base + len(pending)) - base
+		if ready >= STREAM_CHUNK:
+			writeWords(pending[:ready], outfile)
+			del pending[:ready]
+			base += ready
+
+	# Whatever is still unresolved is a variable
+	varloc = VARIABLE_BASE
+	for (pc, sym) in unresolved:
+		if not syms.contains(sym):
+			syms.addEntry(sym, varloc)
+			varloc = varloc + 1
+		pending[pc - base] = syms.getAddress(sym)
+
+	writeWords(pending, outfile)
+	return parser.errors
+
+def writeRom(rom, outfilename, format='hack'):
+	if format == 'bin':
+		with open(outfilename, "wb") as binfile:
+			writeBin(rom, binfile)
 	else:
-		pc = pc + 1
-
-# Pass 2
-parser = Parser(asmfilename)
-hackfile = open(hackfilename, "w")
-varloc = 16
-for junk in parser.advance():
-	ctype = parser.commandType()
-	if ctype == Parser.A_COMMAND:
-		sym = parser.symbol()
-		if re.match('^[0-9]+$', sym):
-			print('0{:015b}'.format(int(sym)), file=hackfile)
+		with open(outfilename, "w") as hackfile:
+			writeHack(rom, hackfile)
+
+# Assembles asmfilename into a .hack or .bin file next to it. If an
+# AssemblerCache is given and already holds the output for this source, the
+# output is copied from the cache without parsing. A source that fails to
+# assemble writes no output and is not cached.
+# Returns: the number of ROM words
+# Raises: ValueError if the source has unrecognized lines
+def assembleFile(asmfilename, format='hack', cache=None, optimize=False):
+	outfilename = asmfilename.replace(".asm", "." + format)
+	if cache is None:
+		rom = assemble(asmfilename, optimize=optimize)
+		writeRom(rom, outfilename, format)
+		return len(rom)
+
+	with open(asmfilename, "rb") as asmfile:
+		source = asmfile.read()
+	key = cache.key(source, format + ('-optimized' if optimize else ''))
+	nwords = cache.fetch(key, outfilename)
+	if nwords is not None:
+		return nwords
+
+	start = time.perf_counter()
+	rom = assemble(asmfilename, source.decode().splitlines(True), optimize)
+	writeRom(rom, outfilename, format)
+	cache.store(key, outfilename, len(rom), time.perf_counter() - start)
+	return len(rom)
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description='Hack assembler')
+	argparser.add_argument('asmfile', nargs='?', default='-',
+		help='Hack assembly (.asm) file, or - (default) to stream stdin to stdout')
+	argparser.add_argument('--two-pass', action='store_true',
+		help='read the source twice instead of backpatching labels')
+	argparser.add_argument('--format', choices=['hack', 'bin'], default='hack',
+		help='hack: text .hack file (default); bin: little-endian uint16 .bin image')
+	argparser.add_argument('--cache', action='store_true',
+		help='reuse output from the assembler cache when the source is unchanged')
+	argparser.add_argument('--cache-dir', default=None,
+		help='assembler cache directory (default: $HACKASM_CACHE or ~/.cache/hackasm)')
+	argparser.add_argument('--optimize', '-O', action='store_true',
+		help='run the peephole optimizer and report instruction counts')
+	args = argparser.parse_args()
+	if args.two_pass and args.format != 'hack':
+		argparser.error('--two-pass only supports --format=hack')
+	if args.optimize and (args.two_pass or args.asmfile == '-'):
+		argparser.error('--optimize needs the whole program; not available with --two-pass or stdin')
+
+	# Stream from stdin to stdout
+	if args.asmfile == '-':
+		if args.two_pass:
+			argparser.error('--two-pass needs a file; stdin can only be read once')
+		if args.format == 'bin':
+			errors = assembleStream(sys.stdin, sys.stdout.buffer, writeBin)
+		else:
+			errors = assembleStream(sys.stdin, sys.stdout)
+		sys.exit(1 if errors else 0)
+
+	# Set Filenames
+	asmfilename  = args.asmfile
+	hackfilename = asmfilename.replace(".asm", ".hack")
+
+	try:
+		if args.two_pass:
+			with open(hackfilename, "w") as hackfile:
+				assembleTwoPass(asmfilename, hackfile)
+		elif args.cache:
+			cache = AssemblerCache(args.cache_dir)
+			assembleFile(asmfilename, args.format, cache, args.optimize)
+			cache.close()
 		else:
-			if not syms.contains(sym):
-				syms.addEntry(sym, varloc)
-				varloc = varloc + 1
-			print('0{:015b}'.format(syms.getAddress(sym)), file=hackfile)
-	elif ctype == Parser.C_COMMAND:
-		print('111' + Code.comp(parser.comp()) + 
-			Code.dest(parser.dest()) + Code.jump(parser.jump()), file=hackfile)
+			assembleFile(asmfilename, args.format, optimize=args.optimize)
+	except ValueError as e:
+		print(e, file=sys.stderr)
+		sys.exit(1)
@@ -0,0 +1,232 @@
+import sys
+from Parser import Parser
+
+# Peephole optimizer for Hack assembly, run between the Parser and encoding.
+# Works on commands as (ctype, value) pairs, where value is the symbol of an A
+# or L command and the dest=comp;jump text of a C command. The program is
+# split into basic blocks: a block starts at a label and ends after a jump.
+
+A = Parser.A_COMMAND
+C = Parser.C_COMMAND
+L = Parser.L_COMMAND
+
+# The stack sequences emitted by projects/08 CodeWriter.writePushD/writePopD
+PUSH_D = [ (A, 'SP'), (C, 'A=M'), (C, 'M=D'), (A, 'SP'), (C, 'M=M+1') ]
+POP_D  = [ (A, 'SP'), (C, 'AM=M-1'), (C, 'D=M') ]
+
+# What is left of PUSH_D + POP_D: A ends up pointing at the free stack slot
+PUSH_POP_D = [ (A, 'SP'), (C, 'A=M') ]
+
+# What is left of POP_D + PUSH_D: D gets a copy of the top of the stack
+POP_PUSH_D = [ (A, 'SP'), (C, 'A=M-1'), (C, 'D=M'), (A, 'SP') ]
+
+# Jumps that are always taken when comp is 0
+ZERO_JUMPS = [ 'JEQ', 'JGE', 'JLE' ]
+
+# Splits C command text into its (dest, comp, jump) fields
+def split(text):
+	(comp, _, jump) = text.partition(';')
+	(dest, _, rest) = comp.partition('=')
+	if rest:
+		comp = rest
+	else:
+		dest = ''
+	return (dest, comp, jump)
+
+def isJump(cmd):
+	return cmd[0] == C and ';' in cmd[1]
+
+def isUnconditionalJump(cmd):
+	if cmd[0] != C:
+		return False
+	(dest, comp, jump) = split(cmd[1])
+	return jump == 'JMP' or (comp == '0' and jump in ZERO_JUMPS)
+
+# An A command, or a C command whose only effect is to set A
+def onlyLoadsA(cmd):
+	if cmd[0] == A:
+		return True
+	(dest, comp, jump) = split(cmd[1])
+	return dest == 'A' and not jump
+
+class BasicBlock:
+
+	def __init__(self):
+		self.labels = []
+		self.code = []
+
+	def fallsThrough(self):
+		return not (self.code and isUnconditionalJump(self.code[-1]))
+
+class Optimizer:
+
+	def __init__(self, commands):
+		# Split the commands into basic blocks
+		self._blocks = [ BasicBlock() ]
+		for cmd in commands:
+			block = self._blocks[-1]
+			if cmd[0] == L:
+				if block.code:
+					block = BasicBlock()
+					self._blocks.append(block)
+				block.labels.append(cmd[1])
+			else:
+				block.code.append(cmd)
+				if isJump(cmd):
+					self._blocks.append(BasicBlock())
+
+		self.before = self.count()
+
+	# The passes move and delete instructions, so they are only safe when
+	# every jump goes to a label. Code that jumps to numeric ROM addresses
+	# (such as the Pong.asm shipped with the course) must be left alone.
+	def relocatable(self):
+		for block in self._blocks:
+			code = block.code
+			for i in range(len(code) - 1):
+				if code[i][0] == A and code[i][1].isdecimal() and isJump(code[i+1]):
+					return False
+		return True
+
+	# Number of ROM instructions in the program
+	def count(self):
+		return sum(len(block.code) for block in self._blocks)
+
+	# Runs all of the passes until none of them finds anything more to do.
+	# Returns: the optimized commands
+	def optimize(self):
+		while True:
+			count = self.count()
+			changed = self.threadJumps()
+			# Before load elimination, which breaks up the stack sequences
+			self.cancelPushPop()
+			self.eliminateRedundantLoads()
+			self.removeUnreachable()
+			if not changed and self.count() == count:
+				break
+		return self.commands()
+
+	def commands(self):
+		commands = []
+		for block in self._blocks:
+			commands.extend((L, label) for label in block.labels)
+			commands.extend(block.code)
+		return commands
+
+	# Jump-to-jump threading: a jump to a block that does nothing but jump
+	# somewhere else is sent straight to the final destination.
+	# Returns: True if any jump was retargeted
+	def threadJumps(self):
+		blockOf = {}
+		for block in self._blocks:
+			for label in block.labels:
+				blockOf[label] = block
+
+		# Follows a chain of jump-only blocks from label
+		def destination(label):
+			seen = set()
+			while label in blockOf and label not in seen:
+				seen.add(label)
+				code = blockOf[label].code
+				if not (len(code) >= 2 and code[0][0] == A and code[1][0] == C):
+					break
+				(dest, comp, jump) = split(code[1][1])
+				if dest or not isUnconditionalJump(code[1]):
+					break
+				label = code[0][1]
+			return label
+
+		changed = False
+		for block in self._blocks:
+			code = block.code
+			for i in range(len(code) - 1):
+				if code[i][0] == A and isJump(code[i+1]):
+					target = destination(code[i][1])
+					if target != code[i][1]:
+						code[i] = (A, target)
+						changed = True
+		return changed
+
+	# Redundant load elimination: drops an @X when A already holds X, a D=M
+	# or M=D when D and M are already known to be equal, and any instruction
+	# that only loads A when the next instruction loads A again. Nothing is
+	# known on entry to a block, since it may be reached by a jump.
+	def eliminateRedundantLoads(self):
+		for block in self._blocks:
+			code = []
+			knownA = None
+			dEqualsM = False
+			for cmd in block.code:
+				if cmd[0] == A:
+					if cmd[1] == knownA:
+						continue
+					# A dead load of A before this one
+					while code and onlyLoadsA(code[-1]):
+						code.pop()
+					knownA = cmd[1]
+					dEqualsM = False
+				else:
+					text = cmd[1]
+					if dEqualsM and text in [ 'D=M', 'M=D' ]:
+						continue
+					(dest, comp, jump) = split(text)
+					if 'A' in dest:
+						knownA = None
+					if text in [ 'D=M', 'M=D' ]:
+						dEqualsM = True
+					elif dest:
+						dEqualsM = False
+				code.append(cmd)
+			block.code = code
+
+	# Push/pop cancellation: a push of D immediately popped back into D, or a
+	# pop into D pushed straight back, leaves the stack as it was. Each pair
+	# is replaced by the few instructions needed to leave A and D as the pair
+	# would have; redundant load elimination drops those too if A is dead.
+	def cancelPushPop(self):
+		for block in self._blocks:
+			code = block.code
+			i = 0
+			while i < len(code):
+				if code[i:i+8] == PUSH_D + POP_D:
+					code[i:i+8] = PUSH_POP_D
+					i += len(PUSH_POP_D)
+				elif code[i:i+8] == POP_D + PUSH_D:
+					code[i:i+8] = POP_PUSH_D
+					i += len(POP_PUSH_D)
+				else:
+					i += 1
+
+	# Unreachable code removal: a block can only run if execution falls into
+	# it from a live block or some A command refers to one of its labels.
+	def removeUnreachable(self):
+		while True:
+			referenced = set(cmd[1] for block in self._blocks for cmd in block.code if cmd[0] == A)
+			removed = False
+			live = True
+			for (i, block) in enumerate(self._blocks):
+				if i > 0:
+					live = (live and self._blocks[i-1].fallsThrough()) or \
+						any(label in referenced for label in block.labels)
+				if not live and block.code:
+					block.code = []
+					removed = True
+			if not removed:
+				break
+
+if __name__ == '__main__':
+	# self-test code: print the optimized program
+	parser = Parser(sys.argv[1])
+	commands = []
+	for junk in parser.advance():
+		ctype = parser.commandType()
+		commands.append((ctype, parser.symbol() if ctype != C else parser.command()))
+	optimizer = Optimizer(commands)
+	for (ctype, value) in optimizer.optimize():
+		if ctype == L:
+			print('(' + value + ')')
+		elif ctype == A:
+			print('    @' + value)
+		else:
+			print('    ' + value)
+	print('// {} -> {} instructions'.format(optimizer.before, optimizer.count()))
@@ -1,89 +1,113 @@
-import re,sys
+import sys
+from Code import Code
 
 class Parser:
 
 	# Command types
 	(A_COMMAND, C_COMMAND, L_COMMAND) = range(3)
 
-	# Regular expressions (compiled for speed)
-	COMMENT_PATTERN   = re.compile(r'//.*$')
-	A_COMMAND_PATTERN = re.compile(r'^@(.*)$')
-	C_COMMAND_PATTERN = re.compile(r'^((A?M?D?)=)?' +
-		r'(0|[ADM]?-?1|[-!]?[ADM]|[ADM]\+1|D[-+|&][AM]|[AM]-D)' +
-		r'(;(J(EQ|NE|MP|[GL][ET])))?$')
-	L_COMMAND_PATTERN = re.compile(r'^\((.*)\)$')
-
-	def __init__(self, filename):
+	def __init__(self, filename=None):
 		# Initialize the Parser
 		self._filename = filename
 		self._hasMoreCommands = None
+		# Lines skipped because they are not valid commands
+		self.errors = 0
 
 	def hasMoreCommands(self):
 		return self.hasMoreCommands
 
 	# This method reads forward in the file, skipping whitespace and comments,
 	# until a command is found. Sets hasMoreCommands and commandType
-	# appropriately.
+	# appropriately. The command type is decided by the first character of
+	# the command, and C commands are validated and encoded with a single
+	# lookup in the precomputed Code table.
+	# lines: any iterable of source lines (e.g. sys.stdin). If not given, the
+	# file named when the Parser was created is read. Lines that are not
+	# commands are reported on stderr, which keeps them out of machine code
+	# streamed to stdout, counted in errors, and skipped.
 	# Returns: None
-	def advance(self):
+	def advance(self, lines=None):
 		self._hasMoreCommands = True
-		for line in open(self._filename):
+		if lines is None:
+			lines = open(self._filename)
+		for (lineno, line) in enumerate(lines, 1):
 			# Strip comments and whitespace
-			line = Parser.COMMENT_PATTERN.sub('', line).strip()
-			if len(line) > 0:
-				#print(line + ' '*(24-len(line)), end='')
-				# Parse the line
-				self._symbol = self._dest = self._comp = self._jump = None
-				# Look for A commands
-				aMatch = Parser.A_COMMAND_PATTERN.match(line)
-				if aMatch:
-					self._commandType = Parser.A_COMMAND
-					# Group 1 has address
-					#print(str(aMatch.groups()))
-					self._symbol = aMatch.group(1)
-				else:
-					# Look for C commands
-					cMatch = Parser.C_COMMAND_PATTERN.match(line)
-					if cMatch:
-						self._commandType = Parser.C_COMMAND
-						#print(str(cMatch.groups()))
-						# Group 2 has dest, 3 has comp, 5 has jump
-						self._dest = cMatch.group(2)
-						self._comp = cMatch.group(3)
-						self._jump = cMatch.group(5)
-					else:
-						# Look for labels
-						lMatch = Parser.L_COMMAND_PATTERN.match(line)
-						if lMatch:
-							self._commandType = Parser.L_COMMAND
-							#print(str(lMatch.groups()))
-							# Group 1 has symbol
-							self._symbol = lMatch.group(1)
-
-				# If a command was found, yield control
-				if aMatch or cMatch or lMatch:
-					yield None
-				else:
-					print("Unrecognized: " + line)
+			comment = line.find('//')
+			if comment >= 0:
+				line = line[:comment]
+			line = line.strip()
+			if not line:
+				continue
+
+			# Parse the line
+			self._symbol = self._instruction = None
+			self._text = line
+			first = line[0]
+			if first == '@':
+				# Address follows the '@'
+				self._commandType = Parser.A_COMMAND
+				self._symbol = line[1:]
+			elif first == '(':
+				if line[-1] != ')':
+					self.unrecognized(lineno, line)
+					continue
+				# Label is between the parentheses
+				self._commandType = Parser.L_COMMAND
+				self._symbol = line[1:-1]
+			else:
+				self._instruction = Code.cInstruction(line)
+				if self._instruction is None:
+					self.unrecognized(lineno, line)
+					continue
+				self._commandType = Parser.C_COMMAND
+
+			# A command was found, yield control
+			yield None
 
 		# No more commands
 		self._hasMoreCommands = False
 
+	def unrecognized(self, lineno, line):
+		self.errors += 1
+		print("{}:{}: Unrecognized: {}".format(self._filename or '<stdin>', lineno, line),
+			file=sys.stderr)
+
+	# Split the current C command into its dest, comp and jump fields. Only
+	# done on request, since the encoded instruction is usually all that is
+	# needed.
+	def _fields(self):
+		if self._commandType != Parser.C_COMMAND:
+			return (None, None, None)
+		(comp, _, jump) = self._text.partition(';')
+		(dest, _, rest) = comp.partition('=')
+		if rest:
+			comp = rest
+		else:
+			dest = None
+		return (dest, comp, jump or None)
 
 	def commandType(self):
 		return self._commandType
 
+	# The current command as written, without comments or whitespace
+	def command(self):
+		return self._text
+
 	def symbol(self):
 		return self._symbol
 
 	def dest(self):
-		return self._dest
+		return self._fields()[0]
 
 	def comp(self):
-		return self._comp
+		return self._fields()[1]
 
 	def jump(self):
-		return self._jump
+		return self._fields()[2]
+
+	# The 16-bit machine word for the current C command
+	def instruction(self):
+		return self._instruction
 
 if __name__ == '__main__':
 	# self-test code
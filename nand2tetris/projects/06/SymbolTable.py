@@ -11,3 +11,8 @@ class SymbolTable:
 
 	def getAddress(self, k):
 		return self._syms[k]
+
+	def copy(self):
+		table = SymbolTable()
+		table._syms = self._syms.copy()
+		return table
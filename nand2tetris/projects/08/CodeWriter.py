@@ -1,16 +1,68 @@
 import os
 from Parser import Parser
+from HackTools import HackAssembler, AsmParser
 
 class CodeWriter:
 
-    def __init__(self, filename, bootstrap=False, debug=False):
-        self._outfile = open(filename, 'w')
+    # The code is kept as a list of (kind, text) entries: the assembler's A
+    # (text is the symbol or number), C and L (the label) commands, and the
+    # comments and blank lines that only the .asm dump shows. rom() encodes
+    # it without going through the assembly text.
+    (A_COMMAND, C_COMMAND, L_COMMAND) = (AsmParser.A_COMMAND, AsmParser.C_COMMAND,
+                                         AsmParser.L_COMMAND)
+    COMMENT = max(A_COMMAND, C_COMMAND, L_COMMAND) + 1
+
+    # Entry labels of the shared call and return routines
+    CALL_ROUTINE = '$CALL'
+    RETURN_ROUTINE = '$RETURN'
+
+    # The registers a call saves in the callee's frame, after the return
+    # address
+    FRAME = [ 'LCL', 'ARG', 'THIS', 'THAT' ]
+
+    # filename is the .asm file written by close(), or None for none
+    def __init__(self, filename, bootstrap=False, debug=False, trampolines=False,
+                 sharedCompares=(), cacheTop=False, frames=None):
+        self._filename = filename
+        self._code = []
         self._DEBUG = debug
 
+        # With trampolines, every call and return jumps to one shared
+        # routine instead of having the whole sequence written inline.
+        # Likewise each comparison in sharedCompares (eq, gt or lt) calls a
+        # shared routine for its kind.
+        self._trampolines = trampolines
+        self._sharedCompares = set(sharedCompares)
+        self._usedCompares = set()
+        self._wroteRoutines = False
+
+        # With cacheTop, the value on top of the stack is kept in D between
+        # straight-line commands instead of being written to RAM and read
+        # straight back. _cached says whether D holds it at this point in
+        # the code; it is spilled to RAM at labels, jumps, calls and returns,
+        # so that every jump target starts with the whole stack in RAM.
+        self._cacheTop = cacheTop
+        self._cached = False
+
+        # frames gives the functions whose calls save only some of FRAME
+        # (see VMOptimizer.leafFrames), with the registers they save. Both
+        # their calls and their returns are written inline, with or without
+        # trampolines.
+        self._frames = frames or {}
+
         # Initialize the ASM instruction and call counters.
         self._asmInstCounter = 0
         self._callCounter = 0
 
+        # Instructions executed by all of the calls and returns written so
+        # far, not counting the shared routines, and the routines' sizes
+        self._calls = self._callInstructions = 0
+        self._returns = self._returnInstructions = 0
+        self._callRoutineSize = self._returnRoutineSize = 0
+
+        # ROM address of each function written
+        self._functionAddresses = {}
+
         # Initial "function" name is '_null'. Will be updated each time a
         # "function" is encountered.
         self._currFunction = '_null'
@@ -21,6 +73,9 @@ class CodeWriter:
             self.writeBlank()
 
     def setFileName(self, filename):
+        # The previous file may have ended with the top of the stack in D
+        self.writeSpill()
+
         if not filename.endswith('.vm'):
             print("WARNING: filename does not have .vm extension: " + filename)
         self._vmfile = os.path.basename(filename)
@@ -33,7 +88,13 @@ class CodeWriter:
         # Set command to lower case
         command = command.lower()
 
-        if command in [ 'neg', 'not' ]:
+        if command in self._sharedCompares:
+            # Let the shared routine do all of the work
+            self.writeSpill()
+            self.writeSharedCompare(command, lineno)
+        elif self._cached:
+            self.writeCachedArithmetic(command, lineno)
+        elif command in [ 'neg', 'not' ]:
             # For the unary operations neg and not, we would pop the value,
             # perform the operation, and then push the result back on the
             # stack. For efficiency, just manipulate the value on the stack
@@ -60,18 +121,16 @@ class CodeWriter:
                 self.writeCode('D;J{}'.format(command.upper()))
                 self.writeCode('@{}-{}-{}'.format(self._vmfilenoext, lineno, 'out'))
                 self.writeCode('D=0;JMP')
-                self.writeCode('({}-{}-{})'.format(self._vmfilenoext, lineno, command),
-                               indent=False)
+                self.defineLabel('{}-{}-{}'.format(self._vmfilenoext, lineno, command))
                 self.writeCode('D=-1')
-                self.writeCode('({}-{}-{})'.format(self._vmfilenoext, lineno, 'out'),
-                               indent=False)
+                self.defineLabel('{}-{}-{}'.format(self._vmfilenoext, lineno, 'out'))
                 self.writeCode('@SP')
                 self.writeCode('A=M-1')
                 self.writeCode('M=D')
             elif command == 'and':
                 self.writeCode('M=D&M')
             elif command == 'or':
-                self.writeCode('M=M|D')
+                self.writeCode('M=D|M')
             else:
                 print("WARNING: Unimplemented arithmetic command: " + command)
 
@@ -87,6 +146,20 @@ class CodeWriter:
         if segment == 'temp' and int(index) not in range(0, 8):
             raise ValueError('temp segment only supports indexes from 0 to 7')
 
+        if self._cacheTop:
+            if ctype == Parser.C_PUSH:
+                self.writeCachedPush(segment, index)
+                return
+            elif self._cached:
+                self.writeCachedPop(segment, index)
+                return
+
+        # Negative constants come only from VMOptimizer.fold
+        if segment == 'constant' and int(index) < 0:
+            self.writeConstantD(int(index))
+            self.writePushD()
+            return
+
         # Calculate the RAM address we really want
 
         # Load the index (offset/constant) into A if not static segment
@@ -125,7 +198,7 @@ class CodeWriter:
             self.writeCode('AD=D+A')
         elif segment == 'static':
             # For the static segment, just create a label and let the assembler deal with it
-            self.writeCode('@{}.{}'.format(self._vmfile, index))
+            self.writeCode('@' + self.staticSymbol(index))
             if ctype == Parser.C_POP:
                 # Copy the address to D if popping
                 self.writeCode('D=A')
@@ -160,26 +233,280 @@ class CodeWriter:
         else:
             raise ValueError('writePushPop: Unrecognized ctype {}'.format(ctype))
 
+    # Arithmetic with the top of the stack in D. The result stays in D.
+    def writeCachedArithmetic(self, command, lineno):
+        if command in [ 'neg', 'not' ]:
+            self.writeCode('D=-D' if command == 'neg' else 'D=!D')
+            return
+
+        # Pop the first argument into A and M
+        self.writeCode('@SP')
+        self.writeCode('AM=M-1')
+
+        if command == 'add':
+            self.writeCode('D=D+M')
+        elif command == 'sub':
+            self.writeCode('D=M-D')
+        elif command in [ 'eq', 'gt', 'lt' ]:
+            self.writeCode('D=M-D')
+            self.writeCode('@{}-{}-{}'.format(self._vmfilenoext, lineno, command))
+            self.writeCode('D;J{}'.format(command.upper()))
+            self.writeCode('@{}-{}-{}'.format(self._vmfilenoext, lineno, 'out'))
+            self.writeCode('D=0;JMP')
+            self.defineLabel('{}-{}-{}'.format(self._vmfilenoext, lineno, command))
+            self.writeCode('D=-1')
+            self.defineLabel('{}-{}-{}'.format(self._vmfilenoext, lineno, 'out'))
+        elif command == 'and':
+            self.writeCode('D=D&M')
+        elif command == 'or':
+            self.writeCode('D=D|M')
+        else:
+            print("WARNING: Unimplemented arithmetic command: " + command)
+
+    # Push with the top of the stack cached: spill the old top, if any, and
+    # load the new one into D
+    def writeCachedPush(self, segment, index):
+        self.writeSpill()
+        if segment == 'constant':
+            self.writeConstantD(int(index))
+        else:
+            self.writeAddress(segment, index)
+            self.writeCode('D=M')
+        self._cached = True
+
+    # Pop with the top of the stack in D
+    def writeCachedPop(self, segment, index):
+        if self.canAddressKeepingD(segment, index):
+            self.writeAddress(segment, index, keepD=True)
+            self.writeCode('M=D')
+        else:
+            # Save the value in R13 while computing the address, then
+            # store it without a second temporary: D = address + value,
+            # A = D - value, M = D - A
+            self.writeCode('@R13')
+            self.writeCode('M=D')
+            self.writeAddress(segment, index)
+            self.writeCode('D=A')
+            self.writeCode('@R13')
+            self.writeCode('D=D+M')
+            self.writeCode('A=D-M')
+            self.writeCode('M=D-A')
+        self._cached = False
+
+    # Writes the cached top of the stack, if any, out to RAM
+    def writeSpill(self):
+        if self._cached:
+            self.writeCode('@SP')
+            self.writeCode('AM=M+1')
+            self.writeCode('A=A-1')
+            self.writeCode('M=D')
+            self._cached = False
+
+    # Pops the top of the stack into D, unless it is already there
+    def writePopTop(self):
+        if self._cached:
+            self._cached = False
+        else:
+            self.writePopD()
+
+    # Base address registers of the segments that are reached through them
+    SEGMENT_BASES = { 'local': 'LCL', 'argument': 'ARG', 'this': 'THIS', 'that': 'THAT' }
+
+    # Longest chain of A=A+1 used to reach a segment entry while keeping D
+    MAX_CHAIN = 5
+
+    # The RAM address of a temp, pointer or static segment entry, as an A
+    # command argument, or None for the other segments
+    def fixedAddress(self, segment, index):
+        if segment == 'temp':
+            return str(5 + int(index))
+        elif segment == 'pointer':
+            return str(3 + int(index))
+        elif segment == 'static':
+            return self.staticSymbol(index)
+        return None
+
+    # The symbol for a static segment entry. An index that is not a number is
+    # already a full symbol, such as the static of another file or an inlining
+    # temporary from VMOptimizer.inlineFunctions.
+    def staticSymbol(self, index):
+        if str(index).isdigit():
+            return '{}.{}'.format(self._vmfile, index)
+        return str(index)
+
+    # True if writeAddress can reach the segment entry without using D
+    def canAddressKeepingD(self, segment, index):
+        return self.fixedAddress(segment, index) is not None or int(index) <= CodeWriter.MAX_CHAIN
+
+    # Loads the address of a segment entry into A. Uses D unless keepD.
+    def writeAddress(self, segment, index, keepD=False):
+        address = self.fixedAddress(segment, index)
+        if address is not None:
+            self.writeCode('@' + address)
+            return
+        index = int(index)
+        if index == 0:
+            self.writeCode('@' + CodeWriter.SEGMENT_BASES[segment])
+            self.writeCode('A=M')
+        elif index == 1 or keepD:
+            self.writeCode('@' + CodeWriter.SEGMENT_BASES[segment])
+            self.writeCode('A=M+1')
+            for _ in range(index - 1):
+                self.writeCode('A=A+1')
+        else:
+            self.writeCode('@{}'.format(index))
+            self.writeCode('D=A')
+            self.writeCode('@' + CodeWriter.SEGMENT_BASES[segment])
+            self.writeCode('A=D+M')
+
+    # D = a constant, which may be negative
+    def writeConstantD(self, value):
+        assert -32768 <= value < 32768, 'Constant out of range: {}'.format(value)
+        if value in [ -1, 0, 1 ]:
+            self.writeCode('D={}'.format(value))
+        elif value == -32768:
+            # Too big to negate in an A command
+            self.writeCode('@32767')
+            self.writeCode('D=!A')
+        elif value > 0:
+            self.writeCode('@{}'.format(value))
+            self.writeCode('D=A')
+        else:
+            self.writeCode('@{}'.format(-value))
+            self.writeCode('D=-A')
+
+    # D = D + a constant, which may be negative but not -32768
+    def writeAddD(self, value):
+        assert -32768 < value < 32768, 'Constant out of range: {}'.format(value)
+        if value in [ -1, 1 ]:
+            self.writeCode('D=D{:+}'.format(value))
+        elif value > 0:
+            self.writeCode('@{}'.format(value))
+            self.writeCode('D=D+A')
+        elif value < 0:
+            self.writeCode('@{}'.format(-value))
+            self.writeCode('D=D-A')
+
+    # Fused push source; [push constant; add|sub;] pop target: target =
+    # source + offset, without going through the stack
+    def writeMove(self, source, offset, target):
+        self.writeSpill()
+        (segment, index) = source
+        if segment == 'constant':
+            # Fold the offset into the constant
+            self.writeMoveConstant(int(index) + offset, target)
+            return
+
+        if source == target:
+            # In place
+            if offset == 0:
+                return
+            if offset in [ -1, 1 ]:
+                self.writeAddress(segment, index)
+                self.writeCode('M=M+1' if offset > 0 else 'M=M-1')
+                return
+            if self.canAddressKeepingD(segment, index):
+                self.writeConstantD(abs(offset))
+                self.writeAddress(segment, index, keepD=True)
+                self.writeCode('M=D+M' if offset > 0 else 'M=M-D')
+                return
+
+        # Far entries of the target segment need the address saved first
+        viaR13 = not self.canAddressKeepingD(*target)
+        if viaR13:
+            self.writeAddress(*target)
+            self.writeCode('D=A')
+            self.writeCode('@R13')
+            self.writeCode('M=D')
+
+        self.writeAddress(segment, index)
+        self.writeCode('D=M')
+        self.writeAddD(offset)
+        self.writeStoreD(target, viaR13)
+
+    # Fused push constant; pop target
+    def writeMoveConstant(self, value, target):
+        if value in [ -1, 0, 1 ]:
+            # Constants the ALU makes, stored straight into M
+            self.writeAddress(*target)
+            self.writeCode('M={}'.format(value))
+            return
+        viaR13 = not self.canAddressKeepingD(*target)
+        if viaR13:
+            self.writeAddress(*target)
+            self.writeCode('D=A')
+            self.writeCode('@R13')
+            self.writeCode('M=D')
+        self.writeConstantD(value)
+        self.writeStoreD(target, viaR13)
+
+    # Stores D in a segment entry, whose address is in R13 if viaR13
+    def writeStoreD(self, target, viaR13=False):
+        if viaR13:
+            self.writeCode('@R13')
+            self.writeCode('A=M')
+        else:
+            self.writeAddress(*target, keepD=True)
+        self.writeCode('M=D')
+
+    # Fused push constant; add|sub: adds value to the top of the stack
+    def writeAddConstant(self, value):
+        if self._cached:
+            self.writeAddD(value)
+            return
+        if value == 0:
+            return
+        if value not in [ -1, 1 ]:
+            self.writeConstantD(abs(value))
+        self.writeCode('@SP')
+        self.writeCode('A=M-1')
+        if value in [ -1, 1 ]:
+            self.writeCode('M=M+1' if value > 0 else 'M=M-1')
+        else:
+            self.writeCode('M=D+M' if value > 0 else 'M=M-D')
+
     def writeLabel(self, label):
+        self.writeSpill()
         # Output the ASM label
-        self.writeCode('({}${})'.format(self._currFunction, label), indent=False)
+        self.defineLabel('{}${}'.format(self._currFunction, label))
 
     def writeGoto(self, label):
+        self.writeSpill()
         # Load the destination and jump
         self.writeCode('@{}${}'.format(self._currFunction, label))
         self.writeCode('0;JMP')
 
     def writeIf(self, label):
         # Pop the top of the stack into D
-        self.writePopD()
+        self.writePopTop()
 
         # Load the destination and jump if non-zero
         self.writeCode('@{}${}'.format(self._currFunction, label))
         self.writeCode('D;JNE')
 
+    # Fused comparison (or not, or none) and if-goto: pops the operands and jumps
+    # on the condition without pushing a true/false value first
+    def writeBranch(self, comparison, jump, label):
+        # Pop the top of the stack into D
+        self.writePopTop()
+
+        # D = x - y, popping x
+        if comparison == 'not':
+            self.writeCode('D=D+1')
+        elif comparison is not None:
+            self.writeCode('@SP')
+            self.writeCode('AM=M-1')
+            self.writeCode('D=M-D')
+
+        # Load the destination and jump if the condition holds
+        self.writeCode('@{}${}'.format(self._currFunction, label))
+        self.writeCode('D;{}'.format(jump))
+
     def writeFunction(self, functionName, numLocals):
+        self.writeSpill()
+        self._functionAddresses[functionName] = self._asmInstCounter
         # Output the label for the function and update current function
-        self.writeCode('({})'.format(functionName), indent=False)
+        self.defineLabel('{}'.format(functionName))
         self._currFunction = functionName
 
         # Set up for the local variables
@@ -193,21 +520,47 @@ class CodeWriter:
             self.writeCode('M=D')
 
     def writeReturn(self):
+        start = self._asmInstCounter
+        frame = self._frames.get(self._currFunction)
+        if frame is not None:
+            self.writeReturnCode(frame)
+        elif self._trampolines:
+            self.writeSpill()
+            # goto $RETURN
+            self.writeCode('@' + CodeWriter.RETURN_ROUTINE)
+            self.writeCode('0;JMP')
+        else:
+            self.writeReturnCode()
+        self._returns += 1
+        self._returnInstructions += self._asmInstCounter - start
+
+    def writeReturnCode(self, frame=FRAME):
+        # Keep a cached return value out of the way in R13
+        cached = self._cached
+        if cached:
+            self.writeCode('@R13')
+            self.writeCode('M=D')
+            self._cached = False
+
         # FRAME (R14) = LCL
         self.writeCode('@LCL')
         self.writeCode('D=M')
         self.writeCode('@R14')
         self.writeCode('M=D')
 
-        # RET (R15) = *(FRAME-5)
-        self.writeCode('@5')
+        # RET (R15) = *(FRAME-5), or before fewer saved registers
+        self.writeCode('@{}'.format(len(frame) + 1))
         self.writeCode('A=D-A')
         self.writeCode('D=M')
         self.writeCode('@R15')
         self.writeCode('M=D')
 
         # *ARG = pop()
-        self.writePopD()
+        if cached:
+            self.writeCode('@R13')
+            self.writeCode('D=M')
+        else:
+            self.writePopD()
         self.writeCode('@ARG')
         self.writeCode('A=M')
         self.writeCode('M=D')
@@ -217,8 +570,8 @@ class CodeWriter:
         self.writeCode('@SP')
         self.writeCode('M=D')
 
-        # Restore THAT, THIS, ARG, and LCL using FRAME
-        for reg in [ 'THAT', 'THIS', 'ARG', 'LCL' ]:
+        # Restore THAT, THIS, ARG, and LCL (or those saved) using FRAME
+        for reg in reversed(frame):
             self.writeCode('@R14')
             self.writeCode('AM=M-1')
             self.writeCode('D=M')
@@ -230,23 +583,65 @@ class CodeWriter:
         self.writeCode('A=M;JMP')
 
     def writeCall(self, functionName, numArgs):
+        self.writeSpill()
+        start = self._asmInstCounter
+        frame = self._frames.get(functionName)
+        if frame is not None:
+            self.writeCallCode(functionName, numArgs, frame)
+        elif self._trampolines:
+            self.writeTrampolineCall(functionName, numArgs)
+        else:
+            self.writeCallCode(functionName, numArgs)
+
+        # Label for return address
+        self.defineLabel('{}:RET{}'.format(self._currFunction, self._callCounter))
+
+        # Increment the call counter
+        self._callCounter += 1
+        self._calls += 1
+        self._callInstructions += self._asmInstCounter - start
+
+    def writeTrampolineCall(self, functionName, numArgs):
+        # R13 = functionName
+        self.writeCode('@{}'.format(functionName))
+        self.writeCode('D=A')
+        self.writeCode('@R13')
+        self.writeCode('M=D')
+
+        # R14 = numArgs
+        if int(numArgs) in [ 0, 1 ]:
+            self.writeCode('@R14')
+            self.writeCode('M={}'.format(int(numArgs)))
+        else:
+            self.writeCode('@{}'.format(numArgs))
+            self.writeCode('D=A')
+            self.writeCode('@R14')
+            self.writeCode('M=D')
+
+        # D = return address, goto $CALL
+        self.writeCode('@{}:RET{}'.format(self._currFunction, self._callCounter))
+        self.writeCode('D=A')
+        self.writeCode('@' + CodeWriter.CALL_ROUTINE)
+        self.writeCode('0;JMP')
+
+    def writeCallCode(self, functionName, numArgs, frame=FRAME):
         # Push return address
         self.writeCode('@{}:RET{}'.format(self._currFunction, self._callCounter))
         self.writeCode('D=A')
         self.writePushD()
 
-        # Push LCL, ARG, THIS, and THAT
-        for reg in [ 'LCL', 'ARG', 'THIS', 'THAT' ]:
+        # Push LCL, ARG, THIS, and THAT, or those the callee needs saved
+        for reg in frame:
             self.writeCode('@{}'.format(reg))
             self.writeCode('D=M')
             self.writePushD()
 
-        # ARG = SP-numArgs-5
+        # ARG = SP-numArgs-5, or less the registers not saved
         self.writeCode('@SP')
         self.writeCode('D=M')
         self.writeCode('@{}'.format(numArgs))
         self.writeCode('D=D-A')
-        self.writeCode('@5')
+        self.writeCode('@{}'.format(len(frame) + 1))
         self.writeCode('D=D-A')
         self.writeCode('@ARG')
         self.writeCode('M=D')
@@ -261,12 +656,122 @@ class CodeWriter:
         self.writeCode('@{}'.format(functionName))
         self.writeCode('0;JMP')
 
-        # Label for return address
-        self.writeCode('({}:RET{})'.format(self._currFunction, self._callCounter),
-                       indent=False)
+    def writeSharedCompare(self, command, lineno):
+        # D = return address, goto $EQ, $GT or $LT
+        self.writeCode('@{}-{}-{}'.format(self._vmfilenoext, lineno, 'ret'))
+        self.writeCode('D=A')
+        self.writeCode('@${}'.format(command.upper()))
+        self.writeCode('0;JMP')
+        self.defineLabel('{}-{}-{}'.format(self._vmfilenoext, lineno, 'ret'))
+        self._usedCompares.add(command)
+
+    def writeCompareRoutine(self, command):
+        # $EQ, $GT or $LT: D = return address. Replaces the top two values on
+        # the stack with true (-1) or false (0).
+        self.defineLabel('${}'.format(command.upper()))
+        self.writeCode('@R13')
+        self.writeCode('M=D')
+        self.writePopD()
+        self.writeCode('A=A-1')
+        self.writeCode('D=M-D')
+        self.writeCode('M=-1')
 
-        # Increment the call counter
-        self._callCounter += 1
+        # Return straight away if true
+        self.writeCode('@R13')
+        self.writeCode('A=M')
+        self.writeCode('D;J{}'.format(command.upper()))
+
+        # Otherwise overwrite the result with false, then return
+        self.writeCode('@SP')
+        self.writeCode('A=M-1')
+        self.writeCode('M=0')
+        self.writeCode('@R13')
+        self.writeCode('A=M')
+        self.writeCode('0;JMP')
+
+    # The shared routines: after the bootstrap all of those enabled, and
+    # otherwise at the end of the program those it used
+    def writeRoutines(self, used=False):
+        trampolines = self._trampolines and (self._calls or self._returns or not used)
+        compares = [ command for command in [ 'eq', 'gt', 'lt' ]
+                     if command in (self._usedCompares if used else self._sharedCompares) ]
+
+        # A program without a bootstrap may just run off its end. Stop it
+        # there rather than in the routines.
+        if used and (trampolines or compares):
+            self.writeBlank()
+            self.defineLabel('$END')
+            self.writeCode('@$END')
+            self.writeCode('0;JMP')
+
+        if trampolines:
+            self.writeBlank()
+            self.writeTrampolines()
+        for command in compares:
+            self.writeBlank()
+            self.writeCompareRoutine(command)
+        self._wroteRoutines = True
+
+    def writeTrampolines(self):
+        # $CALL: R13 = function, R14 = numArgs, D = return address
+        start = self._asmInstCounter
+        self.defineLabel('{}'.format(CodeWriter.CALL_ROUTINE))
+
+        # Push the return address, then LCL, ARG, THIS, and THAT, advancing
+        # SP as we go rather than after each push
+        self.writeCode('@SP')
+        self.writeCode('A=M')
+        self.writeCode('M=D')
+        for reg in [ 'LCL', 'ARG', 'THIS', 'THAT' ]:
+            self.writeCode('@{}'.format(reg))
+            self.writeCode('D=M')
+            self.writeCode('@SP')
+            self.writeCode('AM=M+1')
+            self.writeCode('M=D')
+
+        # LCL = SP = SP+1
+        self.writeCode('@SP')
+        self.writeCode('MD=M+1')
+        self.writeCode('@LCL')
+        self.writeCode('M=D')
+
+        # ARG = SP-5-numArgs
+        self.writeCode('@5')
+        self.writeCode('D=D-A')
+        self.writeCode('@R14')
+        self.writeCode('D=D-M')
+        self.writeCode('@ARG')
+        self.writeCode('M=D')
+
+        # goto R13
+        self.writeCode('@R13')
+        self.writeCode('A=M;JMP')
+        self._callRoutineSize = self._asmInstCounter - start
+        self.writeBlank()
+
+        # $RETURN: the inline return sequence
+        start = self._asmInstCounter
+        self.defineLabel('{}'.format(CodeWriter.RETURN_ROUTINE))
+        self.writeReturnCode()
+        self._returnRoutineSize = self._asmInstCounter - start
+
+    # Average instructions executed per call and per return, including the
+    # shared routines when using trampolines, or None if there were none
+    def callCost(self):
+        callCycles = returnCycles = None
+        if self._calls:
+            callCycles = self._callInstructions / self._calls + self._callRoutineSize
+        if self._returns:
+            returnCycles = self._returnInstructions / self._returns + self._returnRoutineSize
+        return (callCycles, returnCycles)
+
+    # ROM address of a function, or None if it was not written
+    def functionAddress(self, functionName):
+        return self._functionAddresses.get(functionName)
+
+    # Number of instructions written, i.e. the ROM size
+    def instructionCount(self):
+        return self._asmInstCounter
 
     def writePopD(self):
         # Pop into D
@@ -292,23 +797,55 @@ class CodeWriter:
         # call Sys.init
         self.writeCall('Sys.init', '0')
 
+        # The shared routines, where Sys.init never returns
+        self.writeRoutines()
+
     def writeComment(self, cmdtext, lineno):
-        self.writeCode('// {} [{}]: {}'.format(self._vmfile, lineno, cmdtext),
-                       indent=False)
+        self._code.append((CodeWriter.COMMENT,
+                           '// {} [{}]: {}'.format(self._vmfile, lineno, cmdtext)))
 
     def writeBlank(self):
-        self.writeCode('', indent=False)
+        self._code.append((CodeWriter.COMMENT, ''))
 
-    # Simplify code generation by putting file specification in one place
-    def writeCode(self, code, indent=True):
-        if indent:
-            code = ' ' * 4 + code
-
-            # Format the code and add a comment with the instruction number
-            code = '{:<28}// {!s}'.format(code, self._asmInstCounter)
-            self._asmInstCounter += 1
+    # Adds an instruction, in assembly syntax, to the code
+    def writeCode(self, code):
+        if code[0] == '@':
+            self._code.append((CodeWriter.A_COMMAND, code[1:]))
+        else:
+            self._code.append((CodeWriter.C_COMMAND, code))
+        self._asmInstCounter += 1
+
+    # Adds a label for the next instruction to the code
+    def defineLabel(self, symbol):
+        self._code.append((CodeWriter.L_COMMAND, symbol))
+
+    # Writes the code as assembly, with the address of each instruction
+    def writeAsm(self, filename):
+        lines = []
+        pc = 0
+        for (kind, text) in self._code:
+            if kind == CodeWriter.A_COMMAND or kind == CodeWriter.C_COMMAND:
+                code = ' ' * 4 + ('@' + text if kind == CodeWriter.A_COMMAND else text)
+                lines.append('{:<28}// {!s}'.format(code, pc))
+                pc += 1
+            elif kind == CodeWriter.L_COMMAND:
+                lines.append('(' + text + ')')
+            else:
+                lines.append(text)
+        with open(filename, 'w') as asmfile:
+            asmfile.write('\n'.join(lines) + '\n')
 
-        print(code, file=self._outfile)
+    # The code assembled, straight from the instructions.
+    # Returns: the ROM words as an array('H')
+    def rom(self):
+        return HackAssembler.encode([ entry for entry in self._code
+                                      if entry[0] != CodeWriter.COMMENT ])
 
     def close(self):
-        self._outfile.close()
+        self.writeSpill()
+
+        # Without a bootstrap, the routines go after the program
+        if not self._wroteRoutines:
+            self.writeRoutines(used=True)
+        if self._filename is not None:
+            self.writeAsm(self._filename)
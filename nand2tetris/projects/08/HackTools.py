@@ -0,0 +1,19 @@
+import sys,os
+
+# The assembler and emulator live in projects/06, which has a Parser module
+# of its own. Set ours aside, if loaded, while they load, and put it back
+# afterwards so that "from Parser import Parser" still means the VM parser.
+
+_vmParser = sys.modules.pop('Parser', None)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '06'))
+try:
+    import HackAssembler
+    from BlockEmulator import BlockEmulator
+    from CPUEmulator import SCREEN, KBD
+    AsmParser = HackAssembler.Parser
+finally:
+    sys.path.pop(0)
+    if _vmParser is None:
+        sys.modules.pop('Parser', None)
+    else:
+        sys.modules['Parser'] = _vmParser
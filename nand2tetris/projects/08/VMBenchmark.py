@@ -0,0 +1,105 @@
+import sys,os,shutil,tempfile,argparse
+import VMTranslator
+from HackTools import BlockEmulator, SCREEN, KBD
+
+# Measures the Hack cycles a VM program takes, translated with the code
+# generation options given and with the baseline options (by default, none).
+# Each program runs from reset until it
+# reaches one of the stop functions (by default Sys.halt, or
+# Keyboard.keyPressed for programs that wait for input), a halt loop, or the
+# cycle limit. The two runs must leave the same picture on the screen.
+# With --reference, the runs are instead of a projects/11 program's .refvm
+# files and of the .vm files compiled from its .jack files, both with the
+# options given, which checks the compiler against the reference output.
+
+OS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'tools', 'OS')
+
+# Copies a program's .vm files (or a project 11 directory's .refvm files,
+# for the classes without .vm files or, if reference is set, for all of
+# them) into workdir, adding the OS classes it does not define itself if
+# osdir is given.
+# Returns: the copied .vm files
+def collectVMFiles(path, workdir, osdir=None, reference=False):
+    classes = {}
+    for name in sorted(os.listdir(path)):
+        (base, ext) = os.path.splitext(name)
+        if (ext == '.vm' and not reference) or \
+           (ext == '.refvm' and (reference or base not in classes)):
+            classes[base] = os.path.join(path, name)
+    if osdir:
+        for name in sorted(os.listdir(osdir)):
+            (base, ext) = os.path.splitext(name)
+            if ext == '.vm' and base not in classes:
+                classes[base] = os.path.join(osdir, name)
+
+    vmfiles = []
+    for (base, source) in sorted(classes.items()):
+        vmfile = os.path.join(workdir, base + '.vm')
+        shutil.copyfile(source, vmfile)
+        vmfiles.append(vmfile)
+    return vmfiles
+
+# Translates and runs the VM files.
+# Returns: (ROM size, cycles, stopped before the limit, screen contents)
+def measure(vmfiles, stops, maxCycles, options):
+    cw = VMTranslator.translate(vmfiles, None, True, **options)
+    cpu = BlockEmulator(cw.rom())
+    for function in stops:
+        address = cw.functionAddress(function)
+        if address is not None:
+            cpu.addBreakpoint(address)
+    cpu.run(maxCycles)
+    return (len(cpu.rom), cpu.cycles, cpu.halted, cpu.ram[SCREEN:KBD].tobytes())
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Cycle counts of translated VM programs')
+    argparser.add_argument('programs', nargs='+',
+        help='directories of .vm files, or of .refvm files from projects/11')
+    VMTranslator.addOptions(argparser)
+    argparser.add_argument('--os', action='store_true',
+        help='link with the OS classes in tools/OS')
+    argparser.add_argument('--stop', action='append', default=None, metavar='FUNCTION',
+        help='function whose entry ends the run; may be repeated '
+             '(default: Sys.halt and Keyboard.keyPressed)')
+    argparser.add_argument('--cycles', type=int, default=50000000,
+        help='maximum instructions to execute (default: 50000000)')
+    argparser.add_argument('--reference', action='store_true',
+        help="compare each projects/11 program's .refvm files (before) with the .vm "
+             'files compiled from it (after), instead of comparing translator options')
+    argparser.add_argument('--baseline', default='', metavar='OPTIONS',
+        help='translator options to compare against, e.g. --baseline=--trampolines for '
+             'programs too big for the ROM without them')
+    args = argparser.parse_args()
+    baselineParser = argparse.ArgumentParser(prog='--baseline')
+    VMTranslator.addOptions(baselineParser)
+    baseline = args if args.reference else baselineParser.parse_args(args.baseline.split())
+    stops = args.stop or [ 'Sys.halt', 'Keyboard.keyPressed' ]
+
+    failures = 0
+    print('{:<28}{:>14}{:>14}{:>12}{:>12}{:>8}'.format('program', 'cycles before', 'cycles after',
+        'ROM before', 'ROM after', 'change'))
+    for program in args.programs:
+        workdir = tempfile.mkdtemp(prefix='vmbench')
+        try:
+            osdir = OS_DIR if args.os else None
+            vmfiles = collectVMFiles(program, workdir, osdir)
+            basefiles = vmfiles
+            if args.reference:
+                refdir = os.path.join(workdir, 'reference')
+                os.mkdir(refdir)
+                basefiles = collectVMFiles(program, refdir, osdir, reference=True)
+            before = measure(basefiles, stops, args.cycles,
+                             VMTranslator.translateOptions(baseline))
+            after = measure(vmfiles, stops, args.cycles,
+                            VMTranslator.translateOptions(args))
+        finally:
+            shutil.rmtree(workdir)
+
+        name = os.path.basename(os.path.normpath(program))
+        print('{:<28}{:>14}{:>14}{:>12}{:>12}{:>+7.1%}{}'.format(name, before[1], after[1],
+            before[0], after[0], after[1] / before[1] - 1,
+            '' if before[2] and after[2] else '  (cycle limit)'))
+        if before[3] != after[3]:
+            failures += 1
+            print('ERROR: {} leaves a different screen'.format(name))
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,471 @@
+import sys,os
+from Parser import Parser
+
+# Optimization passes over parsed VM commands, run before the CodeWriter.
+# Each command is a (ctype, arg1, arg2, text, lineno) tuple, as read by
+# VMTranslator.readCommands. Passes over the whole program work on a list of
+# (VM file, commands) pairs.
+
+# Fused command types, beyond Parser's own:
+#   (C_MOVE, (source segment, index, offset), (target segment, index), ...)
+#       target = source + offset
+#   (C_ADD_CONSTANT, value, None, ...)
+#       adds value to the top of the stack
+#   (C_BRANCH, (comparison or None, jump), label, ...)
+#       pops and jumps to label if the jump mnemonic's condition holds for
+#       the difference of the top two values (comparison is eq, gt or lt),
+#       for the top value plus one (comparison not), or for the top value
+#       (comparison None)
+C_MOVE = len(Parser.CMDS)
+C_ADD_CONSTANT = C_MOVE + 1
+C_BRANCH = C_MOVE + 2
+
+# The fusion patterns, with the Hack instructions each saves. S and T are any
+# segments; the savings depend on the segments and indexes (far entries of
+# local, argument, this and that need their address saved in R13).
+#
+#   Pattern                                       Inline  Fused  Saved
+#   push S i; pop T j                              17-22    0-15   7-22
+#   push constant c; pop T j                       17-19    2-12   7-17
+#   push S i; push constant c; add|sub; pop T j    29-34    4-17  17-30
+#   push S i; push constant 1; add|sub; pop S i    29-34    2-5   27-32
+#   push constant c; add|sub                       12       0-5    7-12
+#   eq|gt|lt; not; if-goto L                       25       8     17
+#   eq|gt|lt; if-goto L                            22       8     14
+#   not; if-goto L                                 8        6      2
+# The fused branches never materialize the true/false value, so they save
+# nearly as many cycles: 19-20 -> 8 and 16-17 -> 8 with a comparison.
+PATTERNS = [ 'move', 'move constant', 'move with offset', 'increment', 'add constant',
+             'compare and branch', 'not and branch' ]
+
+# What fold does, as counted in its stats
+FOLDS = [ 'constants folded', 'identities removed', 'no-ops removed', 'constant branches' ]
+
+# The jump taken when a comparison holds, and when it does not
+JUMPS = { 'eq': ('JEQ', 'JNE'), 'gt': ('JGT', 'JLE'), 'lt': ('JLT', 'JGE') }
+
+SEGMENTS = [ 'argument', 'local', 'static', 'constant', 'this', 'that', 'pointer', 'temp' ]
+
+def isPush(cmd, segment=None):
+    return cmd[0] == Parser.C_PUSH and (segment is None or cmd[1].lower() == segment)
+
+def isArithmetic(cmd, commands):
+    return cmd[0] == Parser.C_ARITHMETIC and cmd[1].lower() in commands
+
+def isIf(cmd):
+    return cmd[0] == Parser.C_IF
+
+# The (segment, index) of a push or pop, or None if it is one the fused
+# commands cannot handle, in which case the CodeWriter reports the error
+def operand(cmd):
+    segment = cmd[1].lower()
+    if segment == 'static' and not str(cmd[2]).isdigit():
+        # A full symbol, from inlineFunctions
+        return (segment, cmd[2])
+    index = int(cmd[2])
+    if segment not in SEGMENTS or (index < 0 and segment != 'constant'):
+        return None
+    if cmd[0] == Parser.C_POP and segment == 'constant':
+        return None
+    if (segment == 'pointer' and index > 1) or (segment == 'temp' and index > 7):
+        return None
+    return (segment, index)
+
+# Peephole fusion: replaces the command sequences in PATTERNS by single
+# fused commands, trying the longest pattern first at each position.
+# Returns: the new commands. Counts each pattern matched in stats, if given.
+def fuse(commands, stats=None):
+    fused = []
+    i = 0
+    while i < len(commands):
+        window = commands[i:i+4]
+        match = None
+
+        # Conditional branches on a comparison, or on its negation
+        if len(window) >= 2 and isArithmetic(window[0], JUMPS):
+            (jump, inverse) = JUMPS[window[0][1].lower()]
+            if isIf(window[1]):
+                match = ('compare and branch', 2, (C_BRANCH, (window[0][1].lower(), jump), window[1][1]))
+            elif len(window) >= 3 and isArithmetic(window[1], [ 'not' ]) and isIf(window[2]):
+                match = ('compare and branch', 3, (C_BRANCH, (window[0][1].lower(), inverse), window[2][1]))
+        if (match is None and len(window) >= 2 and isArithmetic(window[0], [ 'not' ]) and
+                isIf(window[1])):
+            # not x is true unless x is -1, when x + 1 is 0
+            match = ('not and branch', 2, (C_BRANCH, ('not', 'JNE'), window[1][1]))
+
+        if (len(window) == 4 and isPush(window[0]) and isPush(window[1], 'constant') and
+                isArithmetic(window[2], [ 'add', 'sub' ]) and window[3][0] == Parser.C_POP):
+            source = operand(window[0])
+            target = operand(window[3])
+            offset = int(window[1][2]) * (1 if window[2][1].lower() == 'add' else -1)
+            # The offset, and a folded constant, must still be ones the A
+            # command can load
+            if source and target and -32768 < offset < 32768 and (
+                    source[0] != 'constant' or -32768 < source[1] + offset < 32768):
+                name = 'increment' if source == target and abs(offset) == 1 else 'move with offset'
+                match = (name, 4, (C_MOVE, source + (offset,), target))
+
+        if (match is None and len(window) >= 2 and isPush(window[0]) and
+                window[1][0] == Parser.C_POP):
+            source = operand(window[0])
+            target = operand(window[1])
+            if source and target:
+                name = 'move constant' if source[0] == 'constant' else 'move'
+                match = (name, 2, (C_MOVE, source + (0,), target))
+
+        if (match is None and len(window) >= 2 and isPush(window[0], 'constant') and
+                isArithmetic(window[1], [ 'add', 'sub' ])):
+            value = int(window[0][2]) * (1 if window[1][1].lower() == 'add' else -1)
+            if -32768 < value < 32768:
+                match = ('add constant', 2, (C_ADD_CONSTANT, value, None))
+
+        if match is None:
+            fused.append(commands[i])
+            i += 1
+        else:
+            (name, length, (ctype, arg1, arg2)) = match
+            text = '; '.join(cmd[3] for cmd in commands[i:i+length])
+            fused.append((ctype, arg1, arg2, text, commands[i][4]))
+            if stats is not None:
+                stats[name] = stats.get(name, 0) + 1
+            i += length
+    return fused
+
+# Constant folding of the arithmetic commands. Operands are compared and
+# results wrapped as the Hack code would, so gt and lt compare the
+# difference.
+def wrap(value):
+    value &= 65535
+    return value - 65536 if value & 32768 else value
+
+FOLD_UNARY = { 'neg': lambda x: -x, 'not': lambda x: ~x }
+FOLD_BINARY = {
+    'add': lambda x, y: x + y, 'sub': lambda x, y: x - y,
+    'and': lambda x, y: x & y, 'or': lambda x, y: x | y,
+    'eq': lambda x, y: -1 if x == y else 0,
+    'gt': lambda x, y: -1 if wrap(x - y) > 0 else 0,
+    'lt': lambda x, y: -1 if wrap(x - y) < 0 else 0,
+}
+
+# Binary commands that leave the other operand alone, with the constant
+IDENTITIES = [ ('add', 0), ('sub', 0), ('or', 0), ('and', -1) ]
+
+# The value of a push constant, or None for any other command
+def constantValue(cmd):
+    return int(cmd[2]) if isPush(cmd, 'constant') else None
+
+# Constant folding and algebraic simplification. The commands written so far
+# serve as an abstract stack: those at its end that push constants are the
+# values known at this point, up to the last label, call or other command
+# that breaks the chain. Arithmetic on known values becomes one push of the
+# result (which may be negative, for the CodeWriter to load directly, but
+# not -32768, which is pushed as 32767 and not, as no A command or
+# negation of one can load it), and
+# an if-goto on a known value becomes a goto or nothing. Also removes add or
+# sub of 0, or of 0, and of -1, neg; neg and not; not, and push x; pop x.
+# Returns: the new commands. Counts each of FOLDS in stats, if given.
+def fold(commands, stats=None):
+    folded = []
+    def count(name):
+        if stats is not None:
+            stats[name] = stats.get(name, 0) + 1
+
+    for cmd in commands:
+        last = folded[-1] if folded else (None, None, None, None, None)
+        value = constantValue(last)
+        if cmd[0] == Parser.C_ARITHMETIC:
+            command = cmd[1].lower()
+            if command in FOLD_UNARY and value is not None:
+                result = FOLD_UNARY[command](value)
+                operands = 1
+            elif (command in FOLD_BINARY and value is not None and len(folded) >= 2 and
+                    constantValue(folded[-2]) is not None):
+                result = FOLD_BINARY[command](constantValue(folded[-2]), value)
+                operands = 2
+            elif (command, value) in IDENTITIES:
+                folded.pop()
+                count('identities removed')
+                continue
+            elif command in FOLD_UNARY and isArithmetic(last, [ command ]):
+                folded.pop()
+                count('identities removed')
+                continue
+            else:
+                folded.append(cmd)
+                continue
+            first = folded[-operands]
+            text = '; '.join([ c[3] for c in folded[-operands:] ] + [ cmd[3] ])
+            del folded[-operands:]
+            result = wrap(result)
+            if result == -32768:
+                folded.append((Parser.C_PUSH, 'constant', '32767', text, first[4]))
+                folded.append((Parser.C_ARITHMETIC, 'not', None, text, first[4]))
+            else:
+                folded.append((Parser.C_PUSH, 'constant', str(result), text, first[4]))
+            count('constants folded')
+        elif (cmd[0] == Parser.C_POP and isPush(last) and
+                (last[1].lower(), str(last[2])) == (cmd[1].lower(), str(cmd[2]))):
+            folded.pop()
+            count('no-ops removed')
+        elif cmd[0] == Parser.C_IF and value is not None:
+            folded.pop()
+            if value != 0:
+                folded.append((Parser.C_GOTO, cmd[1], None, last[3] + '; ' + cmd[3], last[4]))
+            count('constant branches')
+        else:
+            folded.append(cmd)
+    return folded
+
+# The first function in the files, as a list of roots for
+# removeDeadFunctions
+def firstFunction(files):
+    for (vmfile, commands) in files:
+        for cmd in commands:
+            if cmd[0] == Parser.C_FUNCTION:
+                return [ cmd[1] ]
+    return []
+
+# Dead function elimination: keeps only the functions that the roots, or
+# code outside any function, can reach through calls. files is a list of
+# (VM file, commands) pairs.
+# Returns: the new list. Counts the functions and the functions and
+# commands removed in stats, if given.
+def removeDeadFunctions(files, roots, stats=None):
+    # The calls made by each function, and by code outside functions
+    calls = {}
+    roots = list(roots)
+    for (vmfile, commands) in files:
+        function = None
+        for cmd in commands:
+            if cmd[0] == Parser.C_FUNCTION:
+                function = cmd[1]
+                calls.setdefault(function, [])
+            elif cmd[0] == Parser.C_CALL:
+                (calls[function] if function is not None else roots).append(cmd[1])
+
+    # Walk the call graph
+    live = set()
+    pending = [ name for name in roots if name in calls ]
+    while pending:
+        function = pending.pop()
+        if function not in live:
+            live.add(function)
+            pending.extend(name for name in calls[function] if name in calls)
+
+    kept = []
+    removed = 0
+    for (vmfile, commands) in files:
+        function = None
+        code = []
+        for cmd in commands:
+            if cmd[0] == Parser.C_FUNCTION:
+                function = cmd[1]
+            if function is None or function in live:
+                code.append(cmd)
+        removed += len(commands) - len(code)
+        kept.append((vmfile, code))
+
+    if stats is not None:
+        stats['functions'] = len(calls)
+        stats['functions removed'] = len(calls) - len(live)
+        stats['commands removed'] = removed
+    return kept
+
+# Inlining temporaries: static symbols shared by every inlined body. The
+# bodies make no calls, so no two of them are ever live at once.
+INLINE_TEMP = '$inline.{}'
+
+# Stack effect of the arithmetic commands
+BINARY = [ 'add', 'sub', 'and', 'or', 'eq', 'gt', 'lt' ]
+UNARY = [ 'neg', 'not' ]
+
+# True if a function body (the commands after its function command) can be
+# inlined: it makes no calls, has no loops, ends with a return, and every
+# return leaves only the return value on the stack, so that a return can
+# become a jump past the body.
+def isInlinable(body):
+    if not body or body[-1][0] != Parser.C_RETURN:
+        return False
+    depth = 0
+    reachable = True
+    labels = {}
+    defined = set()
+    for cmd in body:
+        ctype = cmd[0]
+        if ctype == Parser.C_LABEL:
+            # Only forward jumps, so any depth here is already known
+            defined.add(cmd[1])
+            if cmd[1] in labels:
+                if reachable and labels[cmd[1]] != depth:
+                    return False
+                depth = labels[cmd[1]]
+            elif not reachable:
+                return False
+            labels[cmd[1]] = depth
+            reachable = True
+            continue
+        if not reachable:
+            continue
+        if ctype == Parser.C_PUSH:
+            depth += 1
+        elif ctype == Parser.C_POP:
+            depth -= 1
+        elif ctype == Parser.C_ARITHMETIC and cmd[1].lower() in BINARY + UNARY:
+            depth -= 1 if cmd[1].lower() in BINARY else 0
+        elif ctype in [ Parser.C_GOTO, Parser.C_IF ]:
+            depth -= 1 if ctype == Parser.C_IF else 0
+            if cmd[1] in defined or labels.get(cmd[1], depth) != depth:
+                return False
+            labels[cmd[1]] = depth
+            reachable = ctype == Parser.C_IF
+        elif ctype == Parser.C_RETURN:
+            if depth != 1:
+                return False
+            reachable = False
+        else:
+            return False
+        if depth < 0:
+            return False
+    return True
+
+# The commands that replace a call to an inlinable function. The arguments
+# and locals become inlining temporaries, the labels get the call's line
+# number, and returns jump past the body, restoring THIS and THAT if the
+# body sets them. callee and caller are the VM files of the function and
+# of the call.
+# Returns: the commands, or None if the body uses arguments the call does
+# not pass
+def inlineCall(call, body, nLocals, callee, caller):
+    nArgs = int(call[2])
+    nLocals = int(nLocals)
+    site = call[4]
+    for cmd in body:
+        if (cmd[0] in [ Parser.C_PUSH, Parser.C_POP ] and cmd[1].lower() == 'argument' and
+                int(cmd[2]) >= nArgs):
+            return None
+    pointers = sorted(set(int(cmd[2]) for cmd in body
+                          if cmd[0] == Parser.C_POP and cmd[1].lower() == 'pointer'))
+    saved = { pointer: INLINE_TEMP.format(nArgs + nLocals + i)
+              for (i, pointer) in enumerate(pointers) }
+    end = 'INLINE_END.{}'.format(site)
+
+    commands = []
+    def add(ctype, arg1=None, arg2=None):
+        words = [ arg1 ] if ctype == Parser.C_ARITHMETIC else [ Parser.CMDS[ctype], arg1, arg2 ]
+        text = ' '.join(str(word) for word in words if word is not None)
+        commands.append((ctype, arg1, arg2, text, '{}.{}'.format(site, len(commands))))
+
+    for i in reversed(range(nArgs)):
+        add(Parser.C_POP, 'static', INLINE_TEMP.format(i))
+    for i in range(nLocals):
+        add(Parser.C_PUSH, 'constant', '0')
+        add(Parser.C_POP, 'static', INLINE_TEMP.format(nArgs + i))
+    for (pointer, temp) in saved.items():
+        add(Parser.C_PUSH, 'pointer', str(pointer))
+        add(Parser.C_POP, 'static', temp)
+
+    for (i, cmd) in enumerate(body):
+        (ctype, arg1, arg2) = cmd[:3]
+        if ctype in [ Parser.C_PUSH, Parser.C_POP ]:
+            segment = arg1.lower()
+            if segment == 'argument':
+                (arg1, arg2) = ('static', INLINE_TEMP.format(arg2))
+            elif segment == 'local':
+                (arg1, arg2) = ('static', INLINE_TEMP.format(nArgs + int(arg2)))
+            elif segment == 'static' and callee != caller:
+                arg2 = '{}.{}'.format(os.path.basename(callee), arg2)
+            add(ctype, arg1, arg2)
+        elif ctype in [ Parser.C_LABEL, Parser.C_GOTO, Parser.C_IF ]:
+            add(ctype, '{}.{}'.format(arg1, site))
+        elif ctype == Parser.C_RETURN:
+            for (pointer, temp) in saved.items():
+                add(Parser.C_PUSH, 'static', temp)
+                add(Parser.C_POP, 'pointer', str(pointer))
+            if i < len(body) - 1:
+                add(Parser.C_GOTO, end)
+        else:
+            add(ctype, arg1, arg2)
+    if any(cmd[0] == Parser.C_RETURN for cmd in body[:-1]):
+        add(Parser.C_LABEL, end)
+    return commands
+
+# Inlining: replaces the calls to functions of at most budget commands that
+# isInlinable accepts with the functions' bodies. files is a list of
+# (VM file, commands) pairs.
+# Returns: the new list. Records the size of each function inlined and
+# the number of calls replaced in stats['inlined'], if stats is given.
+def inlineFunctions(files, budget, stats=None):
+    # The inlinable functions: name -> (VM file, locals, body)
+    functions = {}
+    for (vmfile, commands) in files:
+        starts = [ i for (i, cmd) in enumerate(commands) if cmd[0] == Parser.C_FUNCTION ]
+        for (start, end) in zip(starts, starts[1:] + [ len(commands) ]):
+            body = commands[start+1:end]
+            if len(body) <= budget and isInlinable(body):
+                functions[commands[start][1]] = (vmfile, commands[start][2], body)
+
+    inlined = {}
+    result = []
+    for (vmfile, commands) in files:
+        code = []
+        for cmd in commands:
+            replacement = None
+            if cmd[0] == Parser.C_CALL and cmd[1] in functions:
+                (callee, nLocals, body) = functions[cmd[1]]
+                replacement = inlineCall(cmd, body, nLocals, callee, vmfile)
+            if replacement is None:
+                code.append(cmd)
+            else:
+                code.extend(replacement)
+                (size, calls) = inlined.get(cmd[1], (len(body), 0))
+                inlined[cmd[1]] = (size, calls + 1)
+        result.append((vmfile, code))
+
+    if stats is not None:
+        stats['inlined'] = inlined
+    return result
+
+# Frame analysis: the registers that calls to each leaf function (one that
+# makes no calls) need to save, for CodeWriter's frames option. A leaf needs
+# LCL and ARG saved, since it gets its own, but THIS and THAT only if it sets
+# them with pop pointer. The CodeWriter writes these calls inline even with
+# trampolines, so only leaves get a reduced frame: they are the small,
+# frequently called functions where the frame is most of the cost. A
+# function the program never calls itself keeps the full frame, since
+# whatever does call it knows only the usual one.
+# Returns: dict of function name -> registers
+def leafFrames(files):
+    frames = {}
+    called = set()
+    for (vmfile, commands) in files:
+        function = None
+        for cmd in commands:
+            if cmd[0] == Parser.C_CALL:
+                called.add(cmd[1])
+            if cmd[0] == Parser.C_FUNCTION:
+                function = cmd[1]
+                frames[function] = [ 'LCL', 'ARG' ]
+            elif function is None or frames[function] is None:
+                continue
+            elif cmd[0] == Parser.C_CALL:
+                frames[function] = None
+            elif cmd[0] == Parser.C_POP and cmd[1].lower() == 'pointer':
+                register = [ 'THIS', 'THAT' ][int(cmd[2])]
+                if register not in frames[function]:
+                    frames[function].append(register)
+    return { function: [ register for register in [ 'LCL', 'ARG', 'THIS', 'THAT' ]
+                         if register in frame ]
+             for (function, frame) in frames.items() if frame is not None and function in called }
+
+if __name__ == '__main__':
+    # self-test code: print the fused commands
+    parser = Parser(sys.argv[1])
+    commands = []
+    while parser.hasMoreCommands():
+        parser.advance()
+        commands.append((parser.commandType(), parser.arg1(), parser.arg2(),
+                         parser.command(), parser.lineno()))
+    stats = {}
+    for cmd in fuse(commands, stats):
+        print(cmd)
+    print(stats)
@@ -1,79 +1,219 @@
-import sys,os
+import sys,os,argparse
 from Parser import Parser
 from CodeWriter import CodeWriter
+import VMOptimizer
+from HackTools import HackAssembler
 
 DEBUG = False
 
-# Get VM file or directory of files from the command line
-try:
-    arg  = sys.argv[1]
-except IndexError as e:
-    print('Usage: VMTranslator file.vm|directory')
-    sys.exit(1)
-
-# If the argument has '.vm' in it, assume it's a file, otherwise a folder
-vmfiles = []
-if arg.endswith('.vm'):
-    vmfiles.append(arg)
-    asmfilename = arg.replace(".vm", ".asm")
-    bootstrap = False
-else:
-    with os.scandir(arg) as it:
-        for entry in it:
-            if entry.name.endswith('.vm') and entry.is_file():
-                vmfiles.append(os.path.join(arg, entry.name))
-    asmfilename = arg + '\{0}.asm'.format(os.path.basename(arg))
-    bootstrap = True
-
-# print('vmfiles:\t' + str(vmfiles))
-# print('asmfilename:\t' + asmfilename)
-
-# Create the CodeWriter. Add the bootstrap code, if required.
-cw = CodeWriter(asmfilename, bootstrap, DEBUG)
-
-# Main Loop
-for vmfile in vmfiles:
+# Reads the commands of a VM file.
+# Returns: list of (ctype, arg1, arg2, text, lineno) tuples
+def readCommands(vmfile):
     parser = Parser(vmfile, DEBUG)
-    cw.setFileName(vmfile)
-    # print('Parsing ' + vmfile + ' to ' + asmfilename)
-
+    commands = []
     while parser.hasMoreCommands():
-        # Read the next command
         parser.advance()
+        commands.append((parser.commandType(), parser.arg1(), parser.arg2(),
+                         parser.command(), parser.lineno()))
+    return commands
+
+# Translates the VM files into Hack code, written to asmfilename unless it is
+# None; the CodeWriter's rom() gives the machine code. If inline is set, calls to
+# functions of up to that many commands are inlined; if removeDead is set,
+# only the functions reachable from Sys.init (or without a bootstrap, from
+# the first function) are translated; if fold is set, arithmetic on
+# constants is folded; if fuse is set, command sequences are fused. Each
+# counts what it did in stats. If leafFrames is set, calls to
+# leaf functions save only the registers VMOptimizer.leafFrames finds they
+# need. If sharedCompare is set, the comparisons left with at least that
+# many occurrences once all of that is done get shared routines. The options
+# are passed on to the CodeWriter.
+# Returns: the (closed) CodeWriter, for its statistics
+def translate(vmfiles, asmfilename, bootstrap, fuse=False, removeDead=False, inline=None,
+              leafFrames=False, fold=False, sharedCompare=None, stats=None, **options):
+    files = [ (vmfile, readCommands(vmfile)) for vmfile in vmfiles ]
+    if inline:
+        files = VMOptimizer.inlineFunctions(files, inline, stats)
+    if removeDead:
+        roots = [ 'Sys.init' ] if bootstrap else VMOptimizer.firstFunction(files)
+        files = VMOptimizer.removeDeadFunctions(files, roots, stats)
+    if leafFrames:
+        options['frames'] = VMOptimizer.leafFrames(files)
+        if stats is not None:
+            stats['leaf frames'] = options['frames']
+    if fold:
+        files = [ (vmfile, VMOptimizer.fold(commands, stats)) for (vmfile, commands) in files ]
+    if fuse:
+        files = [ (vmfile, VMOptimizer.fuse(commands, stats)) for (vmfile, commands) in files ]
+    if sharedCompare is not None:
+        options['sharedCompares'] = chooseSharedCompares(files, sharedCompare)
+        if stats is not None:
+            stats['shared compares'] = options['sharedCompares']
+
+    # Create the CodeWriter. Add the bootstrap code, if required.
+    cw = CodeWriter(asmfilename, bootstrap, DEBUG, **options)
+
+    # Main Loop
+    for (vmfile, commands) in files:
+        cw.setFileName(vmfile)
+        # print('Translating ' + vmfile + ' to ' + asmfilename)
+
+        for (ctype, arg1, arg2, text, lineno) in commands:
+            # Write a comment into the ASM file with the VM command
+            cw.writeComment(text, lineno)
+
+            # Generate the code for the command
+            if ctype == Parser.C_ARITHMETIC:
+                cw.writeArithmetic(arg1, lineno)
+            elif ctype == Parser.C_PUSH or ctype == Parser.C_POP:
+                cw.writePushPop(ctype, arg1, arg2)
+            elif ctype == Parser.C_LABEL:
+                cw.writeLabel(arg1)
+            elif ctype == Parser.C_GOTO:
+                cw.writeGoto(arg1)
+            elif ctype == Parser.C_IF:
+                cw.writeIf(arg1)
+            elif ctype == Parser.C_FUNCTION:
+                cw.writeFunction(arg1, arg2)
+            elif ctype == Parser.C_RETURN:
+                cw.writeReturn()
+            elif ctype == Parser.C_CALL:
+                cw.writeCall(arg1, arg2)
+            elif ctype == VMOptimizer.C_MOVE:
+                cw.writeMove(arg1[:2], arg1[2], arg2)
+            elif ctype == VMOptimizer.C_ADD_CONSTANT:
+                cw.writeAddConstant(arg1)
+            elif ctype == VMOptimizer.C_BRANCH:
+                cw.writeBranch(arg1[0], arg1[1], arg2)
+            elif ctype in range(len(Parser.CMDS)):
+                print("WARNING: Unimplemented ctype: " + str(ctype))
+            else:
+                print("ERROR: Unrecognized ctype: " + str(ctype))
+                sys.exit(1)
+
+            # Write a blank line into the ASM file after each VM command
+            cw.writeBlank()
+
+    # Close the CodeWriter
+    cw.close()
+    return cw
+
+# Counts the arithmetic commands in (VM file, commands) pairs.
+# Returns: dict of command -> number of occurrences
+def countArithmetic(files):
+    counts = {}
+    for (vmfile, commands) in files:
+        for (ctype, arg1, arg2, text, lineno) in commands:
+            if ctype == Parser.C_ARITHMETIC:
+                command = arg1.lower()
+                counts[command] = counts.get(command, 0) + 1
+    return counts
+
+# Finds the VM files to translate: a single .vm file, or all of those in
+# a directory, which also gets the bootstrap code.
+# Returns: (VM files, ASM file name, bootstrap)
+def findVMFiles(arg):
+    # If the argument has '.vm' in it, assume it's a file, otherwise a folder
+    vmfiles = []
+    if arg.endswith('.vm'):
+        vmfiles.append(arg)
+        asmfilename = arg.replace(".vm", ".asm")
+        bootstrap = False
+    else:
+        with os.scandir(arg) as it:
+            for entry in it:
+                if entry.name.endswith('.vm') and entry.is_file():
+                    vmfiles.append(os.path.join(arg, entry.name))
+        asmfilename = os.path.join(arg, '{0}.asm'.format(os.path.basename(os.path.normpath(arg))))
+        bootstrap = True
+    return (vmfiles, asmfilename, bootstrap)
+
+# The comparisons worth a shared routine: those with at least minimum
+# occurrences in the (VM file, commands) pairs to be translated
+def chooseSharedCompares(files, minimum):
+    counts = countArithmetic(files)
+    return [ command for command in [ 'eq', 'gt', 'lt' ]
+             if counts.get(command, 0) >= max(minimum, 1) ]
+
+# Adds the code generation options to an argument parser
+def addOptions(argparser):
+    argparser.add_argument('--trampolines', action='store_true',
+        help='share one $CALL and one $RETURN routine between all calls and returns')
+    argparser.add_argument('--shared-compare', type=int, default=None, metavar='MIN',
+        help='use a shared routine for eq, gt or lt when the program has at least MIN of them '
+             'after the other optimizations; each one shrinks the ROM by 9 instructions, less 17 '
+             'for the routine (19 without a bootstrap, for the $END loop), and costs 4 to 9 '
+             'extra cycles')
+    argparser.add_argument('--fold', action='store_true',
+        help='fold arithmetic on constants and remove no-op commands')
+    argparser.add_argument('--fuse', action='store_true',
+        help='fuse common sequences of push, pop and arithmetic commands')
+    argparser.add_argument('--cache-top', action='store_true',
+        help='keep the top of the stack in D between straight-line commands')
+    argparser.add_argument('--remove-dead', action='store_true',
+        help='translate only the functions reachable from Sys.init')
+    argparser.add_argument('--inline', type=int, default=None, metavar='SIZE',
+        help='inline calls to functions of at most SIZE VM commands that make no calls '
+             'and have no loops')
+    argparser.add_argument('--leaf-frames', action='store_true',
+        help='save only LCL and ARG, and THIS or THAT if the callee sets them, '
+             'when calling functions that make no calls')
+
+# The translate() keyword arguments for the options in args
+def translateOptions(args):
+    return { 'fold': args.fold, 'fuse': args.fuse, 'removeDead': args.remove_dead, 'inline': args.inline,
+             'leafFrames': args.leaf_frames, 'trampolines': args.trampolines,
+             'sharedCompare': args.shared_compare, 'cacheTop': args.cache_top }
+
+if __name__ == '__main__':
+    # Get VM file or directory of files from the command line
+    argparser = argparse.ArgumentParser(description='VM to Hack assembly translator')
+    argparser.add_argument('path', help='.vm file or directory of .vm files')
+    argparser.add_argument('--format', choices=['asm', 'hack', 'bin'], default='asm',
+        help='asm: annotated assembly (default); hack or bin: machine code, as written by '
+             'the HackAssembler, without the assembly')
+    argparser.add_argument('--asm', action='store_true',
+        help='also write the assembly with --format=hack or bin')
+    addOptions(argparser)
+    args = argparser.parse_args()
+
+    (vmfiles, asmfilename, bootstrap) = findVMFiles(args.path)
+    # print('vmfiles:\t' + str(vmfiles))
+    # print('asmfilename:\t' + asmfilename)
+
+    options = translateOptions(args)
+    stats = {}
+    dump = args.format == 'asm' or args.asm
+    cw = translate(vmfiles, asmfilename if dump else None, bootstrap, stats=stats, **options)
+    if args.format != 'asm':
+        HackAssembler.writeRom(cw.rom(), os.path.splitext(asmfilename)[0] + '.' + args.format,
+                               args.format)
 
-        # Get the command type and arguments
-        ctype = parser.commandType()
-        arg1  = parser.arg1()
-        arg2  = parser.arg2()
-
-        # Write a comment into the ASM file with the VM command
-        cw.writeComment(parser.command(), parser.lineno())
-
-        # Generate the code for the command
-        if ctype == Parser.C_ARITHMETIC:
-            cw.writeArithmetic(arg1, parser.lineno())
-        elif ctype == Parser.C_PUSH or ctype == Parser.C_POP:
-            cw.writePushPop(ctype, arg1, arg2)
-        elif ctype == Parser.C_LABEL:
-            cw.writeLabel(arg1)
-        elif ctype == Parser.C_GOTO:
-            cw.writeGoto(arg1)
-        elif ctype == Parser.C_IF:
-            cw.writeIf(arg1)
-        elif ctype == Parser.C_FUNCTION:
-            cw.writeFunction(arg1, arg2)
-        elif ctype == Parser.C_RETURN:
-            cw.writeReturn()
-        elif ctype == Parser.C_CALL:
-            cw.writeCall(arg1, arg2)
-        elif ctype in range(len(Parser.CMDS)):
-            print("WARNING: Unimplemented ctype: " + str(ctype))
-        else:
-            print("ERROR: Unrecognized ctype: " + str(ctype))
-            sys.exit(1)
-
-        # Write a blank line into the ASM file after each VM command
-        cw.writeBlank()
-
-# Close the CodeWriter
-cw.close()
+    # Compare against the plain translation
+    if any(options.values()) or args.shared_compare is not None:
+        plain = translate(vmfiles, None, bootstrap)
+        print('ROM size: {} instructions, {} without optimizations'.format(
+            cw.instructionCount(), plain.instructionCount()))
+        if stats.get('shared compares'):
+            print('Shared comparisons: ' + ' '.join(stats['shared compares']))
+        if 'inlined' in stats:
+            print('Inlined {} calls to {} functions'.format(
+                sum(calls for (size, calls) in stats['inlined'].values()), len(stats['inlined'])))
+            for (name, (size, calls)) in sorted(stats['inlined'].items()):
+                print('  {:<32}{:>4} commands{:>6} calls'.format(name, size, calls))
+        if 'leaf frames' in stats:
+            frames = stats['leaf frames']
+            print('Leaf frames: {} functions, {} saving only LCL and ARG'.format(
+                len(frames), sum(1 for frame in frames.values() if len(frame) == 2)))
+        if 'functions' in stats:
+            print('Removed {} of {} functions ({} VM commands)'.format(
+                stats['functions removed'], stats['functions'], stats['commands removed']))
+        for name in VMOptimizer.FOLDS:
+            if name in stats:
+                print('{:<24}{:>6}'.format(name[0].upper() + name[1:] + ':', stats[name]))
+        for name in VMOptimizer.PATTERNS:
+            if name in stats:
+                print('Fused {:<18}{:>6}'.format(name + ':', stats[name]))
+        for (what, cycles, plainCycles) in zip([ 'call', 'return' ], cw.callCost(), plain.callCost()):
+            if args.trampolines and cycles is not None:
+                print('Cycles per {}: {:.1f} ({:+.1f})'.format(what, cycles, cycles - plainCycles))
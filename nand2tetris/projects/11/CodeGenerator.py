@@ -0,0 +1,224 @@
+from VMWriter import VMWriter
+import JackAST
+
+
+class CodeGenerator:
+    """
+    Compiles the abstract syntax tree of a class, as built by the
+    CompilationEngine, to VM code written through a VMWriter.
+    """
+
+    def __init__(self, vmFile, DEBUG=False, listener=None):
+        """
+        Creates a code generator writing to vmFile. Each VM command written is
+        also passed to the CompilationListener, if one is given.
+        """
+        self.DEBUG = DEBUG
+        self.writer = VMWriter(vmFile, DEBUG=DEBUG, listener=listener)
+
+    def compileClass(self, node):
+        """
+        Compiles a complete class, and closes the VM file.
+        """
+        self.thisClass = node.name
+
+        # Counters for while loops and if statements
+        self.whileCounter = self.ifCounter = 0
+
+        for subroutine in node.subroutines:
+            self.compileSubroutine(subroutine, node.nFields)
+
+        self.writer.close()
+
+    def compileSubroutine(self, node, nFields):
+        """
+        Compiles a method, function, or constructor of a class with nFields
+        fields.
+        """
+        self.writer.writeFunction(
+            "{}.{}".format(self.thisClass, node.name), node.nLocals
+        )
+
+        # A constructor allocates memory for the new object and sets the base
+        # of the this segment
+        if node.kind == "constructor":
+            self.writer.writePush("CONST", nFields)
+            self.writer.writeCall("Memory.alloc", 1)
+            self.writer.writePop("POINTER", 0)
+
+        # A method sets the base of the this segment
+        if node.kind == "method":
+            self.writer.writePush("ARG", 0)
+            self.writer.writePop("POINTER", 0)
+
+        self.compileStatements(node.statements)
+
+    def compileStatements(self, statements):
+        """
+        Compiles a sequence of statements.
+        """
+        for statement in statements:
+            getattr(self, "compile" + type(statement).__name__)(statement)
+
+    def compileDo(self, node):
+        """
+        Compiles a do statement.
+        """
+        # Call the desired subroutine and consume the returned value
+        self.compileCall(node.call)
+        self.writer.writePop("TEMP", 0)
+
+    def compileLet(self, node):
+        """
+        Compiles a let statement.
+        """
+        variable = node.variable
+        if node.index is None:
+            self.compileExpression(node.value)
+            self.writer.writePop(variable.kind, variable.index)
+        else:
+            # Add the offset to the base. Leave the result on the stack.
+            self.compileExpression(node.index)
+            self.writer.writePush(variable.kind, variable.index)
+            self.writer.writeArithmetic("+")
+
+            # Save the value temporarily while setting THAT.
+            self.compileExpression(node.value)
+            self.writer.writePop("TEMP", 0)
+            self.writer.writePop("POINTER", 1)
+            self.writer.writePush("TEMP", 0)
+            self.writer.writePop("THAT", 0)
+
+    def compileWhile(self, node):
+        """
+        Compiles a while statement.
+        """
+        whileInstance = self.whileCounter
+        self.whileCounter += 1
+        start = "WHILE.{}.{}.EXP".format(self.thisClass, whileInstance)
+        exit = "WHILE.{}.{}.EXIT".format(self.thisClass, whileInstance)
+
+        self.writer.writeLabel(start)
+        self.compileExpression(node.condition)
+        self.writer.writeArithmetic("U~")
+        self.writer.writeIf(exit)
+        self.compileStatements(node.statements)
+        self.writer.writeGoto(start)
+        self.writer.writeLabel(exit)
+
+    def compileReturn(self, node):
+        """
+        Compiles a return statement.
+        """
+        if node.value is not None:
+            self.compileExpression(node.value)
+        else:
+            # void function, so force a 0 onto the stack to return
+            self.writer.writePush("CONST", 0)
+
+        self.writer.writeReturn()
+
+    def compileIf(self, node):
+        """
+        Compiles an if statement, possibly with a trailing else clause.
+        """
+        self.compileExpression(node.condition)
+        self.writer.writeArithmetic("U~")
+        ifInstance = self.ifCounter
+        self.ifCounter += 1
+        otherwise = "IF.{}.{}.ELSE".format(self.thisClass, ifInstance)
+        self.writer.writeIf(otherwise)
+
+        self.compileStatements(node.statements)
+
+        if node.elseStatements is not None:
+            exit = "IF.{}.{}.EXIT".format(self.thisClass, ifInstance)
+            self.writer.writeGoto(exit)
+            self.writer.writeLabel(otherwise)
+            self.compileStatements(node.elseStatements)
+            self.writer.writeLabel(exit)
+        else:
+            self.writer.writeLabel(otherwise)
+
+    def compileExpression(self, node):
+        """
+        Compiles an expression, leaving its value on the stack.
+        """
+        getattr(self, "compile" + type(node).__name__)(node)
+
+    def compileIntegerConstant(self, node):
+        self.writer.writePush("CONST", node.value)
+
+    def compileStringConstant(self, node):
+        # Declare space for the string
+        self.writer.writePush("CONST", len(node.value))
+        self.writer.writeCall("String.new", 1)
+        # Save the contents of the string
+        for c in node.value:
+            self.writer.writePush("CONST", ord(c))
+            self.writer.writeCall("String.appendChar", 2)
+
+    def compileKeywordConstant(self, node):
+        keyword = node.keyword
+        if keyword in ["null", "false"]:
+            # Map to 0
+            self.writer.writePush("CONST", 0)
+        elif keyword == "true":
+            # Map to -1
+            self.writer.writePush("CONST", 1)
+            self.writer.writeArithmetic("U-")
+        else:
+            # this
+            self.writer.writePush("POINTER", 0)
+
+    def compileVariable(self, node):
+        self.writer.writePush(node.kind, node.index)
+
+    def compileArrayEntry(self, node):
+        # Add base to offset
+        self.compileExpression(node.index)
+        self.compileVariable(node.variable)
+        self.writer.writeArithmetic("+")
+        # Update THAT and retrieve
+        self.writer.writePop("POINTER", 1)
+        self.writer.writePush("THAT", 0)
+
+    def compileCall(self, node):
+        nArgs = len(node.arguments)
+        if node.receiver is not None:
+            # Push the object as argument 0
+            self.compileExpression(node.receiver)
+            nArgs += 1
+        for argument in node.arguments:
+            self.compileExpression(argument)
+        self.writer.writeCall(node.name, nArgs)
+
+    def compileBinaryOp(self, node):
+        self.compileExpression(node.left)
+        self.compileExpression(node.right)
+        self.writer.writeArithmetic(node.op)
+
+    def compileUnaryOp(self, node):
+        self.compileExpression(node.operand)
+        # Mark as unary to get right version of '-'
+        self.writer.writeArithmetic("U" + node.op)
+
+    def compileShiftLeft(self, node):
+        operand = node.operand
+        count = node.count
+        if isinstance(operand, JackAST.Variable):
+            # A variable is doubled by pushing it twice
+            self.compileVariable(operand)
+            self.compileVariable(operand)
+            self.writer.writeArithmetic("+")
+            count -= 1
+        else:
+            self.compileExpression(operand)
+
+        # Double the value on the stack, through temp 0 as the VM has no way
+        # to copy it
+        for _ in range(count):
+            self.writer.writePop("TEMP", 0)
+            self.writer.writePush("TEMP", 0)
+            self.writer.writePush("TEMP", 0)
+            self.writer.writeArithmetic("+")
@@ -1,41 +1,34 @@
 from JackTokenizer import JackTokenizer
 from SymbolTable import SymbolTable
-from VMWriter import VMWriter
+import JackAST
 
 
 class CompilationEngine:
     """
-    Effects the actual compilation output. Gets its input from a JackTokenizer
-    and emits its parsed structure into an output file/stream.
+    Parses a class. Gets its input from a JackTokenizer and builds an
+    abstract syntax tree of JackAST nodes, with each variable resolved
+    through the symbol table, for the CodeGenerator to compile. Its parsed
+    structure goes to the CompilationListener, if one is given.
     """
 
-    INDENT = "  "
-
-    def __init__(self, jackFile, vmFile, DEBUG=False):
+    def __init__(self, jackFile, DEBUG=False, listener=None):
         """
-        Creates a new compilation engine with the given input and output. The
-        next routine called must be compileClass().
+        Creates a new compilation engine with the given input. The next
+        routine called must be compileClass().
         """
         self.tokenizer = JackTokenizer(jackFile)  # , DEBUG=DEBUG)
         self.DEBUG = DEBUG
-
-        # Indentation level
-        self.indentLevel = 0
-
-        # Counters for while loops and if statements
-        self.whileCounter = self.ifCounter = 0
+        self.listener = listener
 
         # Initialize the symbol table
-        self.symtab = SymbolTable(DEBUG=True)
-
-        # Initialize the VM writer
-        self.writer = VMWriter(vmFile, DEBUG=True)
+        self.symtab = SymbolTable(DEBUG=DEBUG)
 
     def compileClass(self):
         """
-        Compiles a complete class.
+        Compiles a complete class. Returns its Class node, or None if the
+        input is empty.
         """
-        self.emit(xml="<class>")
+        self.startElement("class")
 
         # Alias self.tokenizer to make code more compact
         t = self.tokenizer
@@ -46,7 +39,7 @@ class CompilationEngine:
             t.advance()
         else:
             # If not, we're done.
-            return
+            return None
 
         self.eatAndEmit("keyword", ["class"])
         (_, self.thisClass) = self.eatAndEmit(
@@ -65,24 +58,26 @@ class CompilationEngine:
                 self.nFields += count
 
         # Expect zero or more subroutineDecs
+        subroutines = []
         while t.tokenType() == "keyword" and t.keyWord() in [
             "constructor",
             "function",
             "method",
         ]:
-            self.compileSubroutine()
+            subroutines.append(self.compileSubroutine())
 
         self.eatAndEmit("symbol", ["}"])
-        self.emit(xml="</class>")
+        self.endElement("class")
 
         # Should not be any more input
         if self.tokenizer.hasMoreTokens():
             raise SyntaxError(
-                "Token after end of class: " + self.tokenizer.currentToken
+                "Token after end of class: {} ({})".format(
+                    t.currentToken, t.location()
+                )
             )
 
-        # Close the VMWriter
-        self.writer.close()
+        return JackAST.Class(self.thisClass, self.nFields, subroutines)
 
     def compileClassVarDec(self):
         """
@@ -90,7 +85,7 @@ class CompilationEngine:
         Should only be called if keyword static or keyword field is the current
         token.
         """
-        self.emit(xml="<classVarDec>")
+        self.startElement("classVarDec")
 
         # Need to save the variable kind for the symbol table
         token = self.eat("keyword", ["static", "field"])
@@ -117,17 +112,17 @@ class CompilationEngine:
             count += 1
 
         self.eatAndEmit("symbol", [";"])
-        self.emit(xml="</classVarDec>")
+        self.endElement("classVarDec")
 
         return count
 
     def compileSubroutine(self):
         """
-        Compiles a complete method, function, or constructor.
-        Should only be called if the current token is one of 'constructor',
-        'function', or 'method'.
+        Compiles a complete method, function, or constructor. Returns its
+        Subroutine node. Should only be called if the current token is one of
+        'constructor', 'function', or 'method'.
         """
-        self.emit(xml="<subroutineDec>")
+        self.startElement("subroutineDec")
         (_, kw) = self.eatAndEmit("keyword", ["constructor", "function", "method"])
 
         # Reset the subroutine symbol table
@@ -153,7 +148,7 @@ class CompilationEngine:
         self.eatAndEmit("symbol", ["("])
         self.compileParameterList()
         self.eatAndEmit("symbol", [")"])
-        self.emit(xml="<subroutineBody>")
+        self.startElement("subroutineBody")
         self.eatAndEmit("symbol", ["{"])
 
         # Expect varDec*. Count the number of local variables.
@@ -161,32 +156,20 @@ class CompilationEngine:
         while t.tokenType() == "keyword" and t.keyWord() == "var":
             nLocals += self.compileVarDec()
 
-        # Generate the VM code to start the function.
-        self.writer.writeFunction("{}.{}".format(self.thisClass, functionName), nLocals)
-
-        # If this subroutine is a constructor, allocate memory for the new object and set the base of the this segment
-        if kw == "constructor":
-            self.writer.writePush("CONST", self.nFields)
-            self.writer.writeCall("Memory.alloc", 1)
-            self.writer.writePop("POINTER", 0)
-
-        # If this subroutine is a method, set the base of the this segment
-        if kw == "method":
-            self.writer.writePush("ARG", 0)
-            self.writer.writePop("POINTER", 0)
-
         # Compile the code of the function
-        self.compileStatements()
+        statements = self.compileStatements()
         self.eatAndEmit("symbol", ["}"])
-        self.emit(xml="</subroutineBody>")
-        self.emit(xml="</subroutineDec>")
+        self.endElement("subroutineBody")
+        self.endElement("subroutineDec")
+
+        return JackAST.Subroutine(kw, functionName, nLocals, statements)
 
     def compileParameterList(self):
         """
         Compiles a (possibly empty) parameter list, not including the
         enclosing '( )'.
         """
-        self.emit(xml="<parameterList>")
+        self.startElement("parameterList")
 
         # Alias for tokenizer
         t = self.tokenizer
@@ -219,13 +202,13 @@ class CompilationEngine:
             else:
                 finished = True
 
-        self.emit(xml="</parameterList>")
+        self.endElement("parameterList")
 
     def compileVarDec(self):
         """
         Compiles a var declaration.
         """
-        self.emit(xml="<varDec>")
+        self.startElement("varDec")
         self.eatAndEmit("keyword", ["var"])
 
         # Expect a type for the variable: one of the keywords 'int', 'char',
@@ -249,42 +232,47 @@ class CompilationEngine:
             nVars += 1
 
         self.eatAndEmit("symbol", [";"])
-        self.emit(xml="</varDec>")
+        self.endElement("varDec")
 
         return nVars
 
     def compileStatements(self):
         """
         Compiles a sequence of statements, not including the enclosing
-        '{ }'.
+        '{ }'. Returns the list of statement nodes.
         """
-        self.emit(xml="<statements>")
+        self.startElement("statements")
 
+        statements = []
         t = self.tokenizer
         while t.tokenType() == "keyword":
             keyword = t.keyWord()
             if keyword == "do":
-                self.compileDo()
+                statements.append(self.compileDo())
             elif keyword == "let":
-                self.compileLet()
+                statements.append(self.compileLet())
             elif keyword == "while":
-                self.compileWhile()
+                statements.append(self.compileWhile())
             elif keyword == "return":
-                self.compileReturn()
+                statements.append(self.compileReturn())
             elif keyword == "if":
-                self.compileIf()
+                statements.append(self.compileIf())
             else:
                 raise SyntaxError(
-                    "Expected statement. Found {}.".format(t.currentToken)
+                    "Expected statement. Found {} ({}).".format(
+                        t.currentToken, t.location()
+                    )
                 )
 
-        self.emit(xml="</statements>")
+        self.endElement("statements")
+
+        return statements
 
     def compileDo(self):
         """
         Compiles a do statement.
         """
-        self.emit(xml="<doStatement>")
+        self.startElement("doStatement")
         self.eatAndEmit("keyword", ["do"])
 
         # Eat the identifier. Can't emit until we know if this is a class or a subroutine.
@@ -304,16 +292,13 @@ class CompilationEngine:
                 # subroutine starts with the class type
                 subroutine = objType
 
-                # Add an argument to the stack for "this"
-                nArgs = 1
-                kind = self.symtab.kindOf(ident)
-                index = self.symtab.indexOf(ident)
-                self.writer.writePush(kind, index)
+                # The object is argument 0
+                receiver = self.variable(ident)
             else:
                 # ident is a class, so method is ident.method and there is no this
                 self.emit(token=token, category="CLASS", state="USE")
                 subroutine = ident
-                nArgs = 0
+                receiver = None
 
             methodToken = self.eat("identifier")
             (_, method) = methodToken
@@ -324,163 +309,129 @@ class CompilationEngine:
             self.emit(token=token, category="SUBROUTINE", state="USE")
             subroutine = self.thisClass + "." + ident
 
-            # Add "this" to the stack
-            nArgs = 1
-            self.writer.writePush("POINTER", 0)
+            # "this" is argument 0
+            receiver = JackAST.KeywordConstant("this")
 
         self.eatAndEmit("symbol", ["("])
-        nArgs += self.compileExpressionList()
+        arguments = self.compileExpressionList()
         self.eatAndEmit("symbol", [")"])
         self.eatAndEmit("symbol", [";"])
 
-        # Call the desired subroutine and consume the returned value
-        self.writer.writeCall(subroutine, nArgs)
-        self.writer.writePop("TEMP", 0)
+        self.endElement("doStatement")
 
-        self.emit(xml="</doStatement>")
+        return JackAST.Do(JackAST.Call(subroutine, receiver, arguments))
 
     def compileLet(self):
         """
         Compiles a let statement.
         """
-        self.emit(xml="<letStatement>")
+        self.startElement("letStatement")
         self.eatAndEmit("keyword", ["let"])
         (_, varName) = self.eatAndEmit("identifier", category="LET", state="USE")
 
         # Look up the variable in the symbol table
-        varKind = self.symtab.kindOf(varName)
-        varIndex = self.symtab.indexOf(varName)
+        variable = self.variable(varName)
 
         # Check for array qualifier
         t = self.tokenizer
-        arrayRef = False
+        index = None
         if t.tokenType() == "symbol" and t.symbol() == "[":
             # Compute the offset
             self.eatAndEmit("symbol", "[")
-            self.compileExpression()
+            index = self.compileExpression()
             self.eatAndEmit("symbol", ["]"])
 
-            # Add the offset to the base. Leave the result on the stack.
-            self.writer.writePush(varKind, varIndex)
-            self.writer.writeArithmetic("+")
-            arrayRef = True
-
         self.eatAndEmit("symbol", ["="])
-        self.compileExpression()
+        value = self.compileExpression()
         self.eatAndEmit("symbol", [";"])
 
-        # Value to save is at the top of the stack.
-        if not arrayRef:
-            # Direct POP
-            self.writer.writePop(varKind, varIndex)
-        else:
-            # Array reference. Save value temporarily while setting THAT.
-            self.writer.writePop("TEMP", 0)
-            self.writer.writePop("POINTER", 1)
-            self.writer.writePush("TEMP", 0)
-            self.writer.writePop("THAT", 0)
+        self.endElement("letStatement")
 
-        self.emit(xml="</letStatement>")
+        return JackAST.Let(variable, index, value)
 
     def compileWhile(self):
         """
         Compiles a while statement.
         """
-        self.emit(xml="<whileStatement>")
+        self.startElement("whileStatement")
         self.eatAndEmit("keyword", ["while"])
-        
-        whileInstance = self.whileCounter
-        self.whileCounter += 1
-        self.writer.writeLabel("WHILE.{}.{}.EXP".format(self.thisClass, whileInstance))
 
         self.eatAndEmit("symbol", ["("])
-        self.compileExpression()
+        condition = self.compileExpression()
         self.eatAndEmit("symbol", [")"])
 
-        self.writer.writeArithmetic("U~")
-        self.writer.writeIf("WHILE.{}.{}.EXIT".format(self.thisClass, whileInstance))
-
         self.eatAndEmit("symbol", ["{"])
-        self.compileStatements()
+        statements = self.compileStatements()
         self.eatAndEmit("symbol", ["}"])
 
-        self.writer.writeGoto("WHILE.{}.{}.EXP".format(self.thisClass, whileInstance))
-        self.writer.writeLabel("WHILE.{}.{}.EXIT".format(self.thisClass, whileInstance))
+        self.endElement("whileStatement")
 
-        self.emit(xml="</whileStatement>")
+        return JackAST.While(condition, statements)
 
     def compileReturn(self):
         """
         Compiles a return statement.
         """
-        self.emit(xml="<returnStatement>")
+        self.startElement("returnStatement")
         self.eatAndEmit("keyword", ["return"])
 
         # If not a ';', expect an expression
         t = self.tokenizer
+        value = None
         if not (t.tokenType() == "symbol" and t.symbol() == ";"):
             # Expect an expression
-            self.compileExpression()
-        else:
-            # void function, so force a 0 onto the stack to return
-            self.writer.writePush("CONST", 0)
+            value = self.compileExpression()
 
-        self.writer.writeReturn()
         self.eatAndEmit("symbol", [";"])
-        self.emit(xml="</returnStatement>")
+        self.endElement("returnStatement")
+
+        return JackAST.Return(value)
 
     def compileIf(self):
         """
         Compiles an if statement, possibly with a trailing else
         clause.
         """
-        self.emit(xml="<ifStatement>")
+        self.startElement("ifStatement")
         self.eatAndEmit("keyword", ["if"])
         self.eatAndEmit("symbol", ["("])
-        self.compileExpression()
+        condition = self.compileExpression()
         self.eatAndEmit("symbol", [")"])
 
-        self.writer.writeArithmetic("U~")
-        ifInstance = self.ifCounter
-        self.ifCounter += 1
-        self.writer.writeIf("IF.{}.{}.ELSE".format(self.thisClass, ifInstance))
-
         self.eatAndEmit("symbol", ["{"])
-        self.compileStatements()
+        statements = self.compileStatements()
         self.eatAndEmit("symbol", ["}"])
 
         t = self.tokenizer
+        elseStatements = None
         if t.tokenType() == "keyword" and t.keyWord() == "else":
-            self.writer.writeGoto("IF.{}.{}.EXIT".format(self.thisClass, ifInstance))
-            self.writer.writeLabel("IF.{}.{}.ELSE".format(self.thisClass, ifInstance))
-
             self.eatAndEmit("keyword", ["else"])
             self.eatAndEmit("symbol", ["{"])
-            self.compileStatements()
+            elseStatements = self.compileStatements()
             self.eatAndEmit("symbol", ["}"])
-            self.writer.writeLabel("IF.{}.{}.EXIT".format(self.thisClass, ifInstance))
-        else:
-            self.writer.writeLabel("IF.{}.{}.ELSE".format(self.thisClass, ifInstance))
 
+        self.endElement("ifStatement")
 
-        self.emit(xml="</ifStatement>")
+        return JackAST.If(condition, statements, elseStatements)
 
     def compileExpression(self):
         """
-        Compiles an expression.
+        Compiles an expression. Returns its node. Jack has no operator
+        precedence, so operators apply from left to right.
         """
-        self.emit(xml="<expression>")
-        self.compileTerm()
+        self.startElement("expression")
+        node = self.compileTerm()
 
         # Look for operator-term pairs
         t = self.tokenizer
         ops = ["+", "-", "*", "/", "&", "|", "<", ">", "="]
         while t.tokenType() == "symbol" and t.symbol() in ops:
             (_, op) = self.eatAndEmit("symbol", ops)
-            self.compileTerm()
-            self.writer.writeArithmetic(op)
+            node = JackAST.BinaryOp(op, node, self.compileTerm())
+
+        self.endElement("expression")
 
-        self.emit(xml="</expression>")
+        return node
 
     def compileTerm(self):
         """
@@ -491,8 +442,9 @@ class CompilationEngine:
         A single lookahead token, which may be one of '[', '(', or '.',
         suffices to distinguish between the three possibilities. Any other
         token is not part of this term and should not be advanced over.
+        Returns the term's node.
         """
-        self.emit(xml="<term>")
+        self.startElement("term")
 
         # Get the current token type
         t = self.tokenizer
@@ -501,30 +453,15 @@ class CompilationEngine:
         # Integer constant
         if tType == "integerConstant":
             (_, value) = self.eatAndEmit("integerConstant")
-            self.writer.writePush("CONST", value)
+            node = JackAST.IntegerConstant(value)
         # String constant
         elif tType == "stringConstant":
             (_, value) = self.eatAndEmit("stringConstant")
-            # Declare space for the string
-            self.writer.writePush("CONST", len(value))
-            self.writer.writeCall("String.new", 1)
-            # Save the contents of the string
-            for c in value:
-                self.writer.writePush("CONST", ord(c))
-                self.writer.writeCall("String.appendChar", 2)
+            node = JackAST.StringConstant(value)
         # Keyword constant
         elif tType == "keyword" and t.keyWord() in ["true", "false", "null", "this"]:
             (_, kw) = self.eatAndEmit("keyword", ["true", "false", "null", "this"])
-            if kw in ["null", "false"]:
-                # Map to 0
-                self.writer.writePush("CONST", 0)
-            elif kw == "true":
-                # Map to -1
-                self.writer.writePush("CONST", 1)
-                self.writer.writeArithmetic("U-")  # NEG
-            else:
-                # this
-                self.writer.writePush("POINTER", 0)
+            node = JackAST.KeywordConstant(kw)
         # Identifier (varName, or array name, or subroutine call)
         elif tType == "identifier":
             (_, ident) = self.eatAndEmit("identifier", category="TERM", state="USE")
@@ -535,32 +472,31 @@ class CompilationEngine:
                     # ident is the array name
                     # Compute the offset
                     self.eatAndEmit("symbol", ["["])
-                    self.compileExpression()
+                    index = self.compileExpression()
                     self.eatAndEmit("symbol", ["]"])
-                    # Add base to offset
-                    self.writer.writePush(self.symtab.kindOf(ident), self.symtab.indexOf(ident))
-                    self.writer.writeArithmetic("+")
-                    # Update THAT and retrieve
-                    self.writer.writePop("POINTER", 1)
-                    self.writer.writePush("THAT", 0)
+                    node = JackAST.ArrayEntry(self.variable(ident), index)
                 elif symbol == "(":
                     # Subroutine call
-                    # ident is the subroutine.
+                    # ident is a method of the current class, as in a do
+                    # statement, and "this" is argument 0.
                     self.eatAndEmit("symbol", ["("])
-                    nArgs = self.compileExpressionList()
+                    arguments = self.compileExpressionList()
                     self.eatAndEmit("symbol", [")"])
-                    self.writer.writeCall(ident, nArgs)
+                    node = JackAST.Call(
+                        self.thisClass + "." + ident,
+                        JackAST.KeywordConstant("this"),
+                        arguments,
+                    )
                 elif symbol == ".":
                     # Method call.
                     # ident is the class name (static method) or the object which will be argument 0 (this).
 
                     # Look up the object's type in the symbol table. If not found, then it is a class name and there is no object to be "this".
                     objType = self.symtab.typeOf(ident)
-                    nArgs = 0
+                    receiver = None
                     if objType is not None:
-                        # Push this onto stack as argument 0
-                        self.writer.writePush(self.symtab.kindOf(ident), self.symtab.indexOf(ident))
-                        nArgs = 1
+                        # The object is argument 0
+                        receiver = self.variable(ident)
                     else:
                         # ident is the class name, so use it
                         objType = ident
@@ -570,49 +506,50 @@ class CompilationEngine:
                         "identifier", category="SUBROUTINE", state="USE"
                     )
                     self.eatAndEmit("symbol", ["("])
-                    nArgs += self.compileExpressionList()
+                    arguments = self.compileExpressionList()
                     self.eatAndEmit("symbol", [")"])
-                    self.writer.writeCall(objType + "." + method, nArgs)
+                    node = JackAST.Call(objType + "." + method, receiver, arguments)
                 else:
-                    # Next token not a symbol, so ident is a simple variable identifier.
-                    varKind = self.symtab.kindOf(ident)
-                    varIndex = self.symtab.indexOf(ident)
-                    self.writer.writePush(varKind, varIndex)
+                    # ident is a simple variable identifier.
+                    node = self.variable(ident)
+            else:
+                # Next token not a symbol, so ident is a simple variable identifier.
+                node = self.variable(ident)
         # Sub-expression
         elif tType == "symbol" and t.symbol() == "(":
             self.eatAndEmit("symbol", ["("])
-            self.compileExpression()
+            node = self.compileExpression()
             self.eatAndEmit("symbol", [")"])
         # Unary op and term
         elif tType == "symbol" and t.symbol() in ["-", "~"]:
             (_, op) = self.eatAndEmit("symbol", ["-", "~"])
-            self.compileTerm()
-            # Mark as unary to get right version of '-'
-            self.writer.writeArithmetic("U" + op)
+            node = JackAST.UnaryOp(op, self.compileTerm())
         else:
             # Not a term
-            raise SyntaxError("Expected term, found {}.".format(t.currentToken))
+            raise SyntaxError(
+                "Expected term, found {} ({}).".format(t.currentToken, t.location())
+            )
+
+        self.endElement("term")
 
-        self.emit(xml="</term>")
+        return node
 
     def compileExpressionList(self):
         """
         Compiles a (possibly empty) comma-separated list of expressions.
-        Returns the number of expressions compiled.
+        Returns the list of their nodes.
         """
-        self.emit(xml="<expressionList>")
+        self.startElement("expressionList")
 
         # Get the initial token type
         t = self.tokenizer
         tType = t.tokenType()
 
-        # Count the expressions in the list
-        nExpressions = 0
+        expressions = []
 
         # Closing parenthesis ends the list
         while not (tType == "symbol" and t.symbol() == ")"):
-            nExpressions += 1
-            self.compileExpression()
+            expressions.append(self.compileExpression())
 
             # Expect an optional ','
             if t.tokenType() == "symbol" and t.symbol() == ",":
@@ -621,9 +558,18 @@ class CompilationEngine:
             # Update the tType
             tType = t.tokenType()
 
-        self.emit(xml="</expressionList>")
+        self.endElement("expressionList")
 
-        return nExpressions
+        return expressions
+
+    def variable(self, name):
+        """
+        Returns a Variable node for the named variable, resolved in the
+        symbol table.
+        """
+        return JackAST.Variable(
+            name, self.symtab.kindOf(name), self.symtab.indexOf(name)
+        )
 
     def eat(self, tokenType, tokenVals=None):
         """
@@ -647,8 +593,11 @@ class CompilationEngine:
         # expected.
         if not (tType == tokenType and (not tokenVals or tVal in tokenVals)):
             raise SyntaxError(
-                "Expected {} {}. Found {}.".format(
-                    tokenType, " or ".join(tokenVals or []), t.currentToken
+                "Expected {} {}. Found {} ({}).".format(
+                    tokenType,
+                    " or ".join(tokenVals or []),
+                    t.currentToken,
+                    t.location(),
                 )
             )
 
@@ -658,57 +607,46 @@ class CompilationEngine:
         # Return the actual token type and value
         return (tType, tVal)
 
-    def emit(self, token=None, category=None, state=None, varType=None, xml=None):
+    def startElement(self, tag):
+        """
+        Tells the listener, if any, that the nonterminal tag starts.
+        """
+        if self.listener:
+            self.listener.startElement(tag)
+
+    def endElement(self, tag):
         """
-        Emit the provided XML or token as XML to the xmlFile.
-        Will indent based on the current indentLevel.
+        Tells the listener, if any, that the nonterminal tag ends.
         """
-        # If XML code not provided, create it from the token type and value
-        if not xml:
-            (tokenType, tokenVal) = token
+        if self.listener:
+            self.listener.endElement(tag)
 
-            # Handle symbol table additions/lookups
-            index = None
-            if state == "DEFINE" and category in ["STATIC", "FIELD", "ARG", "VAR"]:
-                index = self.symtab.define(tokenVal, varType, category)
+    def emit(self, token, category=None, state=None, varType=None):
+        """
+        Defines the token in the symbol table if it is a variable declaration,
+        and passes it on to the listener, if any, with what the symbol table
+        knows about it.
+        """
+        (tokenType, tokenVal) = token
 
-            if state == "USE" and category in ["LET", "TERM"]:
-                category = self.symtab.kindOf(tokenVal)
-                if category:
-                    varType = self.symtab.typeOf(tokenVal)
-                    index = self.symtab.indexOf(tokenVal)
-                else:
-                    category = "CLASS OR SUBROUTINE"
-
-            # Define additional output fields
-            fields = ""
-            if category is not None:
-                fields += " category={}".format(category)
-            if state is not None:
-                fields += " state={}".format(state)
-            if varType is not None:
-                fields += " varType={}".format(varType)
-            if index is not None:
-                fields += " index={}".format(index)
-
-            xml = "<{0}{2}>{1}</{0}>".format(
-                tokenType, self.xmlProtect(tokenVal), fields
-            )
+        # Handle symbol table additions
+        index = None
+        if state == "DEFINE" and category in ["STATIC", "FIELD", "ARG", "VAR"]:
+            index = self.symtab.define(tokenVal, varType, category)
 
-        else:
-            # If the XML starts with '</', reduce the indent level
-            if xml[:2] == "</":
-                self.indentLevel = self.indentLevel - 1
+        if not self.listener:
+            return
 
-        # Output the XML, indented to the current level
-        output = "{}{}\n".format(self.INDENT * self.indentLevel, xml)
-        self.writer.writeComment(output)
-        if self.DEBUG:
-            print(output, end="")
+        # Look up the details of variables used
+        if state == "USE" and category in ["LET", "TERM"]:
+            category = self.symtab.kindOf(tokenVal)
+            if category:
+                varType = self.symtab.typeOf(tokenVal)
+                index = self.symtab.indexOf(tokenVal)
+            else:
+                category = "CLASS OR SUBROUTINE"
 
-        # If the XML does not contain '</', increase the indent level
-        if "</" not in xml:
-            self.indentLevel = self.indentLevel + 1
+        self.listener.terminal(tokenType, tokenVal, category, state, varType, index)
 
     def eatAndEmit(
         self, tokenType, tokenVals=None, category=None, state=None, varType=None
@@ -721,14 +659,3 @@ class CompilationEngine:
 
         # Return the token in case the caller wants it
         return token
-
-    def xmlProtect(self, token):
-        # Protect <, >, and & tokens from XML
-        if token == "<":
-            return "&lt;"
-        elif token == ">":
-            return "&gt;"
-        elif token == "&":
-            return "&amp;"
-        else:
-            return token
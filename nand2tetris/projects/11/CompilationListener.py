@@ -0,0 +1,102 @@
+import sys
+
+
+class CompilationListener:
+    """
+    Receives the parse tree from a CompilationEngine as it is built, and the
+    VM commands the CodeGenerator then writes. Every method does nothing;
+    subclasses override the ones they need. An engine without a listener
+    skips all of this work.
+    """
+
+    def startElement(self, tag):
+        """
+        Called when a nonterminal, such as "class" or "term", starts.
+        """
+        pass
+
+    def endElement(self, tag):
+        """
+        Called when the nonterminal last started ends.
+        """
+        pass
+
+    def terminal(self, tokenType, value, category, state, varType, index):
+        """
+        Called for each token consumed. category, state, varType and index
+        describe identifiers: how they are used, whether this defines or uses
+        them, and their type and symbol table index, where known.
+        """
+        pass
+
+    def vmCommand(self, command):
+        """
+        Called with the text of each VM command written.
+        """
+        pass
+
+
+class XMLListener(CompilationListener):
+    """
+    Writes the parse tree as indented XML, with the identifier details as
+    attributes of the terminals.
+    """
+
+    INDENT = "  "
+
+    def __init__(self, xmlFile):
+        """
+        xmlFile is an open file (or stream) for the XML.
+        """
+        self.xmlFile = xmlFile
+        self.indentLevel = 0
+
+    def write(self, xml):
+        self.xmlFile.write("{}{}\n".format(self.INDENT * self.indentLevel, xml))
+
+    def startElement(self, tag):
+        self.write("<{}>".format(tag))
+        self.indentLevel += 1
+
+    def endElement(self, tag):
+        self.indentLevel -= 1
+        self.write("</{}>".format(tag))
+
+    def terminal(self, tokenType, value, category, state, varType, index):
+        fields = ""
+        if category is not None:
+            fields += " category={}".format(category)
+        if state is not None:
+            fields += " state={}".format(state)
+        if varType is not None:
+            fields += " varType={}".format(varType)
+        if index is not None:
+            fields += " index={}".format(index)
+
+        self.write(
+            "<{0}{2}>{1}</{0}>".format(tokenType, self.xmlProtect(value), fields)
+        )
+
+    def xmlProtect(self, token):
+        # Protect <, >, and & tokens from XML
+        if token == "<":
+            return "&lt;"
+        elif token == ">":
+            return "&gt;"
+        elif token == "&":
+            return "&amp;"
+        else:
+            return token
+
+
+class TraceListener(XMLListener):
+    """
+    Prints the parse tree to stdout as it is built, followed by the VM
+    commands compiled from it.
+    """
+
+    def __init__(self, stream=None):
+        XMLListener.__init__(self, stream or sys.stdout)
+
+    def vmCommand(self, command):
+        self.write("// vm: " + command)
@@ -0,0 +1,225 @@
+class Node:
+    """
+    Base of the abstract syntax tree node classes. The CompilationEngine
+    builds a tree of these for each class; the JackOptimizer rewrites it and
+    the CodeGenerator compiles it. Each node class lists its fields in
+    __slots__, in the order its constructor takes them.
+    """
+
+    __slots__ = ()
+
+    def __repr__(self):
+        return "{}({})".format(
+            type(self).__name__,
+            ", ".join(repr(getattr(self, field)) for field in self.__slots__),
+        )
+
+
+class Class(Node):
+    """
+    A class: its name, the number of fields in each of its objects, and its
+    subroutines.
+    """
+
+    __slots__ = ("name", "nFields", "subroutines")
+
+    def __init__(self, name, nFields, subroutines):
+        self.name = name
+        self.nFields = nFields
+        self.subroutines = subroutines
+
+
+class Subroutine(Node):
+    """
+    A constructor, function or method (kind), with the number of local
+    variables it declares and the statements of its body.
+    """
+
+    __slots__ = ("kind", "name", "nLocals", "statements")
+
+    def __init__(self, kind, name, nLocals, statements):
+        self.kind = kind
+        self.name = name
+        self.nLocals = nLocals
+        self.statements = statements
+
+
+# Statements
+
+
+class Let(Node):
+    """
+    let variable = value; or, if index is not None,
+    let variable[index] = value;
+    """
+
+    __slots__ = ("variable", "index", "value")
+
+    def __init__(self, variable, index, value):
+        self.variable = variable
+        self.index = index
+        self.value = value
+
+
+class If(Node):
+    """
+    An if statement. elseStatements is None if there is no else clause.
+    """
+
+    __slots__ = ("condition", "statements", "elseStatements")
+
+    def __init__(self, condition, statements, elseStatements):
+        self.condition = condition
+        self.statements = statements
+        self.elseStatements = elseStatements
+
+
+class While(Node):
+    """
+    A while statement.
+    """
+
+    __slots__ = ("condition", "statements")
+
+    def __init__(self, condition, statements):
+        self.condition = condition
+        self.statements = statements
+
+
+class Do(Node):
+    """
+    A do statement: a Call whose value is discarded.
+    """
+
+    __slots__ = ("call",)
+
+    def __init__(self, call):
+        self.call = call
+
+
+class Return(Node):
+    """
+    A return statement. value is None in a void subroutine.
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+# Expressions
+
+
+class IntegerConstant(Node):
+    """
+    An integer constant, 0 to 32767.
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class StringConstant(Node):
+    """
+    A string constant, without its quotes.
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class KeywordConstant(Node):
+    """
+    One of the keywords true, false, null and this.
+    """
+
+    __slots__ = ("keyword",)
+
+    def __init__(self, keyword):
+        self.keyword = keyword
+
+
+class Variable(Node):
+    """
+    A variable, with the kind (STATIC, FIELD, ARG or VAR) and index the
+    symbol table gave it. kind and index are None if it was not declared.
+    """
+
+    __slots__ = ("name", "kind", "index")
+
+    def __init__(self, name, kind, index):
+        self.name = name
+        self.kind = kind
+        self.index = index
+
+
+class ArrayEntry(Node):
+    """
+    variable[index].
+    """
+
+    __slots__ = ("variable", "index")
+
+    def __init__(self, variable, index):
+        self.variable = variable
+        self.index = index
+
+
+class Call(Node):
+    """
+    A call of the subroutine with the full name given, such as
+    "Output.printInt". For a method, receiver is the object passed as
+    argument 0 (a Variable, or the KeywordConstant this); otherwise it is
+    None.
+    """
+
+    __slots__ = ("name", "receiver", "arguments")
+
+    def __init__(self, name, receiver, arguments):
+        self.name = name
+        self.receiver = receiver
+        self.arguments = arguments
+
+
+class BinaryOp(Node):
+    """
+    left op right, where op is one of + - * / & | < > =.
+    """
+
+    __slots__ = ("op", "left", "right")
+
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+
+
+class UnaryOp(Node):
+    """
+    op operand, where op is - or ~.
+    """
+
+    __slots__ = ("op", "operand")
+
+    def __init__(self, op, operand):
+        self.op = op
+        self.operand = operand
+
+
+class ShiftLeft(Node):
+    """
+    operand * 2**count. Jack has no shift operator; the JackOptimizer puts
+    these in place of multiplications, and they are compiled by adding the
+    value to itself count times.
+    """
+
+    __slots__ = ("operand", "count")
+
+    def __init__(self, operand, count):
+        self.operand = operand
+        self.count = count
@@ -1,14 +1,31 @@
-import sys, os, os.path
+import sys, os, os.path, argparse
 from CompilationEngine import CompilationEngine
+from CompilationListener import XMLListener, TraceListener
+from JackOptimizer import JackOptimizer
+from CodeGenerator import CodeGenerator
 
 DEBUG = False
 
 # Get Jack file or directory of files from the command line
-try:
-    arg = sys.argv[1]
-except IndexError as e:
-    print("Usage:JackAnalyzer.py file.jack|directory")
-    sys.exit(1)
+argparser = argparse.ArgumentParser(description="Jack to VM compiler")
+argparser.add_argument("path", help="file.jack or directory of .jack files")
+output = argparser.add_mutually_exclusive_group()
+output.add_argument(
+    "--xml", action="store_true", help="also write each parse tree to an .xml file"
+)
+output.add_argument(
+    "--trace",
+    action="store_true",
+    help="print each parse tree, with the VM commands it produces",
+)
+argparser.add_argument(
+    "--fold",
+    action="store_true",
+    help="fold arithmetic on constants, remove identities such as x*1, and "
+    "multiply by constants with additions instead of Math.multiply",
+)
+args = argparser.parse_args()
+arg = args.path
 
 # If the argument has ".jack" in it, assume it's a file, otherwise a folder
 jackFiles = []
@@ -22,13 +39,35 @@ else:
 if DEBUG:
     print("jackFiles:\t" + str(jackFiles))
 
-# Main Loop
+# Main Loop: parse each class to a tree, optimize the tree, and compile it
+optimizer = JackOptimizer(passes=["fold"] if args.fold else [], DEBUG=DEBUG)
 for jackFile in jackFiles:
     # Generate the output VM file name
     vmFile = jackFile.replace(".jack", ".vm")
     if DEBUG:
         print("jackFile: {:<30}vmFile: {}".format(jackFile, vmFile))
 
-    compEngine = CompilationEngine(jackFile=jackFile, vmFile=vmFile, DEBUG=DEBUG)
-    compEngine.compileClass()
+    xmlFile = None
+    listener = None
+    if args.xml:
+        xmlFile = open(jackFile.replace(".jack", ".xml"), mode="w")
+        listener = XMLListener(xmlFile)
+    elif args.trace:
+        listener = TraceListener()
 
+    compEngine = CompilationEngine(jackFile=jackFile, DEBUG=DEBUG, listener=listener)
+    tree = compEngine.compileClass()
+    if tree is not None:
+        tree = optimizer.optimize(tree)
+        CodeGenerator(vmFile, DEBUG=DEBUG, listener=listener).compileClass(tree)
+
+    if xmlFile:
+        xmlFile.close()
+
+if args.fold:
+    for name in JackOptimizer.FOLDS:
+        print(
+            "{:<26}{:>6}".format(
+                name[0].upper() + name[1:] + ":", optimizer.stats.get(name, 0)
+            )
+        )
@@ -0,0 +1,293 @@
+import JackAST
+
+
+def wrap(value):
+    """
+    Returns value as a 16-bit two's complement number, as the Hack computer
+    would hold it.
+    """
+    return (value + 0x8000) % 0x10000 - 0x8000
+
+
+class JackOptimizer:
+    """
+    Runs a pipeline of optimization passes over the abstract syntax tree of a
+    class, between the CompilationEngine that builds it and the
+    CodeGenerator that compiles it. Each pass is a method of this class that
+    takes a Class node and returns the (possibly new) Class node to compile.
+    """
+
+    # The passes, in the order they run. Only those asked for are run.
+    PASSES = ["fold"]
+
+    # The statistics the fold pass keeps
+    FOLDS = ["constants folded", "identities removed", "multiplications reduced"]
+
+    # Operators on constants, by the values Jack programs see. Division
+    # truncates towards zero, as Math.divide does. Comparisons are folded only
+    # where the difference of the operands does not overflow, so that they
+    # mean the same however the VM implementation compares.
+    UNARY = {"-": lambda x: wrap(-x), "~": lambda x: ~x}
+    BINARY = {
+        "+": lambda x, y: wrap(x + y),
+        "-": lambda x, y: wrap(x - y),
+        "*": lambda x, y: wrap(x * y),
+        "/": lambda x, y: (
+            None
+            if y == 0 or -0x8000 in (x, y)
+            else (abs(x) // abs(y)) * (1 if (x < 0) == (y < 0) else -1)
+        ),
+        "&": lambda x, y: x & y,
+        "|": lambda x, y: x | y,
+        "<": lambda x, y: None if wrap(x - y) != x - y else -(x < y),
+        ">": lambda x, y: None if wrap(x - y) != x - y else -(x > y),
+        "=": lambda x, y: -(x == y),
+    }
+
+    # The values of the keyword constants
+    KEYWORDS = {"true": -1, "false": 0, "null": 0}
+
+    # Multiplications of a variable by constants that need at most this many
+    # additions, one for each one bit below the top one, are reduced to
+    # doublings and additions. Powers of two need none.
+    MULTIPLY_ADDS = 3
+
+    def __init__(self, passes=(), DEBUG=False):
+        """
+        Creates an optimizer that runs the passes named.
+        """
+        for name in passes:
+            if name not in self.PASSES:
+                raise ValueError("Unknown optimization pass: " + name)
+        self.passes = passes
+        self.DEBUG = DEBUG
+
+        # Statistics, by name, for the passes to count what they do
+        self.stats = {}
+
+    def optimize(self, tree):
+        """
+        Runs the passes over the Class node tree. Returns the Class node to
+        compile.
+        """
+        for name in self.PASSES:
+            if name in self.passes:
+                if self.DEBUG:
+                    print("DEBUG(JackOptimizer): {} {}".format(name, tree.name))
+                tree = getattr(self, name)(tree)
+        return tree
+
+    def count(self, name):
+        """
+        Adds one to the statistic named.
+        """
+        self.stats[name] = self.stats.get(name, 0) + 1
+
+    def transform(self, node, function):
+        """
+        Rewrites the tree under node from the bottom up: replaces each node
+        below it with function(node), once the same has been done to that
+        node's own children. Returns node.
+        """
+        for field in node.__slots__:
+            value = getattr(node, field)
+            if isinstance(value, JackAST.Node):
+                setattr(node, field, function(self.transform(value, function)))
+            elif isinstance(value, list):
+                setattr(
+                    node,
+                    field,
+                    [
+                        function(self.transform(item, function))
+                        if isinstance(item, JackAST.Node)
+                        else item
+                        for item in value
+                    ],
+                )
+        return node
+
+    def fold(self, tree):
+        """
+        Folds operators on constants, removes operations that leave their
+        operand as it is, such as x + 0, x * 1 and ~~x, and replaces
+        multiplications by suitable constants with doublings and additions,
+        which are far cheaper than calls to Math.multiply.
+        """
+        return self.transform(tree, self.foldNode)
+
+    def foldNode(self, node):
+        """
+        Returns the folded form of node, whose operands are already folded.
+        """
+        if isinstance(node, JackAST.UnaryOp):
+            return self.foldUnary(node)
+        if isinstance(node, JackAST.BinaryOp):
+            return self.foldBinary(node)
+        return node
+
+    def foldUnary(self, node):
+        op = node.op
+        operand = node.operand
+        value = self.constantValue(operand)
+        if value is not None:
+            if isinstance(operand, JackAST.IntegerConstant) and (
+                (op == "-" and value > 0) or (op == "~" and value == 0x7FFF)
+            ):
+                # Already as simple as a negative constant can be
+                return node
+            self.count("constants folded")
+            return self.constant(self.UNARY[op](value))
+
+        # --x and ~~x
+        if isinstance(operand, JackAST.UnaryOp) and operand.op == op:
+            self.count("identities removed")
+            return operand.operand
+        return node
+
+    def foldBinary(self, node):
+        op = node.op
+        left = node.left
+        right = node.right
+        x = self.constantValue(left)
+        y = self.constantValue(right)
+
+        if x is not None and y is not None:
+            value = self.BINARY[op](x, y)
+            if value is None:
+                return node
+            self.count("constants folded")
+            return self.constant(value)
+
+        # Put the constant on the right of the operators that commute
+        if x is not None and op in "+*&|=":
+            (left, right, y) = (right, left, x)
+        elif x is not None:
+            # 0 - x
+            if op == "-" and x == 0:
+                self.count("identities removed")
+                return self.negate(right)
+            return node
+        if y is None:
+            return node
+
+        # x + 0, x - 0, x | 0, x * 1, x / 1, x & -1
+        if (
+            (y == 0 and op in "+-|")
+            or (y == 1 and op in "*/")
+            or (y == -1 and op == "&")
+        ):
+            self.count("identities removed")
+            return left
+
+        # x * -1 and x / -1
+        if y == -1 and op in "*/":
+            self.count("identities removed")
+            return self.negate(left)
+
+        # x * 0, x & 0 and x | -1, if x has no side effects to keep
+        if ((y == 0 and op in "*&") or (y == -1 and op == "|")) and self.isPure(left):
+            self.count("identities removed")
+            return self.constant(y)
+
+        if op == "*":
+            product = self.multiply(left, y)
+            if product is not None:
+                self.count("multiplications reduced")
+                return product
+
+        return node
+
+    def multiply(self, operand, factor):
+        """
+        Returns operand * factor as doublings and additions, or None if
+        Math.multiply is the better way to compute it.
+        """
+        negative = factor < 0
+        factor = abs(factor)
+        if factor == 0:
+            return None
+        if factor & (factor - 1) == 0:
+            # A power of two
+            product = self.shift(operand, factor.bit_length() - 1)
+        elif (
+            isinstance(operand, JackAST.Variable)
+            and bin(factor).count("1") - 1 <= self.MULTIPLY_ADDS
+        ):
+            # operand can be pushed again for each one bit, below the top one
+            product = operand
+            for bit in bin(factor)[3:]:
+                product = self.shift(product, 1)
+                if bit == "1":
+                    product = JackAST.BinaryOp(
+                        "+",
+                        product,
+                        JackAST.Variable(operand.name, operand.kind, operand.index),
+                    )
+        else:
+            return None
+
+        return self.negate(product) if negative else product
+
+    def shift(self, node, count):
+        """
+        Returns node * 2**count.
+        """
+        if count == 0:
+            return node
+        if isinstance(node, JackAST.ShiftLeft):
+            return JackAST.ShiftLeft(node.operand, node.count + count)
+        return JackAST.ShiftLeft(node, count)
+
+    def negate(self, node):
+        """
+        Returns -node, removing a negation already there.
+        """
+        if isinstance(node, JackAST.UnaryOp) and node.op == "-":
+            return node.operand
+        return JackAST.UnaryOp("-", node)
+
+    def constantValue(self, node):
+        """
+        Returns the value of node if it is a constant, otherwise None.
+        """
+        if isinstance(node, JackAST.IntegerConstant):
+            return node.value
+        if isinstance(node, JackAST.KeywordConstant):
+            return self.KEYWORDS.get(node.keyword)
+        if isinstance(node, JackAST.UnaryOp):
+            value = self.constantValue(node.operand)
+            if value is not None:
+                return self.UNARY[node.op](value)
+        return None
+
+    def constant(self, value):
+        """
+        Returns a node for the constant value. Only 0 to 32767 can be pushed,
+        so negative values are negated or, for -32768, inverted.
+        """
+        if value >= 0:
+            return JackAST.IntegerConstant(value)
+        if value == -0x8000:
+            return JackAST.UnaryOp("~", JackAST.IntegerConstant(0x7FFF))
+        return JackAST.UnaryOp("-", JackAST.IntegerConstant(-value))
+
+    def isPure(self, node):
+        """
+        Is node an expression without side effects, which need not be
+        evaluated if its value is not needed? Calls are not, and neither are
+        string constants, which allocate memory, or divisions, which may call
+        Sys.error.
+        """
+        if isinstance(node, (JackAST.Call, JackAST.StringConstant)):
+            return False
+        if isinstance(node, JackAST.BinaryOp):
+            return (
+                node.op not in "*/"
+                and self.isPure(node.left)
+                and self.isPure(node.right)
+            )
+        if isinstance(node, (JackAST.UnaryOp, JackAST.ShiftLeft)):
+            return self.isPure(node.operand)
+        if isinstance(node, JackAST.ArrayEntry):
+            return self.isPure(node.index)
+        return True
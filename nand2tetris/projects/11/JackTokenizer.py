@@ -1,6 +1,27 @@
 import re
 
 
+class Token:
+    """
+    A token of Jack source: its kind (one of the token types "keyword",
+    "symbol", "identifier", "integerConstant" and "stringConstant"), its text,
+    and the line and column where it starts, both counted from 1.
+    """
+
+    __slots__ = ("kind", "value", "line", "column")
+
+    def __init__(self, kind, value, line, column):
+        self.kind = kind
+        self.value = value
+        self.line = line
+        self.column = column
+
+    def __repr__(self):
+        return "Token({!r}, {!r}, {}, {})".format(
+            self.kind, self.value, self.line, self.column
+        )
+
+
 class JackTokenizer:
     """
     Removes all comments and white space from the input stream and breaks it
@@ -32,40 +53,24 @@ class JackTokenizer:
         "this",
     ]
 
-    # Regular expressions (compiled for speed)
-    P_BLANK_LINES = re.compile(r"(?m)^\s*$\n")
-    P_MULTI_LINE_COMMENT = re.compile(r"(?s)\/\*.*?\*\/")
-    P_SINGLE_LINE_COMMENT = re.compile(r"(?m)\s*//.*$")
-
-    R_KEYWORD = r"\b(?:" + "|".join(KEYWORDS) + r")\b"
-    P_KEYWORD = re.compile(R_KEYWORD)
+    KEYWORD_SET = frozenset(KEYWORDS)
 
     R_SYMBOL = r"[\]\-{}()[.,;+*/&|<>=~]"
-    P_SYMBOL = re.compile(R_SYMBOL)
-
-    R_INTEGER_CONSTANT = r"[1-3]?\d{1,4}"
-    P_INTEGER_CONSTANT = re.compile(R_INTEGER_CONSTANT)
-
-    R_STRING_CONSTANT = r'"[^"]*"'
-    P_STRING_CONSTANT = re.compile(R_STRING_CONSTANT)
-
-    R_IDENTIFIER = r"[A-Za-z_][0-9A-Za-z_]*"
-    P_IDENTIFIER = re.compile(R_IDENTIFIER)
-
-    R_TOKEN = (
-        r"(?:"
-        + R_KEYWORD
-        + r")|(?:"
-        + R_SYMBOL
-        + r")|(?:"
-        + R_INTEGER_CONSTANT
-        + r")|(?:"
-        + R_STRING_CONSTANT
-        + r")|(?:"
-        + R_IDENTIFIER
-        + r")"
+
+    # One alternative for each kind of lexeme, tried in order at the cursor.
+    # Strings come before comments, so "//" or "/*" inside a string literal
+    # stays in the string. A quote or "/*" left unmatched by its alternative
+    # is unterminated. Identifiers that are keywords are told apart later.
+    P_LEXEME = re.compile(
+        r"(?P<space>\s+)"
+        r'|(?P<stringConstant>"[^"\n]*")'
+        r"|(?P<comment>//[^\n]*|/\*.*?\*/)"
+        r'|(?P<unterminated>"|/\*)'
+        r"|(?P<integerConstant>\d+)"
+        r"|(?P<identifier>[A-Za-z_][0-9A-Za-z_]*)"
+        r"|(?P<symbol>" + R_SYMBOL + r")",
+        re.DOTALL,
     )
-    P_TOKEN = re.compile(R_TOKEN)
 
     def __init__(self, jackFile, tokenizerFile=None, DEBUG=False):
         """
@@ -79,25 +84,15 @@ class JackTokenizer:
         s = f.read()
         f.close()
 
-        # Remove multi-line comments. Comments in string literals will be a
-        # problem.
-        s = JackTokenizer.P_MULTI_LINE_COMMENT.sub("", s)
-
-        # Remove single line comments. Comments in string literals will be a
-        # problem.
-        s = JackTokenizer.P_SINGLE_LINE_COMMENT.sub("", s)
-
-        # Remove any blank lines.
-        s = JackTokenizer.P_BLANK_LINES.sub("", s)
-
-        # Save the comment-free Jack code after stripping any leading white
-        # space.
-        self.jackData = s.lstrip()
-        if self.DEBUG:
-            print(s)
+        # Split the whole file into Tokens, classified once here
+        self.jackFile = jackFile
+        self.tokens = self.scan(s, jackFile)
+        self.position = 0
 
         # Initialize the current token
+        self.current = None
         self.currentToken = None
+        self.currentType = None
 
         # Open and initializae the tokenizer file, if specified
         self.tokenizerFile = None
@@ -105,12 +100,56 @@ class JackTokenizer:
             self.tokenizerFile = open(tokenizerFile, mode="w")
             self.tokenizerFile.write("<tokens>\n")
 
+    @staticmethod
+    def scan(s, filename="<input>"):
+        """
+        Returns the Tokens of the Jack source s, skipping white space and
+        comments. One pass with a cursor, so linear in the length of s.
+        """
+        tokens = []
+        match = JackTokenizer.P_LEXEME.match
+        keywords = JackTokenizer.KEYWORD_SET
+        pos = 0
+        end = len(s)
+
+        # Line number at the cursor, and where that line starts
+        line = 1
+        lineStart = 0
+
+        while pos < end:
+            m = match(s, pos)
+            if m is None or m.lastgroup == "unterminated":
+                if m is None:
+                    what = "Unexpected character " + repr(s[pos])
+                elif s[pos] == '"':
+                    what = "Unterminated string"
+                else:
+                    what = "Unterminated comment"
+                raise SyntaxError(
+                    "{} at {} line {}, column {}".format(
+                        what, filename, line, pos - lineStart + 1
+                    )
+                )
+            kind = m.lastgroup
+            if kind == "space" or kind == "comment":
+                # Only these can span lines
+                newlines = s.count("\n", pos, m.end())
+                if newlines:
+                    line += newlines
+                    lineStart = s.rindex("\n", pos, m.end()) + 1
+            else:
+                token = m.group()
+                if kind == "identifier" and token in keywords:
+                    kind = "keyword"
+                tokens.append(Token(kind, token, line, pos - lineStart + 1))
+            pos = m.end()
+        return tokens
+
     def hasMoreTokens(self):
         """
         Do we have more tokens in the input?
         """
-        # Any non-whitespace character comprises a token.
-        if self.jackData != "":
+        if self.position < len(self.tokens):
             return True
 
         # If there are no more tokens and we are logging the tokenizer output,
@@ -128,44 +167,29 @@ class JackTokenizer:
         This method should only be called if hasMoreTokens() is True.
         Initially there is no current token.
         """
-        # Look for a token at the beginning of the Jack data
-        m = JackTokenizer.P_TOKEN.match(self.jackData)
+        token = self.tokens[self.position]
+        self.position += 1
+        self.current = token
+        self.currentToken = token.value
+        self.currentType = token.kind
 
-        # We should always match something at the beginning of the Jack data
-        # (or advance should not have been called)
-        assert m, "Did not match?"
-        assert m.start() == 0, "Did not match at the beginning?"
-
-        # Set the current token to the portion which matched
-        self.currentToken = self.jackData[: m.end()]
-
-        # Strip the token and any leading white space from the Jack data
-        self.jackData = self.jackData[m.end() :].lstrip()
-        # if self.DEBUG: print('{:50}Next 10 chars: ^{}^'.format(self.currentToken, self.jackData[:10].replace('\n', '\\n')))
+    def location(self):
+        """
+        Returns where the current token is, for error messages.
+        """
+        token = self.current
+        if token is None:
+            return self.jackFile
+        return "{} line {}, column {}".format(self.jackFile, token.line, token.column)
 
     def tokenType(self):
         """
         Returns the type of the current token.
         """
-        tokenType = None
-        if JackTokenizer.P_KEYWORD.fullmatch(self.currentToken):
-            tokenType = "keyword"
-        elif JackTokenizer.P_SYMBOL.fullmatch(self.currentToken):
-            tokenType = "symbol"
-        elif JackTokenizer.P_IDENTIFIER.fullmatch(self.currentToken):
-            tokenType = "identifier"
-        elif JackTokenizer.P_INTEGER_CONSTANT.fullmatch(self.currentToken):
-            tokenType = "integerConstant"
-        elif JackTokenizer.P_STRING_CONSTANT.fullmatch(self.currentToken):
-            tokenType = "stringConstant"
-
-        if tokenType:
-            if self.DEBUG:
-                print("{} is a {}".format(self.currentToken, tokenType))
-            return tokenType
-
-        # Should never get here
-        assert False, "Unrecognized token" + self.currentToken
+        tokenType = self.currentType
+        if self.DEBUG:
+            print("{} is a {}".format(self.currentToken, tokenType))
+        return tokenType
 
     def keyWord(self):
         """
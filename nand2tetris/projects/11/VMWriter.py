@@ -17,24 +17,34 @@ class VMWriter:
         "VAR": "local",
     }
 
-    def __init__(self, vmFile, DEBUG=False):
+    def __init__(self, vmFile, DEBUG=False, listener=None):
         """
-        Creates a new file and prepares it for writing.
+        Creates a new file and prepares it for writing. Each command written
+        is also passed to the CompilationListener, if one is given.
         """
         self.DEBUG = DEBUG
+        self.listener = listener
         self.vmFile = vmFile
         self.file = open(self.vmFile, mode="w")
 
         if self.DEBUG:
             print("DEBUG(VMWriter): Opened {} for writing".format(self.vmFile))
 
+    def write(self, command):
+        """
+        Writes one VM command.
+        """
+        self.file.write(command + "\n")
+        if self.listener:
+            self.listener.vmCommand(command)
+
     def writePush(self, segment, index):
         """
         Writes a VM push command.
         """
         if self.DEBUG:
             print("DEBUG(VMWriter): push {} {}".format(segment, index))
-        self.file.write("push {} {}\n".format(self.segments[segment], index))
+        self.write("push {} {}".format(self.segments[segment], index))
 
     def writePop(self, segment, index):
         """
@@ -42,7 +52,7 @@ class VMWriter:
         """
         if self.DEBUG:
             print("DEBUG(VMWriter): pop {} {}".format(segment, index))
-        self.file.write("pop {} {}\n".format(self.segments[segment], index))
+        self.write("pop {} {}".format(self.segments[segment], index))
 
     def writeArithmetic(self, command):
         """
@@ -54,27 +64,27 @@ class VMWriter:
             print("DEBUG(VMWriter): arithmetic {}".format(command))
 
         if command == "+":
-            self.file.write("add\n")
+            self.write("add")
         elif command == "-":
-            self.file.write("sub\n")
+            self.write("sub")
         elif command == "*":
             self.writeCall("Math.multiply", 2)
         elif command == "/":
             self.writeCall("Math.divide", 2)
         elif command == "&":
-            self.file.write("and\n")
+            self.write("and")
         elif command == "|":
-            self.file.write("or\n")
+            self.write("or")
         elif command == "<":
-            self.file.write("lt\n")
+            self.write("lt")
         elif command == ">":
-            self.file.write("gt\n")
+            self.write("gt")
         elif command == "=":
-            self.file.write("eq\n")
+            self.write("eq")
         elif command == "U-":
-            self.file.write("neg\n")
+            self.write("neg")
         elif command == "U~":
-            self.file.write("not\n")
+            self.write("not")
         else:
             raise NotImplementedError("Unrecognized arithmetic operator: " + command)
 
@@ -84,7 +94,7 @@ class VMWriter:
         """
         if self.DEBUG:
             print("DEBUG(VMWriter): label {}".format(label))
-        self.file.write("label {}\n".format(label))
+        self.write("label {}".format(label))
 
     def writeGoto(self, label):
         """
@@ -92,7 +102,7 @@ class VMWriter:
         """
         if self.DEBUG:
             print("DEBUG(VMWriter): goto {}".format(label))
-        self.file.write("goto {}\n".format(label))
+        self.write("goto {}".format(label))
 
     def writeIf(self, label):
         """
@@ -100,7 +110,7 @@ class VMWriter:
         """
         if self.DEBUG:
             print("DEBUG(VMWriter): if {}".format(label))
-        self.file.write("if-goto {}\n".format(label))
+        self.write("if-goto {}".format(label))
 
     def writeCall(self, name, nArgs):
         """
@@ -108,7 +118,7 @@ class VMWriter:
         """
         if self.DEBUG:
             print("DEBUG(VMWriter): call {} {}".format(name, nArgs))
-        self.file.write("call {} {}\n".format(name, nArgs))
+        self.write("call {} {}".format(name, nArgs))
 
     def writeFunction(self, name, nLocals):
         """
@@ -116,7 +126,7 @@ class VMWriter:
         """
         if self.DEBUG:
             print("DEBUG(VMWriter): function {} {}".format(name, nLocals))
-        self.file.write("function {} {}\n".format(name, nLocals))
+        self.write("function {} {}".format(name, nLocals))
 
     def writeReturn(self):
         """
@@ -124,7 +134,7 @@ class VMWriter:
         """
         if self.DEBUG:
             print("DEBUG(VMWriter): return")
-        self.file.write("return\n")
+        self.write("return")
 
     def close(self):
         """